@@ -1,15 +1,30 @@
 from django.contrib import admin, messages
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
-from django.db.models import Count, Sum, F, Value, DecimalField
+from django.db.models import Count, Sum, F, Value, DecimalField, Exists, OuterRef, Subquery
 from django.db.models.functions import TruncMonth, Coalesce
 from datetime import datetime, date, timedelta
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseBadRequest, Http404
+from django.core.files.storage import default_storage
+from django.utils.dateparse import parse_date
 import logging
+from io import BytesIO
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
-from .models import Paiement, Contribuable, HistoriqueModification
+from .models import (
+    Paiement, Contribuable, HistoriqueModification, NotificationSortante, Relance,
+    quittance_a_la_demande, TYPE_CONTRIBUABLE_CHOICES,
+)
+from .quittances import lancer_quittances_en_masse, suivi_quittances
+from .recettes import recettes, agreger_recettes, mensuel_recettes
+from .tableau_de_bord import donnees_tableau_de_bord
+from .fusion_pdf import FusionPDF
+from .pagination import EstimatedCountPaginator
+from .recherche import rechercher_contribuables
+from .suppression import supprimer_contribuables
+from .notifications import notifier_retards as mettre_retards_en_file
+from .export import COLONNES_CONTRIBUABLE, COLONNES_PAIEMENT, reponse_csv, reponse_xlsx
 from geolocalisation.models import Zone, LocalisationContribuable
 from django.apps import apps
 from django.templatetags.static import static
@@ -24,6 +39,7 @@ import json
 from django.db.models import Sum
 from django.db.models.functions import TruncMonth, Coalesce
 from django.contrib.admin.actions import delete_selected
+from django.contrib.admin import helpers
 
 def _get_last_12_months_payments():
     now = timezone.now()
@@ -41,22 +57,8 @@ def _get_last_12_months_payments():
     forced_start = date(2025, 1, 1)
     start = forced_start if forced_start > base_start else base_start
 
-    qs = (
-        Paiement.objects
-        .filter(date_paiement__gte=start)
-        .annotate(mois=TruncMonth('date_paiement'))
-        .values('mois')
-        .annotate(total=Coalesce(Sum('montant'), Value(0), output_field=DecimalField()))
-        .order_by('mois')
-    )
-    # map mois -> montant
-    month_map = {}
-    for item in qs:
-        m = item['mois']
-        if hasattr(m, 'date'):
-            m = m.date()
-        key = datetime(m.year, m.month, 1).date()
-        month_map[key] = int(item['total'])
+    # map mois -> montant (table de cumul : une ligne par mois et par axe)
+    month_map = {mois: int(item['montant']) for mois, item in mensuel_recettes(recettes(debut=start)).items()}
     labels = []
     data = []
     # construire 12 mois à partir de start (ou moins si vous préférez)
@@ -67,6 +69,103 @@ def _get_last_12_months_payments():
         dt = shift_month_date(dt, 1)
     return labels, data
 
+def _ensure_quittance_pdf(paiement):
+    """Génère la quittance si besoin (première consultation). Retourne (ok, nom ou erreur)."""
+    try:
+        return True, paiement.assurer_quittance()
+    except Exception as e:
+        logging.getLogger(__name__).exception("Erreur génération PDF pour %s", paiement.pk)
+        return False, str(e)
+
+def _page_echecs(echecs):
+    """Page(s) PDF listant les quittances absentes de l'impression groupée."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    tampon = BytesIO()
+    toile = canvas.Canvas(tampon, pagesize=A4)
+    largeur, hauteur = A4
+    lignes = [f"{reference} — {contribuable} : {raison}" for reference, contribuable, raison in echecs]
+    while lignes:
+        toile.setFont('Helvetica-Bold', 14)
+        toile.drawString(40, hauteur - 50, f"{len(echecs)} quittance(s) non incluse(s) dans ce document")
+        toile.setFont('Helvetica', 9)
+        y = hauteur - 80
+        while lignes and y > 40:
+            toile.drawString(40, y, lignes.pop(0)[:130])
+            y -= 14
+        toile.showPage()
+    toile.save()
+    return tampon.getvalue()
+
+def _flux_quittances(paiements):
+    """
+    Fusionne les quittances au fil de l'eau : mémoire constante, même pour des milliers.
+    Les quittances impossibles à produire ou à lire sont listées sur une dernière page.
+    """
+    logger = logging.getLogger(__name__)
+    fusion = FusionPDF()
+    echecs = []
+    yield fusion.debut()
+    for paiement in paiements.iterator(chunk_size=200):
+        ok, nom = _ensure_quittance_pdf(paiement)
+        if not ok:
+            echecs.append((paiement.reference, paiement.contribuable.nom, "génération impossible"))
+            continue
+        try:
+            with default_storage.open(nom, 'rb') as f:
+                pdf = f.read()
+            morceau = fusion.ajouter(pdf)
+        except Exception:
+            logger.warning("Quittance illisible pour le paiement %s (%s)", paiement.pk, nom, exc_info=True)
+            echecs.append((paiement.reference, paiement.contribuable.nom, "fichier illisible"))
+            continue
+        yield morceau
+    if echecs:
+        logger.warning("Impression groupée : %d quittance(s) non incluse(s)", len(echecs))
+        yield fusion.ajouter(_page_echecs(echecs))
+    yield fusion.fin()
+
+def _reponse_lot_quittances(paiements, nom_fichier):
+    paiements = paiements.select_related('contribuable').order_by('date_paiement', 'pk')
+    response = StreamingHttpResponse(_flux_quittances(paiements), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{nom_fichier}"'
+    return response
+
+def csv_export_selected(modeladmin, request, queryset):
+    """Export CSV / XLSX : choix des colonnes, puis lignes envoyées en flux (export.py)."""
+    colonnes = modeladmin.colonnes_export
+    if request.POST.get('post'):
+        choisis = set(request.POST.getlist('_fields'))
+        colonnes = [c for c in colonnes if c[0] in choisis] or colonnes
+        nom = f"{modeladmin.model._meta.model_name}s_{timezone.localtime():%Y%m%d_%H%M}"
+        if request.POST.get('format') == 'xlsx':
+            try:
+                return reponse_xlsx(queryset, colonnes, nom)
+            except ImportError:
+                modeladmin.message_user(request, "openpyxl n'est pas installé : export XLSX indisponible", messages.ERROR)
+                return None
+        return reponse_csv(queryset, colonnes, nom)
+
+    # « tout sélectionner » : on renvoie select_across plutôt qu'un champ caché par ligne,
+    # avec la sélection de la page (l'admin n'exécute pas une action sans _selected_action)
+    select_across = request.POST.get('select_across') == '1'
+    return TemplateResponse(request, 'admin/csv_export_selected_confirmation.html', {
+        **modeladmin.admin_site.each_context(request),
+        'title': "Exporter la sélection",
+        'opts': modeladmin.model._meta,
+        'app_label': modeladmin.model._meta.app_label,
+        'fields': colonnes,
+        'list_display': [champ for champ, _ in colonnes],
+        'select_across': select_across,
+        'queryset': (
+            request.POST.getlist(helpers.ACTION_CHECKBOX_NAME) if select_across
+            else queryset.values_list('pk', flat=True)
+        ),
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    })
+csv_export_selected.short_description = "Exporter la sélection (CSV / XLSX)"
+
 def _first_field_name(model, candidates, default=None):
     names = {f.name for f in model._meta.get_fields() if hasattr(f, 'name')}
     for c in candidates:
@@ -93,23 +192,8 @@ class CustomAdminSite(admin.AdminSite):
     def has_permission(self, request):
         return request.user.is_active and request.user.is_staff
 
-    def index(self, request, extra_context=None):
-        # Contexte de base
-        # sécuriser la récupération de la liste d'applications (reverse peut échouer si certains admin ne sont pas enregistrés)
-        try:
-            app_list = self.get_app_list(request)
-        except Exception as e:
-            logging.getLogger(__name__).warning("get_app_list failed in admin.index: %s", e)
-            app_list = []
-
-        context = {
-            **super().each_context(request),
-            'title': self.index_title,
-            'subtitle': None,
-            'app_list': app_list,
-            'available_apps': app_list,
-        }
-        
+    def _donnees_index(self):
+        """Données du tableau de bord (indépendantes de la requête, donc partageables en cache)."""
         # Statistiques
         stats = {
             'total_contribuables': Contribuable.objects.count(),
@@ -117,16 +201,15 @@ class CustomAdminSite(admin.AdminSite):
             'paiements_mois': Paiement.objects.filter(
                 date_paiement__gte=timezone.now() - timedelta(days=30)
             ).aggregate(total=Sum('montant'))['total'] or 0,
-            'retards': Paiement.objects.filter(date_paiement__gt=F('date_echeance')).count(),
+            'retards': agreger_recettes(recettes())['nombre_en_retard'],
             'show_stats_dashboard': True
         }
 
-        # Données pour les graphiques
-        paiements_par_mois = list(Paiement.objects.annotate(
-            mois=TruncMonth('date_paiement')
-        ).values('mois').annotate(
-            total=Sum('montant')
-        ).order_by('mois'))
+        # Données pour les graphiques (lues dans la table de cumul mensuelle)
+        paiements_par_mois = [
+            {'mois': mois, 'total': item['montant']}
+            for mois, item in sorted(mensuel_recettes(recettes()).items())
+        ]
 
         types_contribuables = list(Contribuable.objects.values(
             'type_contribuable'
@@ -147,8 +230,7 @@ class CustomAdminSite(admin.AdminSite):
         ]
         total_zones = Zone.objects.count()
 
-        # Mise à jour du contexte
-        context.update({
+        return {
             'stats': stats,
             'paiements_data': json.dumps([{
                 'mois': item['mois'].strftime('%Y-%m') if item['mois'] else None,
@@ -162,15 +244,35 @@ class CustomAdminSite(admin.AdminSite):
                 'zone': item['nom'],
                 'count': item['count']
             } for item in zones_stats]),
-            'extra_js': [
-                'https://cdn.jsdelivr.net/npm/chart.js@3.7.1/dist/chart.min.js',
-                static('js/admin_dashboard_charts.js'),
-                'https://unpkg.com/leaflet/dist/leaflet.js',
-            ],
             'types_contribuables': types_contribuables,
             'zones_stats': list(zones_stats),
             'total_zones': total_zones,
-        })
+        }
+
+    def index(self, request, extra_context=None):
+        # Contexte de base
+        # sécuriser la récupération de la liste d'applications (reverse peut échouer si certains admin ne sont pas enregistrés)
+        try:
+            app_list = self.get_app_list(request)
+        except Exception as e:
+            logging.getLogger(__name__).warning("get_app_list failed in admin.index: %s", e)
+            app_list = []
+
+        context = {
+            **super().each_context(request),
+            'title': self.index_title,
+            'subtitle': None,
+            'app_list': app_list,
+            'available_apps': app_list,
+        }
+        
+        # Statistiques et graphiques : recalculés seulement après une écriture (voir tableau_de_bord.py)
+        context.update(donnees_tableau_de_bord('index', self._donnees_index))
+        context['extra_js'] = [
+            'https://cdn.jsdelivr.net/npm/chart.js@3.7.1/dist/chart.min.js',
+            static('js/admin_dashboard_charts.js'),
+            'https://unpkg.com/leaflet/dist/leaflet.js',
+        ]
 
         if extra_context:
             context.update(extra_context)
@@ -207,6 +309,33 @@ class PaiementInline(admin.TabularInline):
     extra = 1
     can_delete = False
 
+class PaiementsEnRetardFilter(admin.SimpleListFilter):
+    title = "Paiements en retard"
+    parameter_name = "en_retard"
+
+    def lookups(self, request, model_admin):
+        return [('oui', "Oui"), ('non', "Non")]
+
+    def queryset(self, request, queryset):
+        # en_retard est annoté par ContribuableAdmin.get_queryset
+        if self.value() == 'oui':
+            return queryset.filter(en_retard=True)
+        if self.value() == 'non':
+            return queryset.filter(en_retard=False)
+        return queryset
+
+
+def _nombre_par_contribuable(modele):
+    """Sous-requête corrélée : nombre de lignes de `modele` du contribuable courant (0 si aucune)."""
+    return Coalesce(
+        Subquery(
+            modele.objects.filter(contribuable=OuterRef('pk')).order_by()
+            .values('contribuable').annotate(n=Count('pk')).values('n')
+        ),
+        0,
+    )
+
+
 @admin.register(Contribuable, site=admin_site)
 class ContribuableAdmin(admin.ModelAdmin):
     list_display = (
@@ -215,7 +344,10 @@ class ContribuableAdmin(admin.ModelAdmin):
         'has_paiements_retard'
     )
     # Ajout du filtre Type de contribuable (et utile : actif)
-    list_filter = ('type_contribuable', 'actif')
+    list_filter = ('type_contribuable', 'actif', PaiementsEnRetardFilter)
+    # COUNT estimé sans filtre, saut par clé de tri sur les pages profondes
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = ('nif', 'nom', 'telephone', 'email', 'reference')
     readonly_fields = (
         'date_inscription', 'date_modification', 'total_paye', 
@@ -243,7 +375,8 @@ class ContribuableAdmin(admin.ModelAdmin):
         })
     )
     # Utiliser l'action standard de suppression
-    actions = ['generer_quittances', 'notifier_retards', 'delete_selected']
+    actions = ['generer_quittances', 'notifier_retards', csv_export_selected, 'delete_selected']
+    colonnes_export = COLONNES_CONTRIBUABLE
     inlines = [PaiementInline]
 
     def get_inline_instances(self, request, obj=None):
@@ -255,34 +388,106 @@ class ContribuableAdmin(admin.ModelAdmin):
         return f"{obj.total_paye:,} FCFA"
     total_paye_display.short_description = "Total payé"
 
+    def get_queryset(self, request):
+        # compteurs en sous-requêtes dans la requête de la liste : pas de requête par ligne.
+        # L'historique n'est affiché que sur la fiche : compté là, une fois (lien_historique)
+        return super().get_queryset(request).annotate(
+            nb_paiements=_nombre_par_contribuable(Paiement),
+            en_retard=Exists(
+                Paiement.objects.filter(contribuable=OuterRef('pk'), date_paiement__gt=F('date_echeance'))
+            ),
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # index trigrammes et tri par pertinence (recherche.py) au lieu de icontains sur chaque champ
+        if not search_term.strip():
+            return queryset, False
+        return rechercher_contribuables(queryset, search_term), False
+
+    def get_ordering(self, request):
+        # tri par pertinence pendant une recherche, sauf si une colonne a été choisie
+        if request.GET.get('q', '').strip() and not request.GET.get('o'):
+            return ['-pertinence', 'nom']
+        return super().get_ordering(request)
+
     def has_paiements_retard(self, obj):
-        return obj.a_des_retards
+        en_retard = getattr(obj, 'en_retard', None)
+        return obj.a_des_retards if en_retard is None else en_retard
     has_paiements_retard.boolean = True
-   
+    has_paiements_retard.short_description = "Retards"
+    has_paiements_retard.admin_order_field = 'en_retard'
+
     def lien_paiements(self, obj):
-        count = obj.paiements.count()
+        count = getattr(obj, 'nb_paiements', None)
+        if count is None:
+            count = obj.paiements.count()
         url = reverse("admin:gestion_contribuables_paiement_changelist") + f"?contribuable__id__exact={obj.id}"
         return format_html('<a href="{}">{} Paiements</a>', url, count)
     lien_paiements.short_description = "Paiements"
+    lien_paiements.admin_order_field = 'nb_paiements'
 
     def lien_historique(self, obj):
-        count = obj.historique.count()
+        count = getattr(obj, 'nb_historique', None)
+        if count is None:
+            count = obj.historique.count()
         url = reverse("admin:gestion_contribuables_historiquemodification_changelist") + f"?contribuable__id__exact={obj.id}"
         return format_html('<a href="{}">{} Modifications</a>', url, count)
     lien_historique.short_description = "Historique"
 
     def generer_quittances(self, request, queryset):
-        for contribuable in queryset:
-            for paiement in contribuable.paiements.filter(quittance_generee=False):
-                paiement.generer_quittance()
-        self.message_user(request, f"Quittances générées pour {queryset.count()} contribuables")
+        # rendu hors du processus web : lots Celery, sinon commande generer_quittances
+        suivi, nb, sans_file = lancer_quittances_en_masse(Paiement.objects.filter(contribuable__in=queryset))
+        if sans_file:
+            self.message_user(
+                request,
+                f"{sans_file} quittance(s) non planifiée(s) : aucune file de tâches disponible. "
+                "Lancer « python manage.py generer_quittances » sur le serveur.",
+                level='WARNING',
+            )
+        if not suivi:
+            if not sans_file:
+                self.message_user(request, "Aucune quittance manquante pour ces contribuables")
+            return None
+        self.message_user(
+            request,
+            f"{nb} quittance(s) manquante(s) en cours de génération pour {queryset.count()} contribuables"
+        )
+        return redirect('admin:gestion_contribuables_contribuable_suivi_quittances', suivi)
     generer_quittances.short_description = "Générer les quittances manquantes"
 
+    def get_urls(self):
+        urls = super().get_urls()
+        custom = [
+            path(
+                'suivi-quittances/<str:suivi>/',
+                self.admin_site.admin_view(self.suivi_quittances_view),
+                name='gestion_contribuables_contribuable_suivi_quittances'
+            ),
+        ]
+        return custom + urls
+
+    def suivi_quittances_view(self, request, suivi, *args, **kwargs):
+        """Avancement de « Générer les quittances manquantes » (page, ou JSON avec ?format=json)."""
+        avancement = suivi_quittances(suivi)
+        if avancement is None:
+            raise Http404("Suivi de génération inconnu ou expiré")
+        if request.GET.get('format') == 'json':
+            return JsonResponse(avancement)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Génération des quittances',
+            'avancement': avancement,
+            'avancement_json': json.dumps(avancement),
+            'statut_url': request.path + '?format=json',
+            'liste_url': reverse('admin:gestion_contribuables_contribuable_changelist'),
+            'opts': self.model._meta,
+        }
+        return TemplateResponse(request, 'admin/quittances_suivi.html', context)
+
     def notifier_retards(self, request, queryset):
-        for contribuable in queryset.filter(notifier_retards=True):
-            for paiement in contribuable.paiements_en_retard:
-                paiement.notifier_retard()
-        self.message_user(request, f"Notifications envoyées pour {queryset.count()} contribuables")
+        # une requête pour toute la sélection ; l'envoi se fait hors requête (boîte d'envoi)
+        nb = mettre_retards_en_file(Paiement.objects.filter(contribuable__in=queryset))
+        self.message_user(request, f"{nb} mise(s) en demeure mise(s) en file pour {queryset.count()} contribuables")
     notifier_retards.short_description = "Notifier les retards"
 
     def voir_fiche_link(self, obj):
@@ -350,18 +555,12 @@ class ContribuableAdmin(admin.ModelAdmin):
         return actions
 
     def delete_selected(self, request, queryset):
-        """Action personnalisée avec logs"""
+        """Suppression ensembliste (suppression.py) : dépendances par lots, fichiers nettoyés en tâche de fond"""
         try:
-            count = queryset.count()
-            logging.info(f"Tentative de suppression de {count} contribuables")
-            
-            for obj in queryset:
-                logging.info(f"Suppression du contribuable: {obj.nom} (ID: {obj.id})")
-                obj.delete()
-                
-            self.message_user(request, f"{count} contribuable(s) supprimé(s) avec succès.")
-            logging.info(f"Suppression réussie de {count} contribuables")
-            
+            compteurs = supprimer_contribuables(queryset, utilisateur=request.user)
+            count = compteurs.get(Contribuable._meta.label, 0)
+            nb_paiements = compteurs.get(Paiement._meta.label, 0)
+            self.message_user(request, f"{count} contribuable(s) supprimé(s) avec succès ({nb_paiements} paiement(s)).")
         except Exception as e:
             logging.error(f"Erreur lors de la suppression: {str(e)}")
             self.message_user(request, f"Erreur lors de la suppression: {str(e)}", level='ERROR')
@@ -382,8 +581,8 @@ class TypeContribuableFilter(admin.SimpleListFilter):
     parameter_name = "type_contribuable"
 
     def lookups(self, request, model_admin):
-        qs = Contribuable.objects.order_by('type_contribuable').values_list('type_contribuable', flat=True).distinct()
-        return [(v, v) for v in qs if v is not None]
+        # valeurs fixes : pas de DISTINCT sur tous les contribuables à chaque affichage
+        return TYPE_CONTRIBUABLE_CHOICES
 
     def queryset(self, request, queryset):
         if self.value():
@@ -396,10 +595,10 @@ class PaiementAdmin(admin.ModelAdmin):
     fields = (
         'contribuable', 'montant', 'taxe_redevance', 'date_echeance',
         'date_paiement', 'mode_paiement', 'agent', 'notes',
-        'reference', 'fichier_quittance'
+        'reference', 'fichier_quittance', 'statut_quittance'
     )
     readonly_fields = (
-        'montant', 'taxe_redevance', 'reference', 'fichier_quittance'
+        'montant', 'taxe_redevance', 'reference', 'fichier_quittance', 'statut_quittance'
     )
     list_display = (
         'contribuable',
@@ -414,6 +613,12 @@ class PaiementAdmin(admin.ModelAdmin):
     search_fields = ('reference', 'contribuable__nom', 'contribuable__nif')
     # Permet de filtrer par mode, taxe/redevance et aussi par type du contribuable lié
     list_filter = ('mode_paiement', 'taxe_redevance', TypeContribuableFilter)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # __str__, type et référence lisent le contribuable : une jointure au lieu d'une requête par ligne
+    list_select_related = ('contribuable',)
+    actions = ['imprimer_quittances', csv_export_selected, 'delete_selected']
+    colonnes_export = COLONNES_PAIEMENT
 
     def get_type_contribuable(self, obj):
         return obj.contribuable.type_contribuable if obj.contribuable else "-"
@@ -467,9 +672,56 @@ class PaiementAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.send_quittance_view),
                 name='gestion_contribuables_paiement_send_whatsapp'
             ),
+            path(
+                'imprimer-lot/',
+                self.admin_site.admin_view(self.imprimer_lot_view),
+                name='gestion_contribuables_paiement_imprimer_lot'
+            ),
+            path(
+                'statut-quittance/<int:pk>/',
+                self.admin_site.admin_view(self.quittance_statut_view),
+                name='gestion_contribuables_paiement_statut_quittance'
+            ),
         ]
         return custom + urls
 
+    def imprimer_quittances(self, request, queryset):
+        return _reponse_lot_quittances(queryset, "quittances_selection.pdf")
+    imprimer_quittances.short_description = "Imprimer les quittances sélectionnées (un seul PDF)"
+
+    def imprimer_lot_view(self, request, *args, **kwargs):
+        """
+        Quittances d'une journée en un seul PDF.
+        Filtres GET : date=AAAA-MM-JJ (défaut : aujourd'hui) ou debut/fin, agent=<id>, zone=<id>.
+        """
+        if not self.has_view_permission(request):
+            return JsonResponse({'ok': False, 'msg': 'Permission refusée.'}, status=403)
+
+        try:
+            jour = parse_date(request.GET.get('date', ''))
+            debut = parse_date(request.GET.get('debut', ''))
+            fin = parse_date(request.GET.get('fin', ''))
+        except ValueError:
+            return HttpResponseBadRequest("Date invalide")
+
+        paiements = Paiement.objects.all()
+        if debut or fin:
+            if debut:
+                paiements = paiements.filter(date_paiement__gte=debut)
+            if fin:
+                paiements = paiements.filter(date_paiement__lte=fin)
+            libelle = f"{debut or ''}_{fin or ''}"
+        else:
+            jour = jour or timezone.localdate()
+            paiements = paiements.filter(date_paiement=jour)
+            libelle = jour.isoformat()
+        if request.GET.get('agent', '').isdigit():
+            paiements = paiements.filter(agent_id=request.GET['agent'])
+        if request.GET.get('zone', '').isdigit():
+            paiements = paiements.filter(contribuable__localisation__zone_id=request.GET['zone'])
+
+        return _reponse_lot_quittances(paiements, f"quittances_{libelle}.pdf")
+
     def imprimer_quittance(self, obj):
         """Ouvre la preview (Imprimer + Partager)."""
         if obj and obj.pk:
@@ -498,6 +750,12 @@ class PaiementAdmin(admin.ModelAdmin):
 
         obj = get_object_or_404(Paiement, pk=pk)
 
+        # quittance encore en file côté worker : page d'attente qui interroge le statut
+        if not obj.quittance_prete and not quittance_a_la_demande():
+            attente = self._attente_quittance(request, obj)
+            if attente is not None:
+                return attente
+
         # génération PDF si nécessaire (si vous avez _ensure_quittance_pdf)
         try:
             ok_pdf = True
@@ -531,6 +789,34 @@ class PaiementAdmin(admin.ModelAdmin):
         }
         return TemplateResponse(request, 'admin/quittance_preview.html', context)
 
+    def _attente_quittance(self, request, obj):
+        """Page d'attente tant que le worker n'a pas produit le PDF (None si le PDF est prêt)."""
+        delai = getattr(settings, 'QUITTANCE_DELAI_ATTENTE', 60)
+        en_souffrance = obj.date_creation < timezone.now() - timedelta(seconds=delai)
+        if obj.statut_quittance == Paiement.QUITTANCE_ERREUR or en_souffrance:
+            # worker absent ou en échec : générer ici plutôt que de faire attendre indéfiniment
+            try:
+                obj.assurer_quittance()
+                return None
+            except Exception as e:
+                logging.getLogger(__name__).exception("Erreur génération PDF: %s", e)
+                self.message_user(request, "Erreur génération PDF", level=admin.messages.ERROR)
+                return redirect(request.META.get('HTTP_REFERER', '..'))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Quittance en préparation',
+            'paiement': obj,
+            'statut_url': reverse('admin:gestion_contribuables_paiement_statut_quittance', args=[obj.pk]),
+            'opts': self.model._meta,
+        }
+        return TemplateResponse(request, 'admin/quittance_attente.html', context)
+
+    def quittance_statut_view(self, request, pk, *args, **kwargs):
+        """Statut de génération (JSON) interrogé par la page d'attente."""
+        obj = get_object_or_404(Paiement.objects.only('statut_quittance', 'fichier_quittance'), pk=pk)
+        return JsonResponse({'statut': obj.statut_quittance, 'pret': obj.quittance_prete})
+
     def send_quittance_view(self, request, pk, *args, **kwargs):
         """Vue admin : envoie la quittance via WhatsApp. Toujours renvoie JSON en cas d'erreur."""
         try:
@@ -552,9 +838,10 @@ class PaiementAdmin(admin.ModelAdmin):
                 if not ok_pdf:
                     return JsonResponse({'ok': False, 'msg': f"Erreur génération PDF: {pdf_res}"}, status=500)
 
-            file_field = obj.fichier_quittance
-            name = getattr(file_field, 'name', None)
-            if not name or not default_storage.exists(name):
+            # l'empreinte n'est enregistrée qu'une fois le fichier écrit : pas de stat disque
+            # (sauf anciens fichiers pas encore passés par migrer_quittances)
+            name = getattr(obj.fichier_quittance, 'name', None)
+            if not name or (not obj.quittance_sha256 and not default_storage.exists(name)):
                 return JsonResponse({'ok': False, 'msg': f"Fichier introuvable ({name})"}, status=500)
 
             # appel à la fonction d'envoi existante
@@ -588,6 +875,8 @@ class HistoriqueModificationAdmin(admin.ModelAdmin):
         'utilisateur_display', 'champs_modifies'
     )
     list_filter = ('action', 'utilisateur')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = ('contribuable__nif', 'contribuable__nom', 'utilisateur__username')
     readonly_fields = (
         'contribuable_link', 'action', 'date_modification', 
@@ -631,6 +920,46 @@ class HistoriqueModificationAdmin(admin.ModelAdmin):
             actions['delete_selected'] = self.get_action('delete_selected')
         return actions
 
+@admin.register(NotificationSortante, site=admin_site)
+class NotificationSortanteAdmin(admin.ModelAdmin):
+    list_display = ('type_notification', 'contribuable', 'destinataire', 'statut', 'tentatives', 'prochain_essai', 'date_envoi')
+    list_filter = ('statut', 'type_notification')
+    list_select_related = ('contribuable',)
+    search_fields = ('destinataire', 'contribuable__nom', 'contribuable__nif')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [f.name for f in NotificationSortante._meta.fields]
+    actions = ['renvoyer']
+
+    def renvoyer(self, request, queryset):
+        nb = queryset.exclude(statut=NotificationSortante.ENVOYEE).update(
+            statut=NotificationSortante.EN_ATTENTE, tentatives=0, prochain_essai=timezone.now()
+        )
+        self.message_user(request, f"{nb} notification(s) remise(s) en file")
+    renvoyer.short_description = "Remettre en file (non envoyées)"
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Relance, site=admin_site)
+class RelanceAdmin(admin.ModelAdmin):
+    list_display = ('contribuable', 'niveau', 'date_echeance', 'montant_du', 'date_relance', 'statut_envoi')
+    list_filter = ('niveau', 'date_relance')
+    list_select_related = ('contribuable', 'notification')
+    search_fields = ('contribuable__nom', 'contribuable__nif', 'contribuable__reference')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [f.name for f in Relance._meta.fields]
+
+    def statut_envoi(self, obj):
+        return obj.notification.get_statut_display() if obj.notification else "-"
+    statut_envoi.short_description = "Envoi"
+
+    def has_add_permission(self, request):
+        return False
+
+
 # Remplacement du site admin par défaut
 admin.site = admin_site
 admin.sites.site = admin_site
@@ -640,6 +969,11 @@ _orig_admin_index = admin.site.index
 
 def _index_with_30d_stats(request, extra_context=None):
     extra_context = extra_context or {}
+    stats = {**extra_context.get('stats', {}), **donnees_tableau_de_bord('index_30j', _stats_30j)}
+    extra_context['stats'] = stats
+    return _orig_admin_index(request, extra_context=extra_context)
+
+def _stats_30j():
     now = timezone.now()
     since = now - timedelta(days=30)
 
@@ -648,34 +982,13 @@ def _index_with_30d_stats(request, extra_context=None):
         total=Coalesce(Sum('montant'), Value(0), output_field=DecimalField())
     )['total'] or 0
 
-    # total global
-    total_global = Paiement.objects.aggregate(
-        total=Coalesce(Sum('montant'), Value(0), output_field=DecimalField())
-    )['total'] or 0
+    # total global (table de cumul)
+    total_global = agreger_recettes(recettes())['montant']
 
     # nombre de contribuables
     total_contribuables = Contribuable.objects.count()
 
     # --- statistiques mensuelles (derniers 12 mois) ---
-    since_year = now - timedelta(days=365)
-    qs = (
-        Paiement.objects
-        .filter(date_paiement__gte=since_year)
-        .annotate(month=TruncMonth('date_paiement'))
-        .values('month')
-        .annotate(total=Coalesce(Sum('montant'), Value(0), output_field=DecimalField()))
-        .order_by('month')
-    )
-
-    # normaliser résultats en dict {date(YYYY,MM,1): total}
-    month_map = {}
-    for item in qs:
-        m = item['month']
-        if hasattr(m, 'date'):
-            m = m.date()
-        month_key = datetime(m.year, m.month, 1).date()
-        month_map[month_key] = int(item['total'])
-
     # start candidate (12 mois glissants)
     base_start = datetime(now.year, now.month, 1).date()
     def shift_month_date(d, months):
@@ -689,6 +1002,9 @@ def _index_with_30d_stats(request, extra_context=None):
     forced_start = date(2025, 1, 1)
     start = forced_start if forced_start > base_start else base_start
 
+    # dict {date(YYYY,MM,1): total}
+    month_map = {mois: int(item['montant']) for mois, item in mensuel_recettes(recettes(debut=start)).items()}
+
     # construire labels/data à partir de start (12 mois)
     labels = []
     data = []
@@ -698,17 +1014,14 @@ def _index_with_30d_stats(request, extra_context=None):
         data.append(month_map.get(dt, 0))
         dt = shift_month_date(dt, 1)
 
-    stats = extra_context.get('stats', {})
-    stats.update({
+    return {
         'show_stats_dashboard': True,
         'paiements_mois': int(total_30j),
         'paiements_total': int(total_global),
         'total_contribuables': int(total_contribuables),
         'months_labels_json': json.dumps(labels),
         'months_data_json': json.dumps(data),
-    })
-    extra_context['stats'] = stats
-    return _orig_admin_index(request, extra_context=extra_context)
+    }
 
 admin.site.index = _index_with_30d_stats
 
@@ -0,0 +1,123 @@
+# gestion_contribuables/export.py
+"""
+Export CSV / XLSX des contribuables et des paiements (action admin csv_export_selected).
+
+Mémoire constante quel que soit le volume :
+- lecture par values_list().iterator(chunk_size) : curseur côté serveur
+  PostgreSQL, jamais d'instances de modèles ni de liste complète ;
+- CSV : envoyé au fil de l'eau (StreamingHttpResponse), par paquets de lignes ;
+- XLSX : classeur openpyxl en write_only (les lignes partent dans des fichiers
+  temporaires), puis le fichier .xlsx est envoyé par morceaux (FileResponse).
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+TAILLE_LOT = 2000
+LIGNES_PAR_ENVOI = 500
+
+COLONNES_CONTRIBUABLE = [
+    ('reference', "Référence"),
+    ('nif', "NIF"),
+    ('nom', "Nom"),
+    ('type_contribuable', "Type"),
+    ('telephone', "Téléphone"),
+    ('email', "Email"),
+    ('adresse', "Adresse"),
+    ('actif', "Actif"),
+    ('taxe_redevance', "Taxe/Redevance"),
+    ('montant_a_payer', "Montant à payer"),
+    ('date_echeance', "Échéance"),
+    ('total_paye', "Total payé"),
+    ('date_inscription', "Inscription"),
+]
+
+COLONNES_PAIEMENT = [
+    ('reference', "Référence"),
+    ('contribuable__nif', "NIF"),
+    ('contribuable__nom', "Contribuable"),
+    ('contribuable__type_contribuable', "Type de contribuable"),
+    ('taxe_redevance', "Taxe/Redevance"),
+    ('montant', "Montant"),
+    ('date_paiement', "Date de paiement"),
+    ('date_echeance', "Échéance"),
+    ('mode_paiement', "Mode"),
+    ('agent__username', "Agent"),
+    ('statut_quittance', "Quittance"),
+]
+
+
+def _champ(modele, chemin):
+    champ = None
+    for nom in chemin.split('__'):
+        champ = modele._meta.get_field(nom)
+        if champ.is_relation:
+            modele = champ.related_model
+    return champ
+
+
+def _conversions(modele, champs):
+    """Par colonne : dict des libellés de choix (ou None), pour un export lisible."""
+    return [dict(_champ(modele, chemin).flatchoices) or None for chemin in champs]
+
+
+def lignes(queryset, champs):
+    """Tuples de valeurs, libellés de choix substitués, lus par lots côté serveur."""
+    conversions = _conversions(queryset.model, champs)
+    for ligne in queryset.order_by('pk').values_list(*champs).iterator(chunk_size=TAILLE_LOT):
+        yield [
+            conv.get(valeur, valeur) if conv else valeur
+            for conv, valeur in zip(conversions, ligne)
+        ]
+
+
+def reponse_csv(queryset, colonnes, nom_fichier):
+    champs = [champ for champ, _ in colonnes]
+
+    def flux():
+        tampon = io.StringIO()
+        ecrivain = csv.writer(tampon, delimiter=';')
+        # BOM : Excel ouvre le fichier en UTF-8 (accents)
+        tampon.write('\ufeff')
+        ecrivain.writerow([libelle for _, libelle in colonnes])
+        for i, ligne in enumerate(lignes(queryset, champs), 1):
+            ecrivain.writerow(ligne)
+            if i % LIGNES_PAR_ENVOI == 0:
+                yield tampon.getvalue()
+                tampon.seek(0)
+                tampon.truncate()
+        yield tampon.getvalue()
+
+    response = StreamingHttpResponse(flux(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nom_fichier}.csv"'
+    return response
+
+
+def _valeur_excel(valeur):
+    # Excel ne gère pas les fuseaux horaires
+    if isinstance(valeur, datetime) and timezone.is_aware(valeur):
+        return timezone.localtime(valeur).replace(tzinfo=None)
+    return valeur
+
+
+def reponse_xlsx(queryset, colonnes, nom_fichier):
+    from openpyxl import Workbook
+
+    champs = [champ for champ, _ in colonnes]
+    classeur = Workbook(write_only=True)
+    feuille = classeur.create_sheet(title=nom_fichier[:31])
+    feuille.append([libelle for _, libelle in colonnes])
+    for ligne in lignes(queryset, champs):
+        feuille.append([_valeur_excel(v) for v in ligne])
+
+    fichier = tempfile.TemporaryFile()
+    classeur.save(fichier)
+    fichier.seek(0)
+    return FileResponse(
+        fichier, as_attachment=True, filename=f'{nom_fichier}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
@@ -0,0 +1,171 @@
+# gestion_contribuables/fusion_pdf.py
+"""
+Concaténation de PDF en flux.
+
+Chaque document source est recopié objet par objet dans la sortie dès qu'il
+est lu : seules les positions des objets (xref) et la liste des pages restent
+en mémoire, quel que soit le nombre de documents fusionnés. Les attributs
+hérités du nœud /Pages parent (/MediaBox, /Resources, ...) sont reportés sur
+chaque page copiée. Un document illisible lève une exception sans rien
+émettre : la fusion peut continuer avec les suivants.
+
+    fusion = FusionPDF()
+    yield fusion.debut()
+    for pdf in documents:
+        yield fusion.ajouter(pdf)
+    yield fusion.fin()
+"""
+from io import BytesIO
+
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, NumberObject, StreamObject,
+)
+
+CATALOGUE = 1
+ARBRE_PAGES = 2
+# attributs de page héritables (PDF 32000-1, 7.7.3.4)
+HERITES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+class FusionPDF:
+    def __init__(self):
+        self._position = 0
+        self._offsets = {}
+        self._pages = []
+        self._prochain = ARBRE_PAGES + 1
+
+    def _bloc(self, data):
+        self._position += len(data)
+        return data
+
+    def _objet(self, numero, corps):
+        self._offsets[numero] = self._position
+        return self._bloc(b"%d 0 obj\n" % numero + corps + b"\nendobj\n")
+
+    def debut(self):
+        return self._bloc(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def ajouter(self, pdf_bytes):
+        """Recopie toutes les pages d'un PDF ; retourne les octets à émettre."""
+        prochain = self._prochain
+        try:
+            objets, pages = self._copier(PdfReader(BytesIO(pdf_bytes)))
+        except Exception:
+            self._prochain = prochain  # rien n'a été émis : numéros libérés
+            raise
+        morceaux = [self._objet(num, corps) for num, corps in objets]
+        self._pages.extend(pages)
+        return b"".join(morceaux)
+
+    def _copier(self, reader):
+        """[(numéro, corps)] des objets à écrire et numéros des pages, sans rien émettre."""
+        correspondance = {}
+        a_ecrire = []
+
+        racine_pages = reader.trailer['/Root'].raw_get('/Pages')
+        if isinstance(racine_pages, IndirectObject):
+            correspondance[(racine_pages.idnum, racine_pages.generation)] = ARBRE_PAGES
+
+        def numero(ref):
+            cle = (ref.idnum, ref.generation)
+            if cle not in correspondance:
+                correspondance[cle] = self._prochain
+                self._prochain += 1
+                a_ecrire.append(ref)
+            return correspondance[cle]
+
+        def convertir(obj):
+            if isinstance(obj, IndirectObject):
+                return IndirectObject(numero(obj), 0, None)
+            if isinstance(obj, DictionaryObject):
+                copie = DictionaryObject()
+                for cle, valeur in obj.items():
+                    copie[NameObject(cle)] = convertir(valeur)
+                return copie
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(convertir(v) for v in obj)
+            return obj
+
+        def serialiser(obj):
+            tampon = BytesIO()
+            if obj is None:
+                # référence cassée dans la source : null, comme le prévoit la norme
+                NullObject().write_to_stream(tampon)
+            elif isinstance(obj, StreamObject):
+                donnees = obj._data
+                entete = convertir(obj)
+                entete[NameObject('/Length')] = NumberObject(len(donnees))
+                entete.write_to_stream(tampon)
+                tampon.write(b"\nstream\n" + donnees + b"\nendstream")
+            else:
+                convertir(obj).write_to_stream(tampon)
+            return tampon.getvalue()
+
+        def herites(page):
+            """Attributs hérités des nœuds /Pages ancêtres, le plus proche l'emportant."""
+            valeurs = {}
+            parent = page.raw_get('/Parent') if '/Parent' in page else None
+            vus = set()
+            while parent is not None:
+                if isinstance(parent, IndirectObject):
+                    if (parent.idnum, parent.generation) in vus:
+                        break  # boucle dans l'arbre des pages
+                    vus.add((parent.idnum, parent.generation))
+                noeud = parent.get_object()
+                if not isinstance(noeud, DictionaryObject):
+                    break
+                for cle in HERITES:
+                    if cle in noeud and cle not in valeurs:
+                        valeurs[cle] = noeud.raw_get(cle)
+                parent = noeud.raw_get('/Parent') if '/Parent' in noeud else None
+            return valeurs
+
+        # pages réservées d'abord : les annotations qui pointent vers leur page ne la dupliquent pas
+        pages = []
+        for page in reader.pages:
+            ref = page.indirect_reference
+            num = self._prochain
+            self._prochain += 1
+            if ref is not None:
+                correspondance[(ref.idnum, ref.generation)] = num
+            pages.append((num, page))
+
+        objets = []
+        for num, page in pages:
+            brut = {k: page.raw_get(k) for k in page.keys() if k != '/Parent'}
+            for cle, valeur in herites(page).items():
+                brut.setdefault(cle, valeur)
+            copie = convertir(DictionaryObject(brut))
+            copie[NameObject('/Parent')] = IndirectObject(ARBRE_PAGES, 0, None)
+            tampon = BytesIO()
+            copie.write_to_stream(tampon)
+            objets.append((num, tampon.getvalue()))
+
+        while a_ecrire:
+            ref = a_ecrire.pop()
+            num = correspondance[(ref.idnum, ref.generation)]
+            objets.append((num, serialiser(reader.get_object(ref))))
+
+        return objets, [num for num, _ in pages]
+
+    def fin(self):
+        """Arbre des pages, catalogue, table xref et trailer."""
+        kids = b" ".join(b"%d 0 R" % num for num in self._pages)
+        morceaux = [
+            self._objet(ARBRE_PAGES, b"<< /Type /Pages /Kids [ " + kids + b" ] /Count %d >>" % len(self._pages)),
+            self._objet(CATALOGUE, b"<< /Type /Catalog /Pages %d 0 R >>" % ARBRE_PAGES),
+        ]
+        debut_xref = self._position
+        lignes = [b"xref\n0 %d\n" % self._prochain, b"0000000000 65535 f \n"]
+        for num in range(1, self._prochain):
+            if num in self._offsets:
+                lignes.append(b"%010d 00000 n \n" % self._offsets[num])
+            else:
+                lignes.append(b"0000000000 65535 f \n")
+        lignes.append(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self._prochain, CATALOGUE, debut_xref)
+        )
+        morceaux.append(b"".join(lignes))
+        return self._bloc(b"".join(morceaux))
@@ -0,0 +1,470 @@
+# gestion_contribuables/importation.py
+"""
+Import en masse de contribuables et de paiements depuis un CSV ou un XLSX
+(commande importer_masse).
+
+Le fichier est lu ligne à ligne et traité par lots de `taille_lot` :
+- contrôle des champs sans requête (clean_fields : formats, choix) ;
+- unicité NIF / référence en une requête par lot (plus les doublons du fichier) ;
+- références générées par blocs, collisions vérifiées en une requête par tour,
+  seules les manquantes étant retirées ; faute de référence libre, la ligne
+  est signalée en erreur au rapport ;
+- bulk_create des lignes valides, puis des lignes d'historique ;
+- paiements : total_paye et tables de cumul mis à jour par lot (ensemblistes),
+  quittances mises en file après validation (planifier_quittances_en_masse).
+
+save() et ses signaux ne sont pas appelés : pas de requête par ligne. Les
+notifications de retard ne sont pas envoyées pour des paiements importés.
+
+En dry_run rien n'est écrit ; le rapport liste les erreurs ligne par ligne.
+Les lignes invalides sont toujours ignorées, les autres importées.
+"""
+import csv
+import io
+import logging
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from .export import COLONNES_CONTRIBUABLE, COLONNES_PAIEMENT
+from .recherche import plier
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 1000
+ESSAIS_REFERENCES = 5
+
+# en-têtes acceptés en plus des noms de champs et des libellés de l'export
+ALIAS = {
+    'contribuables': {'TYPE_CONTRIBUABLE': 'type_contribuable', 'TEL': 'telephone'},
+    'paiements': {
+        'NIF': 'nif', 'CONTRIBUABLE__NIF': 'nif',
+        'REFERENCE_CONTRIBUABLE': 'reference_contribuable',
+        'CONTRIBUABLE__REFERENCE': 'reference_contribuable',
+        'MODE': 'mode_paiement', 'MODE_PAIEMENT': 'mode_paiement',
+    },
+}
+CHAMPS = {
+    'contribuables': (
+        'nif', 'reference', 'nom', 'type_contribuable', 'adresse', 'telephone', 'email', 'actif',
+        'notifier_retards', 'montant_a_payer', 'taxe_redevance', 'date_echeance',
+    ),
+    'paiements': (
+        'nif', 'reference_contribuable', 'reference', 'montant', 'taxe_redevance',
+        'date_paiement', 'date_echeance', 'mode_paiement', 'notes',
+    ),
+}
+
+
+class RapportImport:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.lues = 0
+        self.importees = 0
+        self.erreurs = []  # (numéro de ligne du fichier, message)
+
+    def erreur(self, numero, message):
+        self.erreurs.append((numero, message))
+
+    def __str__(self):
+        verbe = "valides" if self.dry_run else "importées"
+        return f"{self.lues} ligne(s) lue(s), {self.importees} {verbe}, {len(self.erreurs)} en erreur"
+
+
+# --- Lecture du fichier ------------------------------------------------------
+
+def _cle_en_tete(texte):
+    return plier(str(texte or '')).replace(' ', '_')
+
+
+def _en_tetes(modele):
+    colonnes = COLONNES_CONTRIBUABLE if modele == 'contribuables' else COLONNES_PAIEMENT
+    correspondance = {_cle_en_tete(champ): champ for champ in CHAMPS[modele]}
+    for champ, libelle in colonnes:
+        if champ in CHAMPS[modele]:
+            correspondance.setdefault(_cle_en_tete(libelle), champ)
+    correspondance.update(ALIAS[modele])
+    return correspondance
+
+
+def lire_lignes(fichier, nom_fichier, modele):
+    """(numéro de ligne, {champ: valeur brute}) ; colonnes inconnues ignorées."""
+    if nom_fichier.lower().endswith('.xlsx'):
+        lignes = _lignes_xlsx(fichier)
+    else:
+        lignes = _lignes_csv(fichier)
+    correspondance = _en_tetes(modele)
+    en_tetes = None
+    for numero, valeurs in lignes:
+        if en_tetes is None:
+            en_tetes = [correspondance.get(_cle_en_tete(v)) for v in valeurs]
+            continue
+        if not any(v not in (None, '') for v in valeurs):
+            continue
+        yield numero, {champ: v for champ, v in zip(en_tetes, valeurs) if champ}
+
+
+def _lignes_csv(fichier):
+    texte = io.TextIOWrapper(fichier, encoding='utf-8-sig', newline='')
+    echantillon = texte.read(4096)
+    texte.seek(0)
+    try:
+        dialecte = csv.Sniffer().sniff(echantillon, delimiters=';,\t')
+    except csv.Error:
+        dialecte = csv.excel
+    for numero, valeurs in enumerate(csv.reader(texte, dialecte), 1):
+        yield numero, valeurs
+
+
+def _lignes_xlsx(fichier):
+    from openpyxl import load_workbook
+
+    # read_only : lignes lues au fil de l'eau dans l'archive
+    classeur = load_workbook(fichier, read_only=True, data_only=True)
+    try:
+        for numero, valeurs in enumerate(classeur.active.iter_rows(values_only=True), 1):
+            yield numero, list(valeurs)
+    finally:
+        classeur.close()
+
+
+# --- Conversion des valeurs --------------------------------------------------
+
+def _texte(valeur):
+    if valeur is None:
+        return ''
+    if isinstance(valeur, float) and valeur.is_integer():
+        valeur = int(valeur)  # téléphones / NIF numériques dans Excel
+    return str(valeur).strip()
+
+
+def _decimal(valeur):
+    if isinstance(valeur, (int, float, Decimal)):
+        return Decimal(str(valeur))
+    texte = _texte(valeur).replace(' ', '').replace('\u00a0', '').replace('\u202f', '').replace(',', '.')
+    if not texte:
+        return None
+    try:
+        return Decimal(texte)
+    except InvalidOperation:
+        raise ValidationError(f"montant invalide : {valeur}")
+
+
+def _date(valeur):
+    if isinstance(valeur, datetime):
+        return valeur.date()
+    if isinstance(valeur, date):
+        return valeur
+    texte = _texte(valeur)
+    if not texte:
+        return None
+    for format_date in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(texte, format_date).date()
+        except ValueError:
+            pass
+    raise ValidationError(f"date invalide : {valeur}")
+
+
+def _booleen(valeur, defaut=True):
+    texte = plier(_texte(valeur))
+    if not texte:
+        return defaut
+    return texte in ('1', 'OUI', 'VRAI', 'TRUE', 'O', 'X')
+
+
+def _choix(valeur, choix):
+    """Valeur d'un champ à choix, donnée par sa clé ou son libellé."""
+    texte = _texte(valeur)
+    if not texte:
+        return None
+    for cle, libelle in choix:
+        if plier(texte) in (plier(cle), plier(libelle)):
+            return cle
+    return texte  # clean_fields signalera le choix invalide
+
+
+def _message(erreur):
+    if hasattr(erreur, 'message_dict'):
+        return " ; ".join(f"{champ} : {' '.join(msgs)}" for champ, msgs in erreur.message_dict.items())
+    return " ".join(erreur.messages)
+
+
+# --- Références --------------------------------------------------------------
+
+def _references_libres(modele, generer, nombre, reservees):
+    """
+    Jusqu'à `nombre` références absentes de la base et de `reservees`, vérifiées
+    par blocs : chaque tour ne tire que les références manquantes. Abandon après
+    ESSAIS_REFERENCES tours sans progrès (espace presque épuisé) : la liste peut
+    alors être plus courte que demandé.
+    """
+    libres = []
+    essais = 0
+    while len(libres) < nombre and essais < ESSAIS_REFERENCES:
+        candidates = {generer() for _ in range(nombre - len(libres))} - reservees - set(libres)
+        prises = set(modele.objects.filter(reference__in=candidates).values_list('reference', flat=True))
+        nouvelles = candidates - prises
+        essais = 0 if nouvelles else essais + 1
+        libres.extend(nouvelles)
+    return libres[:nombre]
+
+
+def _attribuer_references(rapport, valides, modele, generer, reservees, objet=lambda v: v):
+    """
+    Complète les références manquantes de `valides` ; les lignes pour lesquelles
+    aucune référence libre n'a été trouvée sont signalées au rapport et retirées.
+    valides : liste de (numéro, élément), objet(élément) donnant l'instance.
+    """
+    sans_reference = [(numero, element) for numero, element in valides if not objet(element).reference]
+    if not sans_reference:
+        return valides
+    references = _references_libres(modele, generer, len(sans_reference), reservees)
+    for (_, element), reference in zip(sans_reference, references):
+        objet(element).reference = reference
+        reservees.add(reference)
+    for numero, _ in sans_reference[len(references):]:
+        rapport.erreur(numero, "aucune référence libre, réessayer ou fournir une référence")
+    return [(numero, element) for numero, element in valides if objet(element).reference]
+
+
+def _par_lots(lignes, taille_lot):
+    lot = []
+    for ligne in lignes:
+        lot.append(ligne)
+        if len(lot) >= taille_lot:
+            yield lot
+            lot = []
+    if lot:
+        yield lot
+
+
+# --- Contribuables -----------------------------------------------------------
+
+def importer_contribuables(lignes, dry_run=False, taille_lot=TAILLE_LOT, utilisateur=None):
+    from .models import Contribuable, HistoriqueModification, TYPE_CONTRIBUABLE_CHOICES
+
+    rapport = RapportImport(dry_run)
+    vus = {'nif': set(), 'reference': set()}
+    choix_taxe = Contribuable._meta.get_field('taxe_redevance').choices
+
+    for lot in _par_lots(lignes, taille_lot):
+        candidats = []
+        for numero, brut in lot:
+            rapport.lues += 1
+            try:
+                obj = Contribuable(
+                    nif=_texte(brut.get('nif')).upper() or None,
+                    reference=_texte(brut.get('reference')) or None,
+                    nom=_texte(brut.get('nom')),
+                    type_contribuable=_choix(brut.get('type_contribuable'), TYPE_CONTRIBUABLE_CHOICES),
+                    adresse=_texte(brut.get('adresse')),
+                    telephone=_texte(brut.get('telephone')),
+                    email=_texte(brut.get('email')) or None,
+                    actif=_booleen(brut.get('actif')),
+                    notifier_retards=_booleen(brut.get('notifier_retards')),
+                    montant_a_payer=_decimal(brut.get('montant_a_payer')) or 0,
+                    taxe_redevance=_choix(brut.get('taxe_redevance'), choix_taxe),
+                    date_echeance=_date(brut.get('date_echeance')),
+                )
+                # formats et choix seulement : l'unicité est vérifiée pour tout le lot plus bas
+                obj.clean_fields(exclude=['reference'])
+            except ValidationError as e:
+                rapport.erreur(numero, _message(e))
+                continue
+            doublon = next((c for c in ('nif', 'reference') if getattr(obj, c) and getattr(obj, c) in vus[c]), None)
+            if doublon:
+                rapport.erreur(numero, f"{doublon} {getattr(obj, doublon)} en double dans le fichier")
+                continue
+            for champ in vus:
+                if getattr(obj, champ):
+                    vus[champ].add(getattr(obj, champ))
+            candidats.append((numero, obj))
+
+        # unicité en base : une requête pour tout le lot
+        nifs = [obj.nif for _, obj in candidats if obj.nif]
+        refs = [obj.reference for _, obj in candidats if obj.reference]
+        existants = Contribuable.objects.filter(Q(nif__in=nifs) | Q(reference__in=refs)).values_list('nif', 'reference')
+        # NIF et référence sont facultatifs : une valeur vide n'est jamais un doublon
+        nifs_pris = {nif for nif, _ in existants if nif}
+        refs_pris = {reference for _, reference in existants if reference}
+        valides = []
+        for numero, obj in candidats:
+            if obj.nif and obj.nif in nifs_pris:
+                rapport.erreur(numero, f"NIF {obj.nif} déjà utilisé")
+            elif obj.reference and obj.reference in refs_pris:
+                rapport.erreur(numero, f"référence {obj.reference} déjà utilisée")
+            else:
+                valides.append((numero, obj))
+
+        if dry_run:
+            rapport.importees += len(valides)
+            continue
+        valides = [
+            obj for _, obj in _attribuer_references(
+                rapport, valides, Contribuable, Contribuable()._generate_reference, vus['reference'],
+            )
+        ]
+        rapport.importees += len(valides)
+        if not valides:
+            continue
+
+        with transaction.atomic():
+            crees = Contribuable.objects.bulk_create(valides, batch_size=taille_lot)
+            HistoriqueModification.objects.bulk_create(
+                [_historique_creation(HistoriqueModification, obj, utilisateur) for obj in crees],
+                batch_size=taille_lot,
+            )
+
+    if not dry_run and rapport.importees:
+        _apres_import()
+    return rapport
+
+
+def _historique_creation(modele, contribuable, utilisateur):
+    # même forme que suivre_modifications (models.py), plus la source
+    return modele(
+        contribuable=contribuable,
+        utilisateur=utilisateur,
+        action='CREATE',
+        details={
+            'champs_modifies': [],
+            'dates': {
+                'inscription': contribuable.date_inscription.isoformat() if contribuable.date_inscription else None,
+                'modification': contribuable.date_modification.isoformat() if contribuable.date_modification else None,
+            },
+            'utilisateur': utilisateur.username if utilisateur else None,
+            'source': 'import',
+        },
+    )
+
+
+# --- Paiements ---------------------------------------------------------------
+
+def importer_paiements(lignes, dry_run=False, taille_lot=TAILLE_LOT, utilisateur=None):
+    from .models import Contribuable, Paiement, quittance_a_la_demande, somme_paiements
+    from .quittances import planifier_quittances_en_masse
+    from .recettes import reporter_paiements
+
+    rapport = RapportImport(dry_run)
+    references_vues = set()
+    touches = set()
+
+    for lot in _par_lots(lignes, taille_lot):
+        # contribuables du lot : une requête, par NIF ou par référence
+        nifs = {_texte(brut.get('nif')).upper() for _, brut in lot} - {''}
+        refs = {_texte(brut.get('reference_contribuable')) for _, brut in lot} - {''}
+        contribuables = {}
+        for c in (
+            Contribuable.objects.filter(Q(nif__in=nifs) | Q(reference__in=refs))
+            .values('pk', 'nif', 'reference', 'montant_a_payer', 'taxe_redevance', 'date_echeance',
+                    'type_contribuable', 'localisation__zone_id')
+        ):
+            if c['nif']:
+                contribuables[('nif', c['nif'])] = c
+            contribuables[('reference', c['reference'])] = c
+
+        candidats = []
+        for numero, brut in lot:
+            rapport.lues += 1
+            nif = _texte(brut.get('nif')).upper()
+            ref_contribuable = _texte(brut.get('reference_contribuable'))
+            contribuable = contribuables.get(('nif', nif)) or contribuables.get(('reference', ref_contribuable))
+            if contribuable is None:
+                rapport.erreur(numero, f"contribuable introuvable ({nif or ref_contribuable or 'ni NIF ni référence'})")
+                continue
+            try:
+                montant = _decimal(brut.get('montant'))
+                obj = Paiement(
+                    contribuable_id=contribuable['pk'],
+                    agent=utilisateur,
+                    reference=_texte(brut.get('reference')) or None,
+                    montant=contribuable['montant_a_payer'] if montant is None else montant,
+                    taxe_redevance=(
+                        _choix(brut.get('taxe_redevance'), Paiement.TAXE_REDEVANCE_CHOICES)
+                        or contribuable['taxe_redevance']
+                    ),
+                    date_paiement=_date(brut.get('date_paiement')),
+                    date_echeance=_date(brut.get('date_echeance')) or contribuable['date_echeance'],
+                    mode_paiement=_choix(brut.get('mode_paiement'), Paiement.MODES_PAIEMENT) or 'ESP',
+                    notes=_texte(brut.get('notes')),
+                )
+                # contribuable / agent exclus : leur existence est déjà connue (pas de requête)
+                obj.clean_fields(exclude=['contribuable', 'agent', 'reference', 'fichier_quittance'])
+            except ValidationError as e:
+                rapport.erreur(numero, _message(e))
+                continue
+            if obj.reference and obj.reference in references_vues:
+                rapport.erreur(numero, f"référence {obj.reference} en double dans le fichier")
+                continue
+            if obj.reference:
+                references_vues.add(obj.reference)
+            candidats.append((numero, obj, contribuable))
+
+        refs_paiements = [obj.reference for _, obj, _ in candidats if obj.reference]
+        refs_prises = set(Paiement.objects.filter(reference__in=refs_paiements).values_list('reference', flat=True))
+        valides = []
+        for numero, obj, contribuable in candidats:
+            if obj.reference in refs_prises:
+                rapport.erreur(numero, f"référence {obj.reference} déjà utilisée")
+            else:
+                valides.append((numero, (obj, contribuable)))
+
+        if dry_run:
+            rapport.importees += len(valides)
+            continue
+        valides = [
+            element for _, element in _attribuer_references(
+                rapport, valides, Paiement, Paiement().generate_reference, references_vues,
+                objet=lambda element: element[0],
+            )
+        ]
+        rapport.importees += len(valides)
+        if not valides:
+            continue
+
+        with transaction.atomic():
+            crees = Paiement.objects.bulk_create([obj for obj, _ in valides], batch_size=taille_lot)
+            ids_contribuables = {obj.contribuable_id for obj in crees}
+            # ce que Paiement.save() ferait ligne par ligne, en quelques requêtes pour le lot
+            Contribuable.objects.filter(pk__in=ids_contribuables).update(total_paye=somme_paiements())
+            reporter_paiements(
+                {
+                    **{champ: getattr(obj, champ) for champ in Paiement.CHAMPS_SUIVIS},
+                    'type_contribuable': contribuable['type_contribuable'],
+                    'zone': contribuable['localisation__zone_id'],
+                }
+                for obj, contribuable in valides
+            )
+            if not quittance_a_la_demande():
+                ids = [obj.pk for obj in crees]
+                transaction.on_commit(lambda ids=ids: planifier_quittances_en_masse(Paiement.objects.filter(pk__in=ids)))
+        touches |= ids_contribuables
+
+    if not dry_run and rapport.importees:
+        _apres_import(touches)
+    return rapport
+
+
+def _apres_import(contribuables_touches=()):
+    from .quittances import invalider_quittances_html
+    from .tableau_de_bord import nouvelle_generation
+
+    def invalider():
+        for pk in contribuables_touches:
+            invalider_quittances_html(pk)
+        nouvelle_generation()
+
+    transaction.on_commit(invalider)
+    logger.info("Import en masse terminé, tableau de bord invalidé")
+
+
+def importer(modele, fichier, nom_fichier, dry_run=False, taille_lot=TAILLE_LOT, utilisateur=None):
+    """modele : 'contribuables' ou 'paiements'. Retourne un RapportImport."""
+    lignes = lire_lignes(fichier, nom_fichier, modele)
+    if modele == 'contribuables':
+        return importer_contribuables(lignes, dry_run, taille_lot, utilisateur)
+    return importer_paiements(lignes, dry_run, taille_lot, utilisateur)
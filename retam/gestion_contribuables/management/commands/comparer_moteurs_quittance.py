@@ -0,0 +1,57 @@
+"""
+Compare les moteurs de rendu des quittances (WeasyPrint / ReportLab) sur des paiements réels.
+Usage: python manage.py comparer_moteurs_quittance [--nombre 50] [--moteur reportlab ...]
+
+Aucun fichier n'est écrit : seuls les temps de rendu (moteur déjà chaud) sont mesurés.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion_contribuables.models import Paiement
+from gestion_contribuables.quittances import MOTEURS, get_renderer
+
+
+class Command(BaseCommand):
+    help = 'Mesure le temps de rendu des quittances pour chaque moteur'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--nombre',
+            type=int,
+            default=50,
+            help='Nombre de paiements rendus par moteur',
+        )
+        parser.add_argument(
+            '--moteur',
+            nargs='*',
+            choices=sorted(MOTEURS),
+            help='Moteurs à comparer (défaut : tous)',
+        )
+
+    def handle(self, *args, **options):
+        paiements = list(
+            Paiement.objects.select_related('contribuable').order_by('-pk')[:options['nombre']]
+        )
+        if not paiements:
+            raise CommandError('Aucun paiement à rendre')
+
+        resultats = {}
+        for moteur in options['moteur'] or sorted(MOTEURS):
+            renderer = get_renderer(moteur)
+            # premier rendu hors mesure : chargement des polices, caches...
+            renderer.render(paiements[0])
+            renderer.nb_rendus, renderer.duree_totale = 0, 0.0
+            taille = sum(len(pdf) for _, pdf in renderer.render_many(paiements))
+            resultats[moteur] = renderer.ms_par_quittance
+            self.stdout.write(
+                f"{moteur:>10} : {renderer.ms_par_quittance:8.1f} ms/quittance "
+                f"({taille // len(paiements)} octets en moyenne)"
+            )
+
+        if len(resultats) > 1:
+            plus_rapide = min(resultats, key=resultats.get)
+            plus_lent = max(resultats, key=resultats.get)
+            if resultats[plus_rapide]:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{plus_rapide} est {resultats[plus_lent] / resultats[plus_rapide]:.1f}x "
+                    f"plus rapide que {plus_lent}"
+                ))
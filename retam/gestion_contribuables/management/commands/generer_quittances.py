@@ -0,0 +1,62 @@
+"""
+Génère en masse les quittances manquantes (rattrapage nocturne, après synchro hors ligne).
+Usage: python manage.py generer_quittances [--workers 4] [--taille-lot 50] [--contribuable ID ...]
+
+Relancer la commande après une interruption reprend là où elle s'était arrêtée.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from gestion_contribuables.models import Paiement
+from gestion_contribuables.quittances import generer_quittances_en_masse
+
+
+class Command(BaseCommand):
+    help = 'Génère les quittances manquantes sur un pool de processus'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Nombre de processus (défaut : nombre de cœurs)',
+        )
+        parser.add_argument(
+            '--taille-lot',
+            type=int,
+            default=50,
+            help='Nombre de quittances par lot (et par écriture en base)',
+        )
+        parser.add_argument(
+            '--contribuable',
+            type=int,
+            nargs='*',
+            help='Limiter aux paiements de ces contribuables (IDs)',
+        )
+
+    def handle(self, *args, **options):
+        paiements = Paiement.objects.all()
+        if options['contribuable']:
+            paiements = paiements.filter(contribuable_id__in=options['contribuable'])
+
+        debut = time.monotonic()
+
+        def progression(faites, total):
+            ecoule = time.monotonic() - debut
+            self.stdout.write(f"  {faites}/{total} quittances ({faites / max(ecoule, 0.001):.1f}/s)")
+
+        generees, erreurs = generer_quittances_en_masse(
+            paiements,
+            workers=options['workers'],
+            taille_lot=options['taille_lot'],
+            progression=progression,
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{generees} quittance(s) générée(s) en {time.monotonic() - debut:.1f}s')
+        )
+        if erreurs:
+            self.stdout.write(
+                self.style.WARNING(f'{erreurs} quittance(s) en erreur (statut « Erreur »)')
+            )
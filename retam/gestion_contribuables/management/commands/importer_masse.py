@@ -0,0 +1,60 @@
+"""
+Import en masse de contribuables ou de paiements depuis un CSV (; ou ,) ou un XLSX.
+Usage: python manage.py importer_masse contribuables fichier.csv [--dry-run] [--taille-lot 1000]
+       python manage.py importer_masse paiements fichier.xlsx [--utilisateur agent1]
+
+Les en-têtes reconnus sont les noms de champs et les libellés de l'export admin.
+Paiements : contribuable désigné par sa colonne NIF ou reference_contribuable.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion_contribuables.importation import TAILLE_LOT, importer
+
+
+class Command(BaseCommand):
+    help = 'Importe en masse des contribuables ou des paiements (CSV / XLSX)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modele', choices=['contribuables', 'paiements'])
+        parser.add_argument('fichier')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Valide le fichier et liste les erreurs sans rien écrire',
+        )
+        parser.add_argument(
+            '--taille-lot',
+            type=int,
+            default=TAILLE_LOT,
+            help='Nombre de lignes validées et insérées ensemble',
+        )
+        parser.add_argument(
+            '--utilisateur',
+            help="Nom d'utilisateur enregistré dans l'historique (et comme agent des paiements)",
+        )
+
+    def handle(self, *args, **options):
+        utilisateur = None
+        if options['utilisateur']:
+            try:
+                utilisateur = get_user_model().objects.get(username=options['utilisateur'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Utilisateur inconnu : {options['utilisateur']}")
+
+        debut = time.monotonic()
+        try:
+            with open(options['fichier'], 'rb') as fichier:
+                rapport = importer(
+                    options['modele'], fichier, options['fichier'],
+                    dry_run=options['dry_run'], taille_lot=options['taille_lot'], utilisateur=utilisateur,
+                )
+        except OSError as e:
+            raise CommandError(f"Lecture impossible : {e}")
+
+        for numero, message in rapport.erreurs:
+            self.stdout.write(f"  ligne {numero} : {message}")
+        style = self.style.WARNING if rapport.erreurs else self.style.SUCCESS
+        self.stdout.write(style(f"{rapport} ({time.monotonic() - debut:.1f}s)"))
@@ -0,0 +1,128 @@
+"""
+Déplace les quittances existantes (quittances/quittance_<ref>.pdf) vers le
+rangement par empreinte : quittances/AAAA/MM/<xx>/<sha256>.pdf.
+Usage: python manage.py migrer_quittances [--taille-lot 500] [--dry-run]
+
+Seuls les paiements sans empreinte sont traités : la commande peut être
+interrompue et relancée. Chaque fichier est copié sous son nouveau nom, le lot
+enregistré en base, puis seulement les anciens fichiers supprimés : une
+interruption laisse au pire un ancien fichier en trop, jamais un paiement
+pointant vers un fichier disparu.
+"""
+import hashlib
+import os
+import shutil
+import time
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gestion_contribuables.models import Paiement
+from gestion_contribuables.quittances import chemin_quittance
+
+
+class Command(BaseCommand):
+    help = 'Range les quittances existantes par date et empreinte SHA-256'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot',
+            type=int,
+            default=500,
+            help='Nombre de paiements mis à jour par requête',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche ce qui serait fait sans rien déplacer',
+        )
+
+    def _copier(self, ancien, nouveau):
+        """Lien physique sur disque local, copie sinon ; l'ancien fichier reste en place."""
+        try:
+            source, cible = default_storage.path(ancien), default_storage.path(nouveau)
+        except NotImplementedError:
+            source = cible = None
+
+        if source:
+            if not os.path.exists(cible):
+                os.makedirs(os.path.dirname(cible), exist_ok=True)
+                try:
+                    os.link(source, cible)
+                except OSError:
+                    shutil.copyfile(source, cible)
+            return nouveau
+
+        if not default_storage.exists(nouveau):
+            with default_storage.open(ancien, 'rb') as f:
+                nouveau = default_storage.save(nouveau, File(f))
+        return nouveau
+
+    def handle(self, *args, **options):
+        taille_lot = options['taille_lot']
+        dry_run = options['dry_run']
+        debut = time.monotonic()
+        deplaces = absents = 0
+        dernier_pk = 0
+
+        while True:
+            lot = list(
+                Paiement.objects.filter(pk__gt=dernier_pk, quittance_sha256='')
+                .exclude(fichier_quittance='').exclude(fichier_quittance__isnull=True)
+                .only('pk', 'date_paiement', 'fichier_quittance')
+                .order_by('pk')[:taille_lot]
+            )
+            if not lot:
+                break
+            dernier_pk = lot[-1].pk
+
+            a_jour = []
+            a_supprimer = []
+            for paiement in lot:
+                ancien = paiement.fichier_quittance.name
+                try:
+                    with default_storage.open(ancien, 'rb') as f:
+                        sha = hashlib.sha256()
+                        for morceau in f.chunks():
+                            sha.update(morceau)
+                        taille = f.size
+                except (FileNotFoundError, OSError):
+                    absents += 1
+                    continue
+
+                empreinte = sha.hexdigest()
+                nouveau = chemin_quittance(paiement, empreinte)
+                if dry_run:
+                    self.stdout.write(f"  {ancien} -> {nouveau}")
+                elif ancien != nouveau:
+                    nouveau = self._copier(ancien, nouveau)
+                    a_supprimer.append(ancien)
+                paiement.fichier_quittance.name = nouveau
+                paiement.quittance_sha256 = empreinte
+                paiement.quittance_taille = taille
+                a_jour.append(paiement)
+
+            if a_jour and not dry_run:
+                with transaction.atomic():
+                    Paiement.objects.bulk_update(
+                        a_jour, ['fichier_quittance', 'quittance_sha256', 'quittance_taille']
+                    )
+                # les paiements pointent désormais vers les copies ; un ancien
+                # fichier encore référencé ailleurs est gardé
+                encore_utilises = set(
+                    Paiement.objects.filter(fichier_quittance__in=a_supprimer)
+                    .values_list('fichier_quittance', flat=True)
+                )
+                for ancien in set(a_supprimer) - encore_utilises:
+                    default_storage.delete(ancien)
+            deplaces += len(a_jour)
+            self.stdout.write(f"  {deplaces} quittance(s) traitée(s) ({time.monotonic() - debut:.1f}s)")
+
+        verbe = 'à déplacer' if dry_run else 'déplacée(s)'
+        self.stdout.write(self.style.SUCCESS(f'{deplaces} quittance(s) {verbe}'))
+        if absents:
+            self.stdout.write(
+                self.style.WARNING(f'{absents} fichier(s) introuvable(s), laissé(s) en place')
+            )
@@ -0,0 +1,71 @@
+"""
+Vérifie que total_paye de chaque contribuable égale la somme de ses paiements
+et corrige les écarts.
+Usage: python manage.py reconcilier_total_paye [--taille-lot 1000] [--dry-run]
+
+La table est parcourue par tranches de clés primaires : chaque tranche coûte
+une requête de détection et, s'il y a des écarts, une requête de correction.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from gestion_contribuables.models import Contribuable, somme_paiements
+
+
+class Command(BaseCommand):
+    help = 'Détecte et corrige les écarts entre total_paye et la somme des paiements'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot',
+            type=int,
+            default=1000,
+            help='Nombre de contribuables examinés par requête',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche les écarts sans les corriger',
+        )
+
+    def handle(self, *args, **options):
+        taille_lot = options['taille_lot']
+        dry_run = options['dry_run']
+        debut = time.monotonic()
+        examines = ecarts = 0
+        dernier_pk = 0
+
+        while True:
+            pks = list(
+                Contribuable.objects.filter(pk__gt=dernier_pk)
+                .order_by('pk').values_list('pk', flat=True)[:taille_lot]
+            )
+            if not pks:
+                break
+            dernier_pk = pks[-1]
+            examines += len(pks)
+
+            tranche = Contribuable.objects.filter(pk__gte=pks[0], pk__lte=dernier_pk)
+            derives = list(
+                tranche.annotate(vrai_total=somme_paiements())
+                .exclude(total_paye=F('vrai_total'))
+                .values_list('pk', 'nom', 'total_paye', 'vrai_total')
+            )
+            if not derives:
+                continue
+
+            ecarts += len(derives)
+            for pk, nom, total_paye, vrai_total in derives:
+                self.stdout.write(f"  #{pk} {nom} : {total_paye} enregistré, {vrai_total} réel")
+            if not dry_run:
+                tranche.filter(pk__in=[d[0] for d in derives]).update(total_paye=somme_paiements())
+
+        duree = time.monotonic() - debut
+        if not ecarts:
+            self.stdout.write(self.style.SUCCESS(f'{examines} contribuable(s) vérifié(s), aucun écart ({duree:.1f}s)'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'{ecarts} écart(s) sur {examines} contribuable(s) ({duree:.1f}s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{ecarts} écart(s) corrigé(s) sur {examines} contribuable(s) ({duree:.1f}s)'))
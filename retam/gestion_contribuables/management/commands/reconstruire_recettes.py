@@ -0,0 +1,36 @@
+"""
+Recalcule les tables de cumul des recettes (jour et mois) à partir des paiements.
+Usage: python manage.py reconstruire_recettes [--depuis AAAA-MM]
+
+À lancer après un import en masse fait hors ORM, ou pour repartir d'un état sûr.
+"""
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion_contribuables.recettes import reconstruire
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit les tables RecetteJournaliere et RecetteMensuelle depuis les paiements'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--depuis',
+            help='Ne reconstruire qu\'à partir de ce mois (AAAA-MM)',
+        )
+
+    def handle(self, *args, **options):
+        depuis = None
+        if options['depuis']:
+            try:
+                depuis = datetime.strptime(options['depuis'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--depuis attend un mois au format AAAA-MM')
+
+        debut = time.monotonic()
+        nb_lignes = reconstruire(depuis=depuis)
+        self.stdout.write(
+            self.style.SUCCESS(f'{nb_lignes} ligne(s) de cumul en {time.monotonic() - debut:.1f}s')
+        )
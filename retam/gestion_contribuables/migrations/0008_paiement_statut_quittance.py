@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+def marquer_quittances_existantes(apps, schema_editor):
+    Paiement = apps.get_model('gestion_contribuables', 'Paiement')
+    Paiement.objects.filter(quittance_generee=True).update(statut_quittance='generee')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0007_alter_contribuable_reference_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paiement',
+            name='statut_quittance',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('generee', 'Générée'), ('erreur', 'Erreur')], default='en_attente', editable=False, max_length=12, verbose_name='Statut de la quittance'),
+        ),
+        migrations.RunPython(marquer_quittances_existantes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0008_paiement_statut_quittance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paiement',
+            name='quittance_sha256',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='paiement',
+            name='quittance_taille',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='paiement',
+            name='fichier_quittance',
+            field=models.FileField(blank=True, max_length=255, null=True, upload_to='quittances/'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def remplir_recettes(apps, schema_editor):
+    Paiement = apps.get_model('gestion_contribuables', 'Paiement')
+    RecetteMensuelle = apps.get_model('gestion_contribuables', 'RecetteMensuelle')
+    lignes = (
+        Paiement.objects.order_by()
+        .annotate(mois=TruncMonth('date_paiement'))
+        .values('mois', 'taxe_redevance', 'mode_paiement',
+                'contribuable__type_contribuable', 'contribuable__localisation__zone_id')
+        .annotate(
+            total=Sum('montant'),
+            nb=Count('id'),
+            nb_a_temps=Count('id', filter=Q(date_paiement__lte=F('date_echeance'))),
+            nb_en_retard=Count('id', filter=Q(date_paiement__gt=F('date_echeance'))),
+        )
+    )
+    RecetteMensuelle.objects.bulk_create(
+        (
+            RecetteMensuelle(
+                mois=ligne['mois'],
+                taxe_redevance=ligne['taxe_redevance'] or '',
+                mode_paiement=ligne['mode_paiement'],
+                type_contribuable=ligne['contribuable__type_contribuable'] or '',
+                zone=ligne['contribuable__localisation__zone_id'] or 0,
+                montant=ligne['total'] or 0,
+                nombre=ligne['nb'],
+                nombre_a_temps=ligne['nb_a_temps'],
+                nombre_en_retard=ligne['nb_en_retard'],
+            )
+            for ligne in lignes.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0009_paiement_quittance_sha256'),
+        ('geolocalisation', '0003_auto_20250904_1039'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecetteMensuelle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mois', models.DateField(verbose_name='Mois')),
+                ('taxe_redevance', models.CharField(blank=True, default='', max_length=32)),
+                ('mode_paiement', models.CharField(max_length=10)),
+                ('type_contribuable', models.CharField(blank=True, default='', max_length=20)),
+                ('zone', models.IntegerField(db_index=True, default=0)),
+                ('montant', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('nombre', models.IntegerField(default=0)),
+                ('nombre_a_temps', models.IntegerField(default=0)),
+                ('nombre_en_retard', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Recette mensuelle',
+                'verbose_name_plural': 'Recettes mensuelles',
+                'ordering': ['mois'],
+                'constraints': [models.UniqueConstraint(fields=('mois', 'taxe_redevance', 'mode_paiement', 'type_contribuable', 'zone'), name='unique_recette_mensuelle')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['date_paiement'], name='paiement_date_idx'),
+        ),
+        migrations.RunPython(remplir_recettes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+def remplir_recettes_journalieres(apps, schema_editor):
+    Paiement = apps.get_model('gestion_contribuables', 'Paiement')
+    RecetteJournaliere = apps.get_model('gestion_contribuables', 'RecetteJournaliere')
+    lignes = (
+        Paiement.objects.order_by()
+        .values('date_paiement', 'taxe_redevance', 'mode_paiement',
+                'contribuable__type_contribuable', 'contribuable__localisation__zone_id')
+        .annotate(
+            total=Sum('montant'),
+            nb=Count('id'),
+            nb_a_temps=Count('id', filter=Q(date_paiement__lte=F('date_echeance'))),
+            nb_en_retard=Count('id', filter=Q(date_paiement__gt=F('date_echeance'))),
+        )
+    )
+    RecetteJournaliere.objects.bulk_create(
+        (
+            RecetteJournaliere(
+                jour=ligne['date_paiement'],
+                taxe_redevance=ligne['taxe_redevance'] or '',
+                mode_paiement=ligne['mode_paiement'],
+                type_contribuable=ligne['contribuable__type_contribuable'] or '',
+                zone=ligne['contribuable__localisation__zone_id'] or 0,
+                montant=ligne['total'] or 0,
+                nombre=ligne['nb'],
+                nombre_a_temps=ligne['nb_a_temps'],
+                nombre_en_retard=ligne['nb_en_retard'],
+            )
+            for ligne in lignes.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0010_recettemensuelle_paiement_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecetteJournaliere',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taxe_redevance', models.CharField(blank=True, default='', max_length=32)),
+                ('mode_paiement', models.CharField(max_length=10)),
+                ('type_contribuable', models.CharField(blank=True, default='', max_length=20)),
+                ('zone', models.IntegerField(db_index=True, default=0)),
+                ('montant', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('nombre', models.IntegerField(default=0)),
+                ('nombre_a_temps', models.IntegerField(default=0)),
+                ('nombre_en_retard', models.IntegerField(default=0)),
+                ('jour', models.DateField(verbose_name='Jour')),
+            ],
+            options={
+                'verbose_name': 'Recette journalière',
+                'verbose_name_plural': 'Recettes journalières',
+                'ordering': ['jour'],
+                'constraints': [models.UniqueConstraint(fields=('jour', 'taxe_redevance', 'mode_paiement', 'type_contribuable', 'zone'), name='unique_recette_journaliere')],
+            },
+        ),
+        migrations.RunPython(remplir_recettes_journalieres, migrations.RunPython.noop),
+    ]
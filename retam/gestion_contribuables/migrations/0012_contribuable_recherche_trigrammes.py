@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-18 15:30
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+import gestion_contribuables.recherche
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.db import migrations
+
+
+# unaccent() n'est que STABLE (dictionnaire modifiable) : enveloppe IMMUTABLE pour l'indexer
+CREER_FONCTION = """
+CREATE OR REPLACE FUNCTION retam_unaccent(text) RETURNS text
+AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0011_recettejournaliere'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        UnaccentExtension(),
+        migrations.RunSQL(CREER_FONCTION, reverse_sql="DROP FUNCTION IF EXISTS retam_unaccent(text);"),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(gestion_contribuables.recherche.SansAccents('nom')),
+                    name='gin_trgm_ops',
+                ),
+                name='contribuable_nom_trgm',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('nif'), name='gin_trgm_ops'),
+                name='contribuable_nif_trgm',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('telephone'), name='gin_trgm_ops'),
+                name='contribuable_tel_trgm',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='gin_trgm_ops'),
+                name='contribuable_email_trgm',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('reference'), name='gin_trgm_ops'),
+                name='contribuable_ref_trgm',
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 16:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0012_contribuable_recherche_trigrammes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationSortante',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_notification', models.CharField(max_length=20, verbose_name='Type')),
+                ('cle_deduplication', models.CharField(max_length=100, unique=True)),
+                ('destinataire', models.EmailField(max_length=254)),
+                ('statut', models.CharField(choices=[('attente', 'En attente'), ('envoyee', 'Envoyée'), ('echec', 'Échec définitif')], default='attente', max_length=10)),
+                ('tentatives', models.PositiveSmallIntegerField(default=0)),
+                ('prochain_essai', models.DateTimeField(default=django.utils.timezone.now)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_envoi', models.DateTimeField(blank=True, null=True)),
+                ('contribuable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='gestion_contribuables.contribuable')),
+                ('paiement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='gestion_contribuables.paiement')),
+            ],
+            options={
+                'verbose_name': 'Notification sortante',
+                'verbose_name_plural': 'Notifications sortantes',
+                'ordering': ['prochain_essai'],
+                'indexes': [models.Index(fields=['statut', 'prochain_essai'], name='notification_a_envoyer_idx')],
+            },
+        ),
+    ]
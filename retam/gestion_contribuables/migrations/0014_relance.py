@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0013_notificationsortante'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Relance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_echeance', models.DateField(verbose_name='Échéance relancée')),
+                ('niveau', models.PositiveSmallIntegerField(choices=[(1, 'Premier rappel'), (2, 'Mise en demeure'), (3, 'Dernier avis avant poursuites')])),
+                ('montant_du', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Reste à payer')),
+                ('date_relance', models.DateTimeField(auto_now_add=True)),
+                ('contribuable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='relances', to='gestion_contribuables.contribuable')),
+                ('notification', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='relance', to='gestion_contribuables.notificationsortante')),
+            ],
+            options={
+                'verbose_name': 'Relance',
+                'verbose_name_plural': 'Relances',
+                'ordering': ['-date_relance'],
+                'constraints': [models.UniqueConstraint(fields=('contribuable', 'date_echeance', 'niveau'), name='relance_unique_niveau')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=models.Index(condition=models.Q(('actif', True), ('notifier_retards', True)), fields=['date_echeance'], name='contribuable_relance_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0014_relance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['contribuable', 'date_echeance'], name='paiement_echeance_idx'),
+        ),
+    ]
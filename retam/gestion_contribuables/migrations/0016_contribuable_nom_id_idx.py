@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0015_paiement_echeance_idx'),
+    ]
+
+    operations = [
+        # (nom, id) couvre aussi les recherches sur le seul nom
+        migrations.RemoveIndex(
+            model_name='contribuable',
+            name='gestion_con_nom_f38946_idx',
+        ),
+        migrations.AddIndex(
+            model_name='contribuable',
+            index=models.Index(fields=['nom', 'id'], name='contribuable_nom_id_idx'),
+        ),
+    ]
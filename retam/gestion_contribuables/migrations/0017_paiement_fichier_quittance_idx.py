@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0016_contribuable_nom_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['fichier_quittance'], name='paiement_fichier_quittance_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_contribuables', '0017_paiement_fichier_quittance_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paiement',
+            name='quittance_en_cours_depuis',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,27 +1,24 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import RegexValidator, MinValueValidator
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 import uuid
-from django.db.models import Sum, F, Count
-from django.core.mail import send_mail
+from .recherche import SansAccents
+from django.db.models import Sum, F, Q, Count, OuterRef, Subquery, Value, DecimalField
+from django.db.models.functions import Coalesce, Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.conf import settings
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-import qrcode
-import base64
-from io import BytesIO
-import os
-from weasyprint import HTML
 import json
+import logging
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.functions import TruncMonth
 from datetime import datetime, timedelta
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 class CustomAdminSite(models.Model):
     """Ce modèle n'est pas utilisé par Django, il faut hériter de admin.AdminSite dans admin.py"""
@@ -123,8 +120,20 @@ class Contribuable(models.Model):
         verbose_name_plural = "Contribuables"
         indexes = [
             models.Index(fields=['nif']),
-            models.Index(fields=['nom']),
+            # ordre par défaut de la liste, complété par id : saut et curseur de pagination.py
+            models.Index(fields=['nom', 'id'], name='contribuable_nom_id_idx'),
             models.Index(fields=['actif']),
+            # relances nocturnes (relances.py) : seuls les contribuables relançables sont indexés
+            models.Index(
+                fields=['date_echeance'], name='contribuable_relance_idx',
+                condition=Q(actif=True, notifier_retards=True),
+            ),
+            # recherche (recherche.py) : trigrammes, nom sans accents
+            GinIndex(OpClass(Upper(SansAccents('nom')), name='gin_trgm_ops'), name='contribuable_nom_trgm'),
+            GinIndex(OpClass(Upper('nif'), name='gin_trgm_ops'), name='contribuable_nif_trgm'),
+            GinIndex(OpClass(Upper('telephone'), name='gin_trgm_ops'), name='contribuable_tel_trgm'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='contribuable_email_trgm'),
+            GinIndex(OpClass(Upper('reference'), name='gin_trgm_ops'), name='contribuable_ref_trgm'),
         ]
         constraints = [
             models.UniqueConstraint(fields=['nif'], name='unique_nif'),
@@ -141,23 +150,41 @@ class Contribuable(models.Model):
         if self.reference and Contribuable.objects.exclude(id=self.id).filter(reference=self.reference).exists():
             raise ValidationError({'reference': 'Cette référence existe déjà'})
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # contenu du QR au chargement, pour purger son cache si le contact change
+        if {'telephone', 'email', 'adresse'} <= set(field_names):
+            from .quittances import qr_payload
+            instance._qr_payload_initial = qr_payload(instance)
+        if 'type_contribuable' in field_names:
+            instance._type_initial = instance.type_contribuable
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.reference:
             self.reference = self._generate_reference()
         super().save(*args, **kwargs)
 
+        ancien_type = getattr(self, '_type_initial', self.type_contribuable)
+        if ancien_type != self.type_contribuable:
+            from .recettes import deplacer_contribuable
+            deplacer_contribuable(self.pk, type_contribuable=(ancien_type, self.type_contribuable))
+        self._type_initial = self.type_contribuable
+
+        from .quittances import qr_payload, invalider_qr
+        ancien = getattr(self, '_qr_payload_initial', None)
+        nouveau = qr_payload(self)
+        if ancien is not None and ancien != nouveau:
+            invalider_qr(ancien)
+        self._qr_payload_initial = nouveau
+
     def _generate_reference(self):
         prefix = "CONTRIB"
         year = timezone.now().strftime("%Y")
         unique_part = uuid.uuid4().hex[:4].upper()
         return f"{prefix}-{year}-{unique_part}"
     
-    def update_total_paye(self):
-        total = self.paiements.aggregate(total=Sum('montant'))['total'] or 0
-        if self.total_paye != total:
-            self.total_paye = total
-            self.save(update_fields=['total_paye'])
-    
     @property
     def paiements_en_retard(self):
         return self.paiements.filter(date_paiement__gt=F('date_echeance'))
@@ -175,33 +202,9 @@ class Contribuable(models.Model):
         return reverse('admin:gestion_contribuables_contribuable_change', args=[str(self.id)])
     
     def generer_quittance(self, paiement):
-        qr_data = f"Tél: {self.telephone}\nMail: {self.email}\nAdresse: {self.adresse}"
-        qr = qrcode.make(qr_data)
-        buffer = BytesIO()
-        qr.save(buffer, format="PNG")
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-
-        context = {
-            'contribuable': self,
-            'paiement': paiement,
-            'date_emission': timezone.now().date().isoformat(),
-            'total_paye': self.total_paye,
-            'qr_base64': qr_base64,
-        }
-
-        html_string = render_to_string('quittance_template.html', context)
-        html = HTML(string=html_string)
-        pdf_file = html.write_pdf()
-
-        quittance_dir = os.path.join(settings.MEDIA_ROOT, 'quittances')
-        os.makedirs(quittance_dir, exist_ok=True)
-        filename = f"quittance_{paiement.reference or paiement.pk}.pdf"
-        filepath = os.path.join(quittance_dir, filename)
-
-        with open(filepath, 'wb') as f:
-            f.write(pdf_file)
-
-        return filepath
+        from .quittances import get_renderer, enregistrer_quittance
+        pdf_file = get_renderer().render(paiement, contribuable=self)
+        return enregistrer_quittance(paiement, pdf_file)
 
 
 class Paiement(models.Model):
@@ -229,6 +232,17 @@ class Paiement(models.Model):
         ('occupation_domaine', "Occupation du domaine public"),
     ]
 
+    QUITTANCE_EN_ATTENTE = 'en_attente'
+    QUITTANCE_EN_COURS = 'en_cours'
+    QUITTANCE_GENEREE = 'generee'
+    QUITTANCE_ERREUR = 'erreur'
+    STATUTS_QUITTANCE = [
+        (QUITTANCE_EN_ATTENTE, "En attente"),
+        (QUITTANCE_EN_COURS, "En cours"),
+        (QUITTANCE_GENEREE, "Générée"),
+        (QUITTANCE_ERREUR, "Erreur"),
+    ]
+
     contribuable = models.ForeignKey(
         Contribuable,
         on_delete=models.CASCADE,
@@ -261,11 +275,24 @@ class Paiement(models.Model):
     notes = models.TextField(blank=True)
     date_creation = models.DateTimeField(auto_now_add=True)
     quittance_generee = models.BooleanField(default=False)
+    statut_quittance = models.CharField(
+        max_length=12,
+        choices=STATUTS_QUITTANCE,
+        default=QUITTANCE_EN_ATTENTE,
+        editable=False,
+        verbose_name="Statut de la quittance"
+    )
+    # début du statut « En cours » : un rendu interrompu (worker tué) est repéré par son ancienneté
+    quittance_en_cours_depuis = models.DateTimeField(null=True, blank=True, editable=False)
     fichier_quittance = models.FileField(
         upload_to='quittances/',
+        max_length=255,
         null=True,
         blank=True
     )
+    # Empreinte et taille du PDF : la présence du fichier se lit en base, sans stat disque
+    quittance_sha256 = models.CharField(max_length=64, blank=True, default='', editable=False)
+    quittance_taille = models.PositiveIntegerField(null=True, blank=True, editable=False)
     taxe_redevance = models.CharField(
         max_length=32,
         choices=TAXE_REDEVANCE_CHOICES,
@@ -281,6 +308,13 @@ class Paiement(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['reference'], name='unique_paiement_reference')
         ]
+        indexes = [
+            models.Index(fields=['date_paiement'], name='paiement_date_idx'),
+            # paiements d'une échéance (relances.py)
+            models.Index(fields=['contribuable', 'date_echeance'], name='paiement_echeance_idx'),
+            # liens signés sur le nom du fichier, nettoyage des fichiers orphelins
+            models.Index(fields=['fichier_quittance'], name='paiement_fichier_quittance_idx'),
+        ]
     
     def __str__(self):
         return f"Paiement {self.reference} - {self.contribuable.nom}"
@@ -299,17 +333,60 @@ class Paiement(models.Model):
             if self.date_echeance is None:
                 self.date_echeance = self.contribuable.date_echeance
 
-        super().save(*args, **kwargs)
-        self.contribuable.update_total_paye()
+        ancien = None
+        if not self._state.adding:
+            # instance construite à la main : état d'origine relu en base
+            ancien = getattr(self, '_etat_initial', None) or (
+                Paiement.objects.filter(pk=self.pk).values(*self.CHAMPS_SUIVIS).first()
+            )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._repercuter(ancien)
 
-        if not self.quittance_generee or not self.fichier_quittance:
-            quittance_path = self.generer_quittance()
-            self.fichier_quittance.name = quittance_path.replace(settings.MEDIA_ROOT + '/', '')
-            self.quittance_generee = True
-            super().save(update_fields=['fichier_quittance', 'quittance_generee'])
+        # PDF et e-mail sont produits par le worker Celery une fois la transaction validée
+        # (en mode « à la demande », le PDF n'est produit qu'à la première consultation)
+        if (not self.quittance_generee or not self.fichier_quittance) and not quittance_a_la_demande():
+            planifier_quittance(self.pk)
 
         if self.est_en_retard and self.contribuable.notifier_retards:
-            self.notifier_retard()
+            planifier_notification_retard(self.pk)
+
+    # champs dont dépendent total_paye et la table de cumul RecetteMensuelle
+    CHAMPS_SUIVIS = ('montant', 'contribuable_id', 'date_paiement', 'date_echeance',
+                     'taxe_redevance', 'mode_paiement')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # état au chargement : save() n'applique que la différence aux cumuls
+        if set(cls.CHAMPS_SUIVIS) <= set(field_names):
+            instance._etat_initial = {champ: getattr(instance, champ) for champ in cls.CHAMPS_SUIVIS}
+        return instance
+
+    def _repercuter(self, ancien):
+        """Reporte la création/modification sur total_paye et sur les recettes mensuelles."""
+        from .recettes import paiement_modifie
+
+        self._ajuster_total_paye(ancien)
+        nouveau = {champ: getattr(self, champ) for champ in self.CHAMPS_SUIVIS}
+        paiement_modifie(ancien, nouveau)
+        self._etat_initial = nouveau
+
+    def _ajuster_total_paye(self, ancien):
+        """Incrémente total_paye par F() : pas de ré-agrégation, pas de course entre paiements simultanés."""
+        montant = self.montant or 0
+        if ancien is None:
+            mouvements = {self.contribuable_id: montant}
+        elif ancien['contribuable_id'] != self.contribuable_id:
+            mouvements = {ancien['contribuable_id']: -(ancien['montant'] or 0), self.contribuable_id: montant}
+        else:
+            mouvements = {self.contribuable_id: montant - (ancien['montant'] or 0)}
+
+        for contribuable_id, delta in mouvements.items():
+            if delta:
+                Contribuable.objects.filter(pk=contribuable_id).update(total_paye=F('total_paye') + delta)
+                if contribuable_id == self.contribuable_id and Paiement.contribuable.is_cached(self):
+                    self.contribuable.total_paye += delta
 
     def generate_reference(self):
         prefix = "PAY"
@@ -318,37 +395,169 @@ class Paiement(models.Model):
         return f"{prefix}-{date_part}-{unique_part}"
     
     def generer_quittance(self):
-        quittance_path = self.contribuable.generer_quittance(self)
-        return quittance_path
+        return self.contribuable.generer_quittance(self)
+
+    def produire_quittance(self):
+        """Génère le PDF et enregistre fichier + statut sans repasser par save()."""
+        Paiement.objects.filter(pk=self.pk).update(
+            statut_quittance=self.QUITTANCE_EN_COURS, quittance_en_cours_depuis=timezone.now(),
+        )
+        try:
+            nom, empreinte, taille = self.generer_quittance()
+        except Exception:
+            Paiement.objects.filter(pk=self.pk).update(statut_quittance=self.QUITTANCE_ERREUR)
+            self.statut_quittance = self.QUITTANCE_ERREUR
+            raise
+        self.fichier_quittance.name = nom
+        self.quittance_sha256 = empreinte
+        self.quittance_taille = taille
+        self.quittance_generee = True
+        self.statut_quittance = self.QUITTANCE_GENEREE
+        Paiement.objects.filter(pk=self.pk).update(
+            fichier_quittance=nom,
+            quittance_sha256=empreinte,
+            quittance_taille=taille,
+            quittance_generee=True,
+            statut_quittance=self.QUITTANCE_GENEREE,
+        )
+        return nom
+
+    def assurer_quittance(self):
+        """
+        Retourne le nom du fichier de quittance, en le générant s'il n'existe pas encore.
+        Le verrou sur la ligne du paiement fait que des demandes simultanées ne
+        produisent qu'un seul rendu : les suivantes attendent puis réutilisent le fichier.
+        """
+        if self.quittance_prete:
+            return self.fichier_quittance.name
+        with transaction.atomic():
+            verrouille = (
+                Paiement.objects.select_for_update(of=('self',))
+                .select_related('contribuable')
+                .get(pk=self.pk)
+            )
+            if not verrouille.quittance_prete:
+                verrouille.produire_quittance()
+        self.fichier_quittance = verrouille.fichier_quittance
+        self.quittance_sha256 = verrouille.quittance_sha256
+        self.quittance_taille = verrouille.quittance_taille
+        self.quittance_generee = verrouille.quittance_generee
+        self.statut_quittance = verrouille.statut_quittance
+        return self.fichier_quittance.name
+
+    @property
+    def quittance_prete(self):
+        return self.statut_quittance == self.QUITTANCE_GENEREE and bool(self.fichier_quittance)
     
     @property
     def est_en_retard(self):
         return self.date_paiement > self.date_echeance if all([self.date_paiement, self.date_echeance]) else False
 
-    def notifier_retard(self):
-        subject = f"Mise en demeure de paiement - {self.contribuable.nom}"
-        context = {
-            'contribuable': self.contribuable,
-            'paiement': self,
-            'jours_retard': (timezone.now().date() - self.date_echeance).days
-        }
-        html_message = render_to_string('emails/notification_retard.html', context)
-        plain_message = strip_tags(html_message)
-        
-        send_mail(
-            subject,
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [self.contribuable.email],
-            html_message=html_message,
-            fail_silently=True
-        )
-
     def get_absolute_url(self):
         from django.urls import reverse
         return reverse('admin:gestion_contribuables_paiement_change', args=[str(self.id)])
 
 
+def mettre_tache_en_file(tache_nom, *args):
+    """Envoie une tâche à Celery ; False s'il n'y a pas de file (celery absent, mode eager, broker injoignable)."""
+    from . import tasks
+    tache = getattr(tasks, tache_nom)
+    if not hasattr(tache, 'apply_async') or getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        return False
+    try:
+        tache.delay(*args)
+        return True
+    except Exception as e:
+        logger.warning("File Celery indisponible pour %s%s (%s)", tache_nom, args, e)
+        return False
+
+
+def envoyer_tache(tache_nom, *args):
+    """Envoie une tâche Celery ; sans Celery (ou broker injoignable) exécute en local."""
+    from . import tasks
+    if mettre_tache_en_file(tache_nom, *args):
+        return
+    try:
+        getattr(tasks, tache_nom)(*args)
+    except Exception:
+        logger.exception("Échec de %s%s", tache_nom, args)
+
+
+def quittance_a_la_demande():
+    return getattr(settings, 'QUITTANCE_GENERATION', 'file') == 'a_la_demande'
+
+
+def planifier_quittance(paiement_id):
+    """Met la génération de la quittance en file après validation de la transaction."""
+    transaction.on_commit(lambda: envoyer_tache('generer_quittance', paiement_id))
+
+
+def planifier_notification_retard(paiement_id):
+    def mettre_en_file():
+        from .notifications import notifier_retards
+        notifier_retards(Paiement.objects.filter(pk=paiement_id))
+    transaction.on_commit(mettre_en_file)
+
+
+class BaseRecette(models.Model):
+    """Axes d'analyse et mesures communs aux tables de cumul des recettes (voir recettes.py)."""
+    taxe_redevance = models.CharField(max_length=32, blank=True, default='')
+    mode_paiement = models.CharField(max_length=10)
+    type_contribuable = models.CharField(max_length=20, blank=True, default='')
+    # id de la zone, 0 = sans zone (pas de NULL : la contrainte d'unicité doit s'appliquer)
+    zone = models.IntegerField(default=0, db_index=True)
+    montant = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    nombre = models.IntegerField(default=0)
+    nombre_a_temps = models.IntegerField(default=0)
+    nombre_en_retard = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class RecetteMensuelle(BaseRecette):
+    """
+    Recettes cumulées par mois et par axe d'analyse (taxe, mode, type, zone).
+    Tenue à jour à chaque écriture de paiement (voir recettes.py) : les tableaux
+    de bord lisent quelques lignes par mois au lieu de parcourir les paiements.
+    Reconstruction complète : python manage.py reconstruire_recettes
+    """
+    mois = models.DateField(verbose_name="Mois")  # premier jour du mois
+
+    class Meta:
+        ordering = ['mois']
+        verbose_name = "Recette mensuelle"
+        verbose_name_plural = "Recettes mensuelles"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['mois', 'taxe_redevance', 'mode_paiement', 'type_contribuable', 'zone'],
+                name='unique_recette_mensuelle'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.mois:%Y-%m} {self.taxe_redevance or '-'} {self.mode_paiement} : {self.montant}"
+
+
+class RecetteJournaliere(BaseRecette):
+    """Même cumul, par jour : base des séries jour / semaine sur des périodes quelconques."""
+    jour = models.DateField(verbose_name="Jour")
+
+    class Meta:
+        ordering = ['jour']
+        verbose_name = "Recette journalière"
+        verbose_name_plural = "Recettes journalières"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['jour', 'taxe_redevance', 'mode_paiement', 'type_contribuable', 'zone'],
+                name='unique_recette_journaliere'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.jour:%Y-%m-%d} {self.taxe_redevance or '-'} {self.mode_paiement} : {self.montant}"
+
+
 class HistoriqueModification(models.Model):
     contribuable = models.ForeignKey(
         Contribuable,
@@ -381,6 +590,85 @@ class HistoriqueModification(models.Model):
         return self.details
 
 
+class NotificationSortante(models.Model):
+    """
+    Boîte d'envoi des e-mails aux contribuables (voir notifications.py) :
+    remplie en masse, vidée par la tâche envoyer_notifications sur une seule connexion SMTP.
+    """
+    EN_ATTENTE = 'attente'
+    ENVOYEE = 'envoyee'
+    ECHEC = 'echec'
+    STATUTS = [
+        (EN_ATTENTE, "En attente"),
+        (ENVOYEE, "Envoyée"),
+        (ECHEC, "Échec définitif"),
+    ]
+
+    contribuable = models.ForeignKey(Contribuable, on_delete=models.CASCADE, related_name='notifications')
+    paiement = models.ForeignKey(
+        Paiement, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications'
+    )
+    type_notification = models.CharField(max_length=20, verbose_name="Type")
+    # une seule notification par clé (ex. un retard par contribuable et par jour)
+    cle_deduplication = models.CharField(max_length=100, unique=True)
+    destinataire = models.EmailField()
+    statut = models.CharField(max_length=10, choices=STATUTS, default=EN_ATTENTE)
+    tentatives = models.PositiveSmallIntegerField(default=0)
+    prochain_essai = models.DateTimeField(default=timezone.now)
+    derniere_erreur = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_envoi = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['prochain_essai']
+        verbose_name = "Notification sortante"
+        verbose_name_plural = "Notifications sortantes"
+        indexes = [
+            models.Index(fields=['statut', 'prochain_essai'], name='notification_a_envoyer_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type_notification} → {self.destinataire} ({self.get_statut_display()})"
+
+
+# (niveau, jours après l'échéance, libellé) : chaque échéance impayée est relancée à chaque palier
+RELANCE_NIVEAUX = [
+    (1, 7, "Premier rappel"),
+    (2, 30, "Mise en demeure"),
+    (3, 60, "Dernier avis avant poursuites"),
+]
+
+
+class Relance(models.Model):
+    """Relance envoyée pour une échéance d'un contribuable (une par palier, voir relances.py)."""
+    contribuable = models.ForeignKey(Contribuable, on_delete=models.CASCADE, related_name='relances')
+    date_echeance = models.DateField(verbose_name="Échéance relancée")
+    niveau = models.PositiveSmallIntegerField(choices=[(n, libelle) for n, _, libelle in RELANCE_NIVEAUX])
+    montant_du = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Reste à payer")
+    date_relance = models.DateTimeField(auto_now_add=True)
+    notification = models.OneToOneField(
+        NotificationSortante, on_delete=models.SET_NULL, null=True, blank=True, related_name='relance'
+    )
+
+    class Meta:
+        ordering = ['-date_relance']
+        verbose_name = "Relance"
+        verbose_name_plural = "Relances"
+        constraints = [
+            # sert aussi d'index à la recherche des relances déjà faites
+            models.UniqueConstraint(
+                fields=['contribuable', 'date_echeance', 'niveau'], name='relance_unique_niveau'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_niveau_display()} - {self.contribuable.nom} ({self.date_echeance:%d/%m/%Y})"
+
+    @property
+    def jours_retard(self):
+        return (timezone.localdate() - self.date_echeance).days
+
+
 @receiver(post_save, sender=Contribuable)
 def suivre_modifications(sender, instance, created, **kwargs):
     user = getattr(instance, '_current_user', None)
@@ -412,4 +700,104 @@ def suivre_modifications(sender, instance, created, **kwargs):
         utilisateur=user if user and user.is_authenticated else None,
         action=action,
         details=details,
-    )
\ No newline at end of file
+    )
+
+
+def somme_paiements():
+    """Expression « somme des paiements du contribuable », utilisable dans un UPDATE ou une annotation."""
+    sous_requete = (
+        Paiement.objects.filter(contribuable=OuterRef('pk'))
+        .order_by().values('contribuable')
+        .annotate(total=Sum('montant')).values('total')
+    )
+    return Coalesce(
+        Subquery(sous_requete), Value(0),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+@receiver(pre_delete, sender=Paiement)
+def retirer_des_recettes(sender, instance, **kwargs):
+    # avant la suppression : le type et la zone du contribuable sont encore lisibles
+    from .recettes import paiement_modifie
+
+    ancien = getattr(instance, '_etat_initial', None) or {
+        champ: getattr(instance, champ) for champ in Paiement.CHAMPS_SUIVIS
+    }
+    paiement_modifie(ancien, None)
+
+
+@receiver(post_delete, sender=Paiement)
+def retirer_du_total_paye(sender, instance, **kwargs):
+    if instance.montant:
+        Contribuable.objects.filter(pk=instance.contribuable_id).update(
+            total_paye=F('total_paye') - instance.montant
+        )
+
+
+@receiver(pre_save, sender='geolocalisation.LocalisationContribuable')
+def memoriser_zone(sender, instance, **kwargs):
+    instance._zone_precedente = (
+        sender.objects.filter(pk=instance.pk).values_list('zone_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender='geolocalisation.LocalisationContribuable')
+def deplacer_recettes_zone(sender, instance, **kwargs):
+    from .recettes import deplacer_contribuable
+
+    ancienne = getattr(instance, '_zone_precedente', None)
+    if ancienne != instance.zone_id:
+        deplacer_contribuable(instance.contribuable_id, zone=(ancienne, instance.zone_id))
+
+
+@receiver(post_delete, sender='geolocalisation.LocalisationContribuable')
+def retirer_recettes_zone(sender, instance, **kwargs):
+    # sans localisation, les recettes du contribuable passent à « sans zone »
+    from .recettes import deplacer_contribuable
+
+    if instance.zone_id is not None:
+        deplacer_contribuable(instance.contribuable_id, zone=(instance.zone_id, None))
+
+
+@receiver(pre_delete, sender='geolocalisation.Zone')
+def fusionner_recettes_zone(sender, instance, **kwargs):
+    # les localisations passent à « sans zone » (SET_NULL, sans signal) : les cumuls aussi
+    from .recettes import retirer_zone
+
+    retirer_zone(instance.pk)
+
+
+@receiver(post_save, sender=Paiement)
+@receiver(post_delete, sender=Paiement)
+@receiver(post_save, sender=Contribuable)
+def invalider_quittances_publiques(sender, instance, **kwargs):
+    """Les quittances HTML en cache du contribuable deviennent périmées."""
+    from .quittances import invalider_quittances_html
+
+    if sender is Contribuable:
+        concernes = {instance.pk}
+    else:
+        # paiement changé de contribuable : l'ancien lien paiement -> contribuable est encore en cache
+        initial = getattr(instance, '_etat_initial', None) or {}
+        concernes = {instance.contribuable_id, initial.get('contribuable_id')} - {None}
+
+    def invalider():
+        for contribuable_id in concernes:
+            invalider_quittances_html(contribuable_id)
+    transaction.on_commit(invalider)
+
+
+@receiver(post_save, sender=Paiement)
+@receiver(post_delete, sender=Paiement)
+@receiver(post_save, sender=Contribuable)
+@receiver(post_delete, sender=Contribuable)
+@receiver(post_save, sender='geolocalisation.Zone')
+@receiver(post_delete, sender='geolocalisation.Zone')
+@receiver(post_save, sender='geolocalisation.LocalisationContribuable')
+@receiver(post_delete, sender='geolocalisation.LocalisationContribuable')
+def perimer_tableau_de_bord(sender, **kwargs):
+    from .tableau_de_bord import nouvelle_generation
+
+    transaction.on_commit(nouvelle_generation)
@@ -0,0 +1,260 @@
+# gestion_contribuables/notifications.py
+"""
+Boîte d'envoi des e-mails (NotificationSortante).
+
+- Mise en file : bulk_create(ignore_conflicts=True) sur cle_deduplication,
+  donc au plus un message par clé (un retard par contribuable et par jour),
+  même si l'action est relancée ou si deux processus mettent en file ensemble.
+- Envoi (tâche envoyer_notifications, aussi lancée chaque minute par beat) :
+  lots réservés par SELECT ... FOR UPDATE SKIP LOCKED, rendus au moment de
+  l'envoi, expédiés sur une seule connexion SMTP (get_connection + send_messages).
+- Échec temporaire : nouvel essai après un délai qui double (NOTIFICATIONS_DELAI_BASE),
+  échec définitif après NOTIFICATIONS_MAX_TENTATIVES ou si l'adresse est refusée.
+- Débit : au plus NOTIFICATIONS_MAX_PAR_MINUTE messages par minute, tous
+  workers confondus (compteur dans le cache).
+
+Une notification réservée mais jamais conclue (worker tué) redevient
+disponible après BAIL secondes.
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+logger = logging.getLogger(__name__)
+
+BAIL = 600
+
+
+def _reglage(nom, defaut):
+    return getattr(settings, nom, defaut)
+
+
+# --- Rendu -------------------------------------------------------------------
+
+def _rendu_retard(notification):
+    paiement = notification.paiement
+    contribuable = notification.contribuable
+    html = render_to_string('emails/notification_retard.html', {
+        'contribuable': contribuable,
+        'paiement': paiement,
+        'jours_retard': (timezone.localdate() - paiement.date_echeance).days,
+    })
+    return f"Mise en demeure de paiement - {contribuable.nom}", html
+
+
+def _rendu_relance(notification):
+    relance = notification.relance
+    contribuable = notification.contribuable
+    html = render_to_string('emails/relance.html', {
+        'contribuable': contribuable,
+        'relance': relance,
+        'jours_retard': relance.jours_retard,
+    })
+    return f"{relance.get_niveau_display()} - {contribuable.nom}", html
+
+
+# type_notification -> fonction (notification) -> (sujet, html)
+RENDUS = {
+    'retard': _rendu_retard,
+    'relance': _rendu_relance,
+}
+
+
+# --- Mise en file ------------------------------------------------------------
+
+def mettre_en_file(notifications):
+    """
+    Insère des NotificationSortante non enregistrées ; les clés déjà présentes sont ignorées.
+    Retourne le nombre de notifications réellement ajoutées.
+    """
+    from .models import NotificationSortante, envoyer_tache
+
+    notifications = list(notifications)
+    ajoutees = 0
+    for i in range(0, len(notifications), 1000):
+        tranche = notifications[i:i + 1000]
+        # ignore_conflicts ne dit pas ce qui a été inséré : on compte les clés déjà prises avant
+        deja = NotificationSortante.objects.filter(
+            cle_deduplication__in=[n.cle_deduplication for n in tranche]
+        ).count()
+        NotificationSortante.objects.bulk_create(tranche, ignore_conflicts=True)
+        ajoutees += len(tranche) - deja
+    if ajoutees:
+        transaction.on_commit(lambda: envoyer_tache('envoyer_notifications'))
+    return ajoutees
+
+
+def notifier_retards(paiements):
+    """
+    Une mise en demeure par contribuable (notifications acceptées, e-mail renseigné)
+    parmi les paiements en retard de `paiements` : celui à l'échéance la plus ancienne.
+    """
+    from .models import NotificationSortante
+
+    jour = timezone.localdate()
+    retards = (
+        paiements.filter(
+            date_paiement__gt=F('date_echeance'),
+            contribuable__notifier_retards=True,
+            contribuable__email__gt='',
+        )
+        .order_by('contribuable_id', 'date_echeance', 'pk')
+        .distinct('contribuable_id')
+        .values_list('pk', 'contribuable_id', 'contribuable__email')
+    )
+    return mettre_en_file(
+        NotificationSortante(
+            contribuable_id=contribuable_id,
+            paiement_id=paiement_id,
+            type_notification='retard',
+            cle_deduplication=f"retard:{contribuable_id}:{jour:%Y%m%d}",
+            destinataire=email,
+        )
+        for paiement_id, contribuable_id, email in retards.iterator()
+    )
+
+
+# --- Envoi -------------------------------------------------------------------
+
+def _reserver_debit(nombre):
+    """Nombre de messages autorisés maintenant (fenêtre d'une minute, partagée par les workers)."""
+    limite = _reglage('NOTIFICATIONS_MAX_PAR_MINUTE', 120)
+    if not limite:
+        return nombre
+    cle = f'notifications:debit:{int(time.time() // 60)}'
+    cache.add(cle, 0, 120)
+    utilise = cache.incr(cle, nombre)
+    return max(0, nombre - max(0, utilise - limite))
+
+
+def _reserver_lot(taille):
+    """Lot à envoyer, réservé (prochain_essai repoussé de BAIL) pour qu'aucun autre worker ne le prenne."""
+    from .models import NotificationSortante
+
+    maintenant = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            NotificationSortante.objects
+            .filter(statut=NotificationSortante.EN_ATTENTE, prochain_essai__lte=maintenant)
+            .order_by('prochain_essai')
+            .select_for_update(skip_locked=True)
+            .values_list('pk', flat=True)[:taille]
+        )
+        NotificationSortante.objects.filter(pk__in=ids).update(
+            prochain_essai=maintenant + timedelta(seconds=BAIL),
+            tentatives=F('tentatives') + 1,
+        )
+    return list(
+        NotificationSortante.objects.filter(pk__in=ids)
+        .select_related('contribuable', 'paiement', 'relance').order_by('prochain_essai', 'pk')
+    )
+
+
+def _message(notification, connexion):
+    sujet, html = RENDUS[notification.type_notification](notification)
+    message = EmailMultiAlternatives(
+        sujet, strip_tags(html), settings.DEFAULT_FROM_EMAIL, [notification.destinataire],
+        connection=connexion,
+    )
+    message.attach_alternative(html, 'text/html')
+    return message
+
+
+def _echec(notification, erreur, definitif):
+    from .models import NotificationSortante
+
+    max_tentatives = _reglage('NOTIFICATIONS_MAX_TENTATIVES', 5)
+    champs = {'derniere_erreur': str(erreur)[:1000]}
+    if definitif or notification.tentatives >= max_tentatives:
+        champs['statut'] = NotificationSortante.ECHEC
+    else:
+        delai = _reglage('NOTIFICATIONS_DELAI_BASE', 60) * 2 ** (notification.tentatives - 1)
+        champs['prochain_essai'] = timezone.now() + timedelta(seconds=min(delai, 6 * 3600))
+    NotificationSortante.objects.filter(pk=notification.pk).update(**champs)
+
+
+def _ouvrir(connexion, lot):
+    """Ouvre (ou rouvre) la connexion ; si le serveur est injoignable, le lot est reporté."""
+    try:
+        connexion.open()
+        return True
+    except (smtplib.SMTPException, OSError) as e:
+        logger.warning("Serveur SMTP injoignable, %d notification(s) reportée(s) : %s", len(lot), e)
+        for notification in lot:
+            _echec(notification, e, definitif=False)
+        return False
+
+
+def envoyer_notifications(taille_lot=None):
+    """Vide la boîte d'envoi (dans la limite du débit). Retourne (envoyées, en échec)."""
+    from .models import NotificationSortante
+
+    taille_lot = taille_lot or _reglage('NOTIFICATIONS_LOT', 100)
+    envoyees = echecs = 0
+    connexion = None
+    try:
+        while True:
+            autorises = _reserver_debit(taille_lot)
+            if not autorises:
+                break
+            lot = _reserver_lot(autorises)
+            if not lot:
+                break
+            if connexion is None:
+                connexion = get_connection(fail_silently=False)
+                if not _ouvrir(connexion, lot):
+                    echecs += len(lot)
+                    break
+
+            reussies = []
+            interrompu = False
+            try:
+                for i, notification in enumerate(lot):
+                    try:
+                        message = _message(notification, connexion)
+                    except Exception as e:
+                        logger.exception("Rendu impossible pour la notification %s", notification.pk)
+                        _echec(notification, e, definitif=False)
+                        echecs += 1
+                        continue
+                    try:
+                        connexion.send_messages([message])
+                    except smtplib.SMTPRecipientsRefused as e:
+                        _echec(notification, e, definitif=True)
+                        echecs += 1
+                    except (smtplib.SMTPException, OSError) as e:
+                        _echec(notification, e, definitif=False)
+                        echecs += 1
+                        # connexion peut-être perdue : la suite repart d'une connexion neuve
+                        connexion.close()
+                        if not _ouvrir(connexion, lot[i + 1:]):
+                            echecs += len(lot) - i - 1
+                            interrompu = True
+                            break
+                    else:
+                        reussies.append(notification.pk)
+            finally:
+                # enregistré même si une erreur inattendue interrompt le lot : pas de double envoi
+                NotificationSortante.objects.filter(pk__in=reussies).update(
+                    statut=NotificationSortante.ENVOYEE, date_envoi=timezone.now(), derniere_erreur='',
+                )
+            envoyees += len(reussies)
+            if interrompu or len(lot) < autorises:
+                break
+    finally:
+        if connexion is not None:
+            connexion.close()
+
+    if envoyees or echecs:
+        logger.info("Boîte d'envoi : %d notification(s) envoyée(s), %d en échec", envoyees, echecs)
+    return envoyees, echecs
@@ -0,0 +1,155 @@
+# gestion_contribuables/pagination.py
+"""
+Pagination des grandes listes (admin et ContribuableListView).
+
+- Nombre total : sans filtre, l'estimation du planificateur PostgreSQL
+  (pg_class.reltuples) remplace le COUNT(*) exact, au-delà de SEUIL_ESTIMATION
+  lignes. Avec un filtre, le COUNT reste exact.
+- Pages profondes : au lieu de OFFSET sur les lignes complètes, on lit la clé
+  de tri (ordre, id) de la première ligne de la page, puis on « saute » à
+  cette clé (WHERE (ordre, id) >= borne LIMIT n).
+- Curseur : page_apres(curseur) lit la page qui suit une clé donnée, sans OFFSET
+  du tout (liens « page suivante » de ContribuableListView).
+
+Le saut et le curseur supposent un index sur (ordre, id) : voir
+contribuable_nom_id_idx pour l'ordre par défaut des contribuables. Sans lui
+(autres ordres de l'admin, paiements triés par date), la lecture de la borne
+reste un OFFSET, sur l'index de la clé seule.
+
+Opt-in : paginator = EstimatedCountPaginator dans un ModelAdmin (avec
+show_full_result_count = False), paginator_class dans une ListView.
+"""
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+SEUIL_ESTIMATION = 10000
+# à partir de cet OFFSET on passe par la clé de tri
+SEUIL_SAUT = 1000
+
+
+def estimer_lignes(modele, using='default'):
+    """Nombre de lignes estimé de la table (None hors PostgreSQL ou table jamais analysée)."""
+    connexion = connections[using]
+    if connexion.vendor != 'postgresql':
+        return None
+    with connexion.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [modele._meta.db_table])
+        ligne = cursor.fetchone()
+    # reltuples vaut -1 tant que la table n'a pas été analysée
+    if ligne is None or ligne[0] < 0:
+        return None
+    return ligne[0]
+
+
+def encoder_curseur(valeurs):
+    return base64.urlsafe_b64encode(json.dumps(valeurs, cls=DjangoJSONEncoder).encode()).decode().rstrip('=')
+
+
+def decoder_curseur(curseur):
+    """Valeurs de la clé de tri ; ValueError si le curseur est illisible."""
+    try:
+        valeurs = json.loads(base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("curseur invalide") from e
+    if not isinstance(valeurs, list):
+        raise ValueError("curseur invalide")
+    return valeurs
+
+
+def condition_apres(cles, valeurs, inclus=False):
+    """
+    Q des lignes qui suivent `valeurs` dans l'ordre `cles` ('champ' ou '-champ'),
+    directions mélangées comprises : k1 > v1 OU (k1 = v1 ET k2 > v2) OU ...
+    """
+    egalites = {}
+    conditions = []
+    for cle, valeur in zip(cles, valeurs):
+        champ = cle.lstrip('-')
+        operateur = 'lt' if cle.startswith('-') else 'gt'
+        conditions.append(Q(**egalites, **{f'{champ}__{operateur}': valeur}))
+        egalites[champ] = valeur
+    if inclus:
+        conditions.append(Q(**egalites))
+    return reduce(operator.or_, conditions)
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if isinstance(qs, QuerySet) and not qs.query.where and not qs.query.distinct:
+            estimation = estimer_lignes(qs.model, qs.db)
+            if estimation is not None and estimation >= SEUIL_ESTIMATION:
+                return estimation
+        return super().count
+
+    def cles_de_tri(self):
+        """Ordre du queryset complété par pk, ou None s'il n'est pas utilisable pour un saut."""
+        qs = self.object_list
+        if not isinstance(qs, QuerySet):
+            return None
+        ordre = list(qs.query.order_by or qs.model._meta.ordering)
+        if not all(isinstance(cle, str) and cle != '?' for cle in ordre):
+            return None
+        if not {cle.lstrip('-') for cle in ordre} & {'pk', qs.model._meta.pk.name}:
+            # même sens que la dernière clé : l'index (clé, id) sert dans les deux cas
+            ordre.append('-pk' if ordre and ordre[-1].startswith('-') else 'pk')
+        return ordre
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bas = (number - 1) * self.per_page
+        cles = self.cles_de_tri() if bas >= SEUIL_SAUT else None
+        if not cles:
+            return super().page(number)
+
+        # OFFSET sur la seule clé de tri (lecture d'index), pas sur les lignes complètes
+        borne = list(self.object_list.values_list(*[cle.lstrip('-') for cle in cles])[bas:bas + 1])
+        if not borne or None in borne[0]:
+            return super().page(number)
+        objets = list(
+            self.object_list.filter(condition_apres(cles, borne[0], inclus=True)).order_by(*cles)[:self.per_page]
+        )
+        return self._get_page(objets, number, self)
+
+    def page_apres(self, curseur=None):
+        """
+        (objets, curseur suivant) : la page qui suit `curseur` (None : première page).
+        Le curseur suivant vaut None sur la dernière page.
+        """
+        cles = self.cles_de_tri()
+        if cles is None:
+            raise ValueError("ordre de tri non utilisable pour un curseur")
+        qs = self.object_list
+        if curseur:
+            valeurs = decoder_curseur(curseur)
+            if len(valeurs) != len(cles):
+                raise ValueError("curseur invalide")
+            qs = qs.filter(condition_apres(cles, valeurs))
+        objets = list(qs.order_by(*cles)[:self.per_page + 1])
+        suivant = None
+        if len(objets) > self.per_page:
+            objets = objets[:self.per_page]
+            suivant = self.curseur_apres(objets[-1])
+        return objets, suivant
+
+    def curseur_apres(self, objet):
+        """Curseur de la page qui suit `objet` (None si l'ordre ne permet pas de curseur)."""
+        cles = self.cles_de_tri()
+        if cles is None:
+            return None
+        champs = [cle.lstrip('-') for cle in cles]
+        if any('__' in champ for champ in champs):
+            valeurs = self.object_list.filter(pk=objet.pk).values_list(*champs).first()
+        else:
+            valeurs = [getattr(objet, champ) for champ in champs]
+        return encoder_curseur(list(valeurs))
@@ -0,0 +1,651 @@
+# gestion_contribuables/quittances.py
+"""
+Rendu PDF des quittances.
+
+Le gabarit de la quittance ne change jamais : la feuille de style, la
+configuration des polices et les logos sont chargés une seule fois par
+processus, puis réutilisés pour chaque quittance.
+
+Deux moteurs, choisis par settings.QUITTANCE_MOTEUR : WeasyPrint (gabarit
+HTML quittance_template.html) et ReportLab (dessin direct, mise en page fixe).
+"""
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def qr_payload(contribuable):
+    return f"Tél: {contribuable.telephone}\nMail: {contribuable.email}\nAdresse: {contribuable.adresse}"
+
+
+# --- Cache des QR codes ------------------------------------------------------
+# Le PNG ne dépend que du texte encodé : la clé est l'empreinte de ce texte.
+# Un contact modifié donne une nouvelle empreinte, l'ancienne entrée est purgée
+# par invalider_qr() (appelé par Contribuable.save).
+
+QR_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+QR_LRU_TAILLE = 1024
+_qr_lru = OrderedDict()
+_qr_lock = threading.Lock()
+
+
+def qr_empreinte(payload):
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _qr_cle(empreinte):
+    return f'quittance:qr:{empreinte}'
+
+
+def _encoder_qr(payload):
+    qr = qrcode.make(payload)
+    buffer = BytesIO()
+    qr.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def qr_png_base64(payload):
+    """PNG base64 du QR : LRU du processus, puis cache partagé, puis encodage."""
+    empreinte = qr_empreinte(payload)
+    with _qr_lock:
+        if empreinte in _qr_lru:
+            _qr_lru.move_to_end(empreinte)
+            return _qr_lru[empreinte]
+
+    valeur = cache.get(_qr_cle(empreinte))
+    if valeur is None:
+        valeur = _encoder_qr(payload)
+        cache.set(_qr_cle(empreinte), valeur, QR_CACHE_TIMEOUT)
+
+    with _qr_lock:
+        _qr_lru[empreinte] = valeur
+        if len(_qr_lru) > QR_LRU_TAILLE:
+            _qr_lru.popitem(last=False)
+    return valeur
+
+
+def qr_base64(contribuable):
+    return qr_png_base64(qr_payload(contribuable))
+
+
+def invalider_qr(payload):
+    empreinte = qr_empreinte(payload)
+    with _qr_lock:
+        _qr_lru.pop(empreinte, None)
+    cache.delete(_qr_cle(empreinte))
+
+
+# --- Cache du rendu HTML public (serve_quittance_html) ----------------------
+# Le fragment rendu est rangé sous (paiement, version des paiements du
+# contribuable, jour d'émission). Toute modification d'un paiement ou du
+# contribuable change la version : les anciens fragments ne sont plus lus et
+# expirent d'eux-mêmes. Le lien paiement -> contribuable est lui aussi en
+# cache, si bien qu'une ouverture répétée ne touche pas la base.
+
+HTML_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _cle_version_html(contribuable_id):
+    return f'quittance:html:version:{contribuable_id}'
+
+
+def _cle_contribuable_html(paiement_id):
+    return f'quittance:html:contribuable:{paiement_id}'
+
+
+def version_quittances_html(contribuable_id):
+    cle = _cle_version_html(contribuable_id)
+    version = cache.get(cle)
+    if version is None:
+        # clé évincée : nouvelle valeur, jamais une version déjà servie
+        cache.add(cle, time.time_ns(), None)
+        version = cache.get(cle)
+    return version
+
+
+def invalider_quittances_html(contribuable_id):
+    cache.set(_cle_version_html(contribuable_id), time.time_ns(), None)
+
+
+def cle_quittance_html(paiement_id, contribuable_id, variante=''):
+    version = version_quittances_html(contribuable_id)
+    return f'quittance:html:{paiement_id}:{version}:{timezone.localdate():%Y%m%d}:{variante}'
+
+
+def quittance_html_en_cache(paiement_id, variante=''):
+    """Fragment déjà rendu, ou None (sans requête SQL)."""
+    contribuable_id = cache.get(_cle_contribuable_html(paiement_id))
+    if contribuable_id is None:
+        return None
+    return cache.get(cle_quittance_html(paiement_id, contribuable_id, variante))
+
+
+def mettre_quittance_html_en_cache(paiement, html, variante=''):
+    cache.set_many({
+        _cle_contribuable_html(paiement.pk): paiement.contribuable_id,
+        cle_quittance_html(paiement.pk, paiement.contribuable_id, variante): html,
+    }, HTML_CACHE_TIMEOUT)
+
+
+def chemin_quittance(paiement, empreinte):
+    """
+    quittances/AAAA/MM/<2 premiers car. du hash>/<sha256>.pdf
+
+    Le mois répartit les fichiers dans le temps, le préfixe du hash les étale
+    sur 256 sous-dossiers : aucun dossier ne grossit sans limite.
+    """
+    jour = paiement.date_paiement or timezone.localdate()
+    return f"quittances/{jour:%Y/%m}/{empreinte[:2]}/{empreinte}.pdf"
+
+
+def enregistrer_quittance(paiement, pdf_file):
+    """
+    Écrit le PDF dans le stockage par défaut, sous son empreinte SHA-256.
+    Retourne (nom, sha256, taille) à reporter sur le paiement.
+    """
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+
+    empreinte = hashlib.sha256(pdf_file).hexdigest()
+    nom = chemin_quittance(paiement, empreinte)
+    # même contenu => même nom : un fichier déjà présent n'est pas réécrit
+    if not default_storage.exists(nom):
+        nom = default_storage.save(nom, ContentFile(pdf_file))
+    return nom, empreinte, len(pdf_file)
+
+
+LOGOS = {
+    'mairie': 'img/logo_mairie.png',
+    'senegal': 'img/logo_senegal.png',
+}
+
+
+class BaseQuittanceRenderer:
+    """Interface commune des moteurs : render(), render_many() et mesure en ms/quittance."""
+
+    def __init__(self):
+        self.nb_rendus = 0
+        self.duree_totale = 0.0
+
+    def _rendre(self, paiement, contribuable):
+        raise NotImplementedError
+
+    def render(self, paiement, contribuable=None):
+        """Retourne le PDF (bytes) de la quittance d'un paiement."""
+        contribuable = contribuable or paiement.contribuable
+        debut = time.perf_counter()
+        pdf_file = self._rendre(paiement, contribuable)
+        self.nb_rendus += 1
+        self.duree_totale += time.perf_counter() - debut
+        return pdf_file
+
+    def render_many(self, paiements):
+        """Génère (paiement, pdf) pour une suite de paiements, avec le même moteur."""
+        nb_avant, duree_avant = self.nb_rendus, self.duree_totale
+        for paiement in paiements:
+            yield paiement, self.render(paiement)
+        nb = self.nb_rendus - nb_avant
+        if nb:
+            logger.info(
+                "%s : %d quittance(s) rendue(s), %.1f ms/quittance",
+                self.__class__.__name__, nb, (self.duree_totale - duree_avant) * 1000 / nb
+            )
+
+    @property
+    def ms_par_quittance(self):
+        return self.duree_totale * 1000 / self.nb_rendus if self.nb_rendus else 0.0
+
+
+class _CacheImages(OrderedDict):
+    """
+    Cache d'images passé à WeasyPrint (cache=), borné : chaque quittance y ajoute
+    son QR code (URL data: unique), seuls les logos doivent y rester.
+    """
+
+    def __init__(self, taille):
+        super().__init__()
+        self.taille = taille
+
+    def __getitem__(self, cle):
+        valeur = super().__getitem__(cle)
+        self.move_to_end(cle)
+        return valeur
+
+    def __setitem__(self, cle, valeur):
+        super().__setitem__(cle, valeur)
+        self.move_to_end(cle)
+        while len(self) > self.taille:
+            self.popitem(last=False)
+
+
+class QuittanceRenderer(BaseQuittanceRenderer):
+    """Moteur WeasyPrint « chaud » : CSS, polices et logos préparés une seule fois."""
+
+    template_name = 'quittance_template.html'
+    feuille_style = 'quittance_styles.css'
+
+    def __init__(self):
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+
+        super().__init__()
+        self.font_config = FontConfiguration()
+        self.css = CSS(string=render_to_string(self.feuille_style), font_config=self.font_config)
+        self.assets = {}
+        self.logos = {}
+        for nom, chemin in LOGOS.items():
+            fichier = finders.find(chemin)
+            if not fichier:
+                logger.warning("Logo de quittance introuvable : %s", chemin)
+                continue
+            with open(fichier, 'rb') as f:
+                self.assets[f'asset:{nom}'] = f.read()
+            self.logos[nom] = f'asset:{nom}'
+        # images décodées partagées entre documents : les logos restent en tête du LRU
+        self._cache_images = _CacheImages(4 * len(LOGOS) + 8)
+
+    def _url_fetcher(self, url, *args, **kwargs):
+        from weasyprint import default_url_fetcher
+
+        if url in self.assets:
+            return {'string': self.assets[url], 'mime_type': 'image/png'}
+        return default_url_fetcher(url, *args, **kwargs)
+
+    def contexte(self, paiement, contribuable):
+        return {
+            'contribuable': contribuable,
+            'paiement': paiement,
+            'date_emission': timezone.now().date().isoformat(),
+            'total_paye': contribuable.total_paye,
+            'qr_base64': qr_base64(contribuable),
+            'logos': self.logos,
+            'pdf': True,
+        }
+
+    def _rendre(self, paiement, contribuable):
+        from weasyprint import HTML
+
+        html_string = render_to_string(self.template_name, self.contexte(paiement, contribuable))
+        return HTML(string=html_string, url_fetcher=self._url_fetcher).write_pdf(
+            stylesheets=[self.css],
+            font_config=self.font_config,
+            cache=self._cache_images,
+        )
+
+
+class QuittanceReportlabRenderer(BaseQuittanceRenderer):
+    """
+    Même quittance dessinée directement au canevas ReportLab : la mise en page
+    est fixe (une page), donc pas besoin du moteur HTML/CSS.
+    """
+
+    BLEU = '#79aec8'
+    BLEU_FONCE = '#0a384f'
+    VERT = '#4caf50'
+    GRIS = '#888888'
+
+    def __init__(self):
+        from reportlab.lib.utils import ImageReader
+
+        super().__init__()
+        self.logos = {}
+        for nom, chemin in LOGOS.items():
+            fichier = finders.find(chemin)
+            if fichier:
+                self.logos[nom] = ImageReader(fichier)
+            else:
+                logger.warning("Logo de quittance introuvable : %s", chemin)
+
+    def _rendre(self, paiement, contribuable):
+        from reportlab.lib.pagesizes import A5
+        from reportlab.pdfgen import canvas
+
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A5, pageCompression=1)
+        c.setTitle(f"Quittance {paiement.reference or paiement.pk}")
+        self._dessiner(c, A5, paiement, contribuable)
+        c.showPage()
+        c.save()
+        return buffer.getvalue()
+
+    def _ligne(self, c, x, y, largeur, libelle, valeur):
+        """Libellé en gras suivi de sa valeur (renvoyée à la ligne si trop longue)."""
+        from reportlab.lib.utils import simpleSplit
+
+        c.setFillColor(self.BLEU_FONCE)
+        c.setFont('Helvetica-Bold', 10)
+        c.drawString(x, y, libelle)
+        decalage = c.stringWidth(libelle, 'Helvetica-Bold', 10) + 4
+        c.setFillColor('#2c3e50')
+        c.setFont('Helvetica', 10)
+        lignes = simpleSplit(str(valeur), 'Helvetica', 10, largeur - decalage) or ['']
+        for i, texte in enumerate(lignes):
+            c.drawString(x + decalage, y - i * 13, texte)
+        return y - len(lignes) * 13 - 5
+
+    def _bandeau(self, c, x, y, largeur, texte, fond, couleur, taille):
+        c.setFillColor(fond)
+        c.roundRect(x, y, largeur, taille + 14, 6, stroke=0, fill=1)
+        c.setFillColor(couleur)
+        c.setFont('Helvetica-Bold', taille)
+        c.drawCentredString(x + largeur / 2, y + 8, texte)
+
+    def _dessiner(self, c, format_page, paiement, contribuable):
+        from django.utils import formats
+        from reportlab.graphics import renderPDF
+        from reportlab.graphics.barcode.qr import QrCodeWidget
+        from reportlab.graphics.shapes import Drawing
+
+        page_l, page_h = format_page
+        marge = 30
+        x, largeur = marge, page_l - 2 * marge
+        interieur_x, interieur_l = x + 18, largeur - 36
+
+        # cadre
+        c.setStrokeColor(self.BLEU)
+        c.setLineWidth(1.5)
+        c.roundRect(x, marge, largeur, page_h - 2 * marge, 14, stroke=1, fill=0)
+        y = page_h - marge - 16
+
+        # logos
+        if self.logos:
+            y -= 44
+            if 'mairie' in self.logos:
+                c.drawImage(self.logos['mairie'], interieur_x, y, width=44, height=44,
+                            preserveAspectRatio=True, mask='auto')
+            if 'senegal' in self.logos:
+                c.drawImage(self.logos['senegal'], interieur_x + interieur_l - 44, y, width=44, height=44,
+                            preserveAspectRatio=True, mask='auto')
+            y -= 10
+
+        # titre + badge
+        y -= 20
+        c.setFillColor(self.BLEU_FONCE)
+        c.setFont('Helvetica-Bold', 17)
+        titre = "Quittance de paiement"
+        largeur_titre = c.stringWidth(titre, 'Helvetica-Bold', 17)
+        debut_titre = x + (largeur - largeur_titre - 58) / 2
+        c.drawString(debut_titre, y, titre)
+        c.setFillColor(self.VERT)
+        c.roundRect(debut_titre + largeur_titre + 10, y - 4, 48, 18, 5, stroke=0, fill=1)
+        c.setFillColor('#ffffff')
+        c.setFont('Helvetica-Bold', 10)
+        c.drawCentredString(debut_titre + largeur_titre + 34, y + 1, "Payé")
+
+        y -= 16
+        c.setStrokeColor(self.BLEU)
+        c.setLineWidth(1)
+        c.line(x + largeur * 0.1, y, x + largeur * 0.9, y)
+        y -= 22
+
+        # informations
+        nom = f"{contribuable.nom} (NIF : {contribuable.nif})"
+        y = self._ligne(c, interieur_x, y, interieur_l, "Contribuable :", nom)
+        y = self._ligne(c, interieur_x, y, interieur_l, "Type de taxe/redevance :",
+                        paiement.get_taxe_redevance_display() or '')
+        y = self._ligne(c, interieur_x, y, interieur_l, "Date de paiement :",
+                        formats.date_format(paiement.date_paiement) if paiement.date_paiement else '')
+        y = self._ligne(c, interieur_x, y, interieur_l, "Référence :", paiement.reference or '')
+        y = self._ligne(c, interieur_x, y, interieur_l, "Date d'émission :", timezone.now().date().isoformat())
+
+        # montants
+        y -= 30
+        self._bandeau(c, interieur_x, y, interieur_l,
+                      f"Montant payé : {formats.localize(paiement.montant)} FCFA",
+                      self.BLEU, '#ffffff', 13)
+        y -= 30
+        self._bandeau(c, interieur_x, y, interieur_l,
+                      f"Total payé (tous paiements) : {formats.localize(contribuable.total_paye)} FCFA",
+                      '#eaf6fb', self.BLEU_FONCE, 10)
+
+        # QR code vectoriel (pas d'encodage PNG)
+        taille_qr = 110
+        widget = QrCodeWidget(qr_payload(contribuable))
+        x0, y0, x1, y1 = widget.getBounds()
+        dessin = Drawing(taille_qr, taille_qr, transform=[taille_qr / (x1 - x0), 0, 0, taille_qr / (y1 - y0), 0, 0])
+        dessin.add(widget)
+        y -= taille_qr + 16
+        renderPDF.draw(dessin, c, x + (largeur - taille_qr) / 2, y)
+        c.setFillColor('#555555')
+        c.setFont('Helvetica', 9)
+        c.drawCentredString(x + largeur / 2, y - 12, "Scannez pour voir les détails de la quittance")
+
+        # pied de page
+        c.setFillColor(self.GRIS)
+        c.setFont('Helvetica', 8)
+        c.drawCentredString(x + largeur / 2, marge + 14,
+                            "Document généré par la plateforme de gestion fiscale - Mairie de Mbour")
+
+
+MOTEURS = {
+    'weasyprint': QuittanceRenderer,
+    'reportlab': QuittanceReportlabRenderer,
+}
+
+_renderers = {}
+_renderer_lock = threading.Lock()
+
+
+def get_renderer(moteur=None):
+    """Moteur partagé du processus (créé au premier usage), choisi par QUITTANCE_MOTEUR."""
+    moteur = moteur or getattr(settings, 'QUITTANCE_MOTEUR', 'weasyprint')
+    if moteur not in _renderers:
+        with _renderer_lock:
+            if moteur not in _renderers:
+                _renderers[moteur] = MOTEURS[moteur]()
+    return _renderers[moteur]
+
+
+# --- Génération en masse ---------------------------------------------------
+
+def _init_processus():
+    """Initialise Django dans un processus du pool (utile hors fork, ex. macOS)."""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def rendre_lot(paiement_ids):
+    """
+    Rend et écrit les PDF d'un lot de paiements.
+    Retourne ([(pk, nom_fichier, sha256, taille)], [(pk, erreur)]) ; la base n'est pas modifiée ici.
+    """
+    from .models import Paiement
+
+    renderer = get_renderer()
+    generees, erreurs = [], []
+    qs = Paiement.objects.select_related('contribuable').filter(pk__in=paiement_ids)
+    for paiement in qs:
+        try:
+            nom, empreinte, taille = enregistrer_quittance(paiement, renderer.render(paiement))
+        except Exception as e:
+            logger.exception("Quittance %s en erreur", paiement.pk)
+            erreurs.append((paiement.pk, str(e)))
+            continue
+        generees.append((paiement.pk, nom, empreinte, taille))
+    return generees, erreurs
+
+
+def enregistrer_lot(generees, erreurs):
+    """Écrit fichier, empreinte, taille et statut des quittances en une requête par lot."""
+    from .models import Paiement
+
+    if generees:
+        Paiement.objects.bulk_update(
+            [
+                Paiement(pk=pk, fichier_quittance=nom, quittance_sha256=empreinte,
+                         quittance_taille=taille, quittance_generee=True,
+                         statut_quittance=Paiement.QUITTANCE_GENEREE)
+                for pk, nom, empreinte, taille in generees
+            ],
+            ['fichier_quittance', 'quittance_sha256', 'quittance_taille',
+             'quittance_generee', 'statut_quittance'],
+        )
+    if erreurs:
+        Paiement.objects.filter(pk__in=[pk for pk, _ in erreurs]).update(
+            statut_quittance=Paiement.QUITTANCE_ERREUR
+        )
+
+
+def _lots(paiements, taille_lot):
+    ids = list(
+        paiements.filter(quittance_generee=False).order_by('pk').values_list('pk', flat=True)
+    )
+    return [ids[i:i + taille_lot] for i in range(0, len(ids), taille_lot)], len(ids)
+
+
+def generer_quittances_en_masse(paiements, workers=None, taille_lot=50, progression=None):
+    """
+    Génère les quittances manquantes d'un queryset de paiements sur un pool de
+    processus (un par cœur par défaut).
+
+    Chaque lot terminé est enregistré immédiatement : une exécution interrompue
+    reprend là où elle s'était arrêtée, puisque seuls les paiements sans
+    quittance sont sélectionnés ; les statuts « En cours » périmés sont remis
+    en attente au passage. `progression(faites, total)` est appelé après
+    chaque lot. Retourne (nb_generees, nb_erreurs).
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from django.db import connections
+
+    liberer_quittances_bloquees()
+    lots, total = _lots(paiements, taille_lot)
+    workers = workers or os.cpu_count() or 1
+    faites = nb_erreurs = 0
+
+    if workers == 1 or len(lots) <= 1:
+        for lot in lots:
+            generees, erreurs = rendre_lot(lot)
+            enregistrer_lot(generees, erreurs)
+            faites += len(lot)
+            nb_erreurs += len(erreurs)
+            if progression:
+                progression(faites, total)
+        return faites - nb_erreurs, nb_erreurs
+
+    # les processus ne doivent pas hériter de la connexion ouverte du parent
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_processus) as pool:
+        futures = {pool.submit(rendre_lot, lot): lot for lot in lots}
+        for future in as_completed(futures):
+            lot = futures[future]
+            try:
+                generees, erreurs = future.result()
+            except Exception as e:
+                logger.exception("Lot de quittances en échec (%d paiements)", len(lot))
+                generees, erreurs = [], [(pk, str(e)) for pk in lot]
+            enregistrer_lot(generees, erreurs)
+            faites += len(lot)
+            nb_erreurs += len(erreurs)
+            if progression:
+                progression(faites, total)
+    return faites - nb_erreurs, nb_erreurs
+
+
+def planifier_quittances_en_masse(paiements, taille_lot=50):
+    """Répartit les quittances manquantes en lots Celery (parallélisés par les workers)."""
+    from .models import envoyer_tache
+
+    lots, total = _lots(paiements, taille_lot)
+    for lot in lots:
+        envoyer_tache('generer_quittances_lot', lot)
+    return total
+
+
+# --- Génération en masse depuis l'admin ----------------------------------------
+# Jamais de rendu dans le processus web : lots Celery, ou à défaut la commande
+# generer_quittances. L'avancement se lit en base (statut_quittance des
+# paiements du suivi) ; un lot « En cours » depuis plus de
+# QUITTANCE_EN_COURS_DELAI (worker tué) est remis « En attente ».
+
+SUIVI_TIMEOUT = 60 * 60 * 24
+
+
+def _cle_suivi(suivi):
+    return f'quittances:suivi:{suivi}'
+
+
+def liberer_quittances_bloquees(paiements=None):
+    """Remet « En attente » les quittances restées « En cours » au-delà du délai. Retourne leur nombre."""
+    from datetime import timedelta
+    from django.db.models import Q
+    from .models import Paiement
+
+    limite = timezone.now() - timedelta(seconds=getattr(settings, 'QUITTANCE_EN_COURS_DELAI', 3600))
+    paiements = Paiement.objects.all() if paiements is None else paiements
+    nombre = paiements.filter(
+        Q(quittance_en_cours_depuis__lt=limite) | Q(quittance_en_cours_depuis__isnull=True),
+        statut_quittance=Paiement.QUITTANCE_EN_COURS,
+    ).update(statut_quittance=Paiement.QUITTANCE_EN_ATTENTE, quittance_en_cours_depuis=None)
+    if nombre:
+        logger.warning("%d quittance(s) bloquée(s) « En cours » remise(s) en attente", nombre)
+    return nombre
+
+
+def lancer_quittances_en_masse(paiements, taille_lot=50):
+    """
+    Met en file Celery les quittances manquantes de `paiements`, lot par lot,
+    chaque lot passant « En cours » juste avant son envoi.
+    Retourne (identifiant de suivi ou None, nombre planifié, nombre laissé faute
+    de file) : ces derniers sont à produire par la commande generer_quittances.
+    """
+    from .models import Paiement, mettre_tache_en_file
+
+    liberer_quittances_bloquees()
+    lots, total = _lots(paiements, taille_lot)
+    planifies = []
+    for lot in lots:
+        en_file = Paiement.objects.filter(pk__in=lot)
+        en_file.update(statut_quittance=Paiement.QUITTANCE_EN_COURS, quittance_en_cours_depuis=timezone.now())
+        if not mettre_tache_en_file('generer_quittances_lot', lot):
+            en_file.update(statut_quittance=Paiement.QUITTANCE_EN_ATTENTE, quittance_en_cours_depuis=None)
+            break
+        planifies.extend(lot)
+    if not planifies:
+        return None, 0, total
+    suivi = uuid.uuid4().hex
+    cache.set(_cle_suivi(suivi), planifies, SUIVI_TIMEOUT)
+    return suivi, len(planifies), total - len(planifies)
+
+
+def suivi_quittances(suivi):
+    """Avancement d'une génération lancée par lancer_quittances_en_masse (None si suivi inconnu ou expiré)."""
+    from django.db.models import Count
+    from .models import Paiement
+
+    ids = cache.get(_cle_suivi(suivi))
+    if ids is None:
+        return None
+    liberer_quittances_bloquees(Paiement.objects.filter(pk__in=ids))
+    statuts = dict(
+        Paiement.objects.filter(pk__in=ids).order_by()
+        .values_list('statut_quittance').annotate(n=Count('pk'))
+    )
+    generees = statuts.get(Paiement.QUITTANCE_GENEREE, 0)
+    erreurs = statuts.get(Paiement.QUITTANCE_ERREUR, 0)
+    return {
+        'total': len(ids),
+        'generees': generees,
+        'erreurs': erreurs,
+        # remises en attente après un worker interrompu : à relancer
+        'interrompues': statuts.get(Paiement.QUITTANCE_EN_ATTENTE, 0),
+        # paiements supprimés entre-temps : comptés comme traités
+        'restantes': statuts.get(Paiement.QUITTANCE_EN_COURS, 0),
+        'termine': not statuts.get(Paiement.QUITTANCE_EN_COURS),
+    }
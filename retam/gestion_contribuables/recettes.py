@@ -0,0 +1,306 @@
+# gestion_contribuables/recettes.py
+"""
+Tables de cumul des recettes (RecetteJournaliere, RecetteMensuelle).
+
+Chaque écriture de paiement y reporte sa différence (montant, nombre, à temps /
+en retard) par UPDATE ... SET x = x + delta sur la ligne (jour ou mois, taxe,
+mode, type de contribuable, zone). Un changement de type ou de zone d'un contribuable
+déplace ses paiements d'une ligne à l'autre.
+
+Les tableaux de bord lisent ces tables : leur coût dépend du nombre de jours
+ou de mois, plus du nombre de paiements. Les helpers mensuel_* existent aussi
+pour un queryset de paiements, quand une période au jour près est demandée.
+Les séries des graphiques sont dans series.py.
+"""
+import calendar
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce, TruncMonth
+
+AXES = ('taxe_redevance', 'mode_paiement', 'type_contribuable', 'zone')
+MESURES = ('montant', 'nombre', 'nombre_a_temps', 'nombre_en_retard')
+
+
+def debut_mois(jour):
+    return date(jour.year, jour.month, 1)
+
+
+def axes_contribuable(contribuable_id):
+    """(type_contribuable, zone) d'un contribuable ; zone 0 s'il n'est pas localisé."""
+    from .models import Contribuable
+
+    ligne = (
+        Contribuable.objects.filter(pk=contribuable_id)
+        .values_list('type_contribuable', 'localisation__zone_id').first()
+    )
+    if ligne is None:
+        return '', 0
+    return ligne[0] or '', ligne[1] or 0
+
+
+def _mesures(etat, signe):
+    echeance, jour = etat['date_echeance'], etat['date_paiement']
+    return [
+        signe * (etat['montant'] or 0),
+        signe,
+        signe * int(bool(echeance) and jour <= echeance),
+        signe * int(bool(echeance) and jour > echeance),
+    ]
+
+
+def _cumuler(mouvements, cle, valeurs):
+    courant = mouvements.setdefault(cle, [0, 0, 0, 0])
+    for i, v in enumerate(valeurs):
+        courant[i] += v
+
+
+def _appliquer(modele, champ_date, mouvements):
+    for cle, valeurs in mouvements.items():
+        if not any(valeurs):
+            continue
+        filtre = dict(zip((champ_date,) + AXES, cle))
+        increments = {m: F(m) + v for m, v in zip(MESURES, valeurs)}
+        if modele.objects.filter(**filtre).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                modele.objects.create(**filtre, **dict(zip(MESURES, valeurs)))
+        except IntegrityError:
+            modele.objects.filter(**filtre).update(**increments)
+
+
+def appliquer(mouvements):
+    """
+    Applique {(jour, taxe, mode, type, zone): [montant, nombre, a_temps, en_retard]}
+    à RecetteJournaliere, puis, regroupés par mois, à RecetteMensuelle.
+    Ligne absente : créée ; création concurrente : on retombe sur l'incrément.
+    """
+    from .models import RecetteJournaliere, RecetteMensuelle
+
+    par_mois = {}
+    for (jour, *axes), valeurs in mouvements.items():
+        _cumuler(par_mois, (debut_mois(jour), *axes), valeurs)
+    _appliquer(RecetteJournaliere, 'jour', mouvements)
+    _appliquer(RecetteMensuelle, 'mois', par_mois)
+
+
+def paiement_modifie(ancien, nouveau):
+    """
+    Reporte un paiement créé (ancien=None), modifié ou supprimé (nouveau=None).
+    ancien / nouveau : dicts des champs Paiement.CHAMPS_SUIVIS.
+    """
+    mouvements = {}
+    axes = {}
+    for etat, signe in ((ancien, -1), (nouveau, 1)):
+        if etat is None or etat['date_paiement'] is None:
+            continue
+        cid = etat['contribuable_id']
+        if cid not in axes:
+            axes[cid] = axes_contribuable(cid)
+        type_contribuable, zone = axes[cid]
+        cle = (etat['date_paiement'], etat['taxe_redevance'] or '',
+               etat['mode_paiement'], type_contribuable, zone)
+        _cumuler(mouvements, cle, _mesures(etat, signe))
+    appliquer(mouvements)
+
+
+def reporter_paiements(etats, signe=1):
+    """
+    Reporte en une passe des paiements créés hors save() (import en masse) ;
+    signe=-1 pour les retirer.
+    etats : dicts des champs Paiement.CHAMPS_SUIVIS plus 'type_contribuable' et 'zone'.
+    """
+    mouvements = {}
+    for etat in etats:
+        if etat['date_paiement'] is None:
+            continue
+        cle = (etat['date_paiement'], etat['taxe_redevance'] or '', etat['mode_paiement'],
+               etat['type_contribuable'] or '', etat['zone'] or 0)
+        _cumuler(mouvements, cle, _mesures(etat, signe))
+    appliquer(mouvements)
+
+
+def retirer_paiements(paiements):
+    """
+    Retire des cumuls des paiements sur le point d'être supprimés hors delete()
+    (suppression en masse) : une requête d'agrégat, puis un incrément par ligne de cumul.
+    """
+    mouvements = {}
+    lignes = _par_periode_et_axes(
+        paiements, 'jour', 'contribuable__type_contribuable', 'contribuable__localisation__zone_id',
+    )
+    for ligne in lignes:
+        cle = (ligne['jour'], ligne['taxe_redevance'] or '', ligne['mode_paiement'],
+               ligne['contribuable__type_contribuable'] or '', ligne['contribuable__localisation__zone_id'] or 0)
+        _cumuler(mouvements, cle, [-(ligne[m] or 0) for m in MESURES])
+    appliquer(mouvements)
+
+
+def deplacer_contribuable(contribuable_id, type_contribuable=None, zone=None):
+    """
+    Déplace les recettes d'un contribuable dont le type ou la zone a changé.
+    type_contribuable / zone : (ancienne valeur, nouvelle valeur), ou None si inchangé.
+    """
+    from .models import Paiement
+
+    type_actuel, zone_actuelle = axes_contribuable(contribuable_id)
+    avant_type, apres_type = (type_contribuable or (type_actuel, type_actuel))
+    avant_zone, apres_zone = (zone or (zone_actuelle, zone_actuelle))
+    avant = (avant_type or '', avant_zone or 0)
+    apres = (apres_type or '', apres_zone or 0)
+    if avant == apres:
+        return
+
+    mouvements = {}
+    for ligne in _par_periode_et_axes(Paiement.objects.filter(contribuable_id=contribuable_id), 'jour'):
+        valeurs = [ligne[m] for m in MESURES]
+        base = (ligne['jour'], ligne['taxe_redevance'] or '', ligne['mode_paiement'])
+        _cumuler(mouvements, base + avant, [-v for v in valeurs])
+        _cumuler(mouvements, base + apres, valeurs)
+    appliquer(mouvements)
+
+
+def retirer_zone(zone_id):
+    """Fait passer les recettes d'une zone supprimée en « sans zone »."""
+    from .models import RecetteJournaliere, RecetteMensuelle
+
+    for modele, champ_date in ((RecetteJournaliere, 'jour'), (RecetteMensuelle, 'mois')):
+        lignes = modele.objects.filter(zone=zone_id)
+        mouvements = {}
+        for ligne in lignes.values(champ_date, *AXES, *MESURES):
+            valeurs = [ligne[m] for m in MESURES]
+            _cumuler(mouvements, (ligne[champ_date],) + tuple(ligne[a] for a in AXES[:-1]) + (0,), valeurs)
+        lignes.delete()
+        _appliquer(modele, champ_date, mouvements)
+
+
+def _par_periode_et_axes(paiements, champ_date, *axes_supplementaires):
+    """Mesures des paiements par jour (champ_date='jour') ou par mois ('mois') et par taxe / mode."""
+    periode = TruncMonth('date_paiement') if champ_date == 'mois' else F('date_paiement')
+    return (
+        paiements.order_by()
+        .annotate(**{champ_date: periode})
+        .values(champ_date, 'taxe_redevance', 'mode_paiement', *axes_supplementaires)
+        .annotate(
+            montant=Sum('montant'),
+            nombre=Count('id'),
+            nombre_a_temps=Count('id', filter=Q(date_paiement__lte=F('date_echeance'))),
+            nombre_en_retard=Count('id', filter=Q(date_paiement__gt=F('date_echeance'))),
+        )
+    )
+
+
+def reconstruire(depuis=None, taille_lot=1000):
+    """
+    Recalcule les tables de cumul (jour et mois) depuis les paiements : tout,
+    ou à partir du mois `depuis`. Retourne le nombre de lignes mensuelles.
+    """
+    from .models import Paiement, RecetteJournaliere, RecetteMensuelle
+
+    paiements = Paiement.objects.all()
+    if depuis:
+        paiements = paiements.filter(date_paiement__gte=debut_mois(depuis))
+
+    with transaction.atomic():
+        for modele, champ_date in ((RecetteJournaliere, 'jour'), (RecetteMensuelle, 'mois')):
+            existantes = modele.objects.all()
+            if depuis:
+                existantes = existantes.filter(**{f'{champ_date}__gte': debut_mois(depuis)})
+            existantes.delete()
+            lignes = _par_periode_et_axes(
+                paiements, champ_date,
+                'contribuable__type_contribuable', 'contribuable__localisation__zone_id',
+            )
+            modele.objects.bulk_create(
+                (
+                    modele(**{
+                        champ_date: ligne[champ_date],
+                        'taxe_redevance': ligne['taxe_redevance'] or '',
+                        'mode_paiement': ligne['mode_paiement'],
+                        'type_contribuable': ligne['contribuable__type_contribuable'] or '',
+                        'zone': ligne['contribuable__localisation__zone_id'] or 0,
+                        **{m: ligne[m] for m in MESURES},
+                    })
+                    for ligne in lignes.iterator()
+                ),
+                batch_size=taille_lot,
+            )
+    return RecetteMensuelle.objects.count()
+
+
+# --- Lecture -----------------------------------------------------------------
+
+def mois_entiers(debut, fin):
+    """
+    (premier mois, dernier mois) si la période [debut, fin] couvre des mois
+    entiers (bornes absentes acceptées), sinon None : la table ne suffit pas.
+    """
+    if debut and debut.day != 1:
+        return None
+    if fin and fin.day != calendar.monthrange(fin.year, fin.month)[1]:
+        return None
+    return (debut_mois(debut) if debut else None, debut_mois(fin) if fin else None)
+
+
+def recettes(debut=None, fin=None, **filtres):
+    """Lignes de cumul entre deux mois (inclus), filtrées sur les axes."""
+    from .models import RecetteMensuelle
+
+    qs = RecetteMensuelle.objects.filter(**filtres)
+    if debut:
+        qs = qs.filter(mois__gte=debut_mois(debut))
+    if fin:
+        qs = qs.filter(mois__lte=debut_mois(fin))
+    return qs
+
+
+def _zero(champ):
+    return Coalesce(Sum(champ), Value(0), output_field=DecimalField() if champ == 'montant' else None)
+
+
+def agreger_recettes(qs):
+    """{'montant', 'nombre', 'nombre_a_temps', 'nombre_en_retard'} sur des lignes de cumul."""
+    return qs.aggregate(**{m: _zero(m) for m in MESURES})
+
+
+def _mesures_paiements():
+    return {
+        'montant': Sum('montant'),
+        'count': Count('id'),
+        'nombre_a_temps': Count('id', filter=Q(date_paiement__lte=F('date_echeance'))),
+        'nombre_en_retard': Count('id', filter=Q(date_paiement__gt=F('date_echeance'))),
+    }
+
+
+def mensuel_recettes(qs):
+    """
+    {date(AAAA, MM, 1): {'montant', 'count', 'nombre_a_temps', 'nombre_en_retard'}}
+    à partir des lignes de cumul, en une requête.
+    """
+    lignes = qs.order_by().values('mois').annotate(
+        montant=Sum('montant'), count=Sum('nombre'),
+        nombre_a_temps=Sum('nombre_a_temps'), nombre_en_retard=Sum('nombre_en_retard'),
+    )
+    return {ligne['mois']: ligne for ligne in lignes}
+
+
+def mensuel_paiements(paiements):
+    """Même forme que mensuel_recettes, calculée sur des paiements (une requête)."""
+    lignes = (
+        paiements.order_by().annotate(mois=TruncMonth('date_paiement'))
+        .values('mois').annotate(**_mesures_paiements())
+    )
+    return {debut_mois(ligne['mois']): ligne for ligne in lignes if ligne['mois']}
+
+
+def totaliser(par_mois):
+    """Totaux d'un résultat mensuel_* (sans requête supplémentaire)."""
+    totaux = {'montant': 0, 'nombre': 0, 'nombre_a_temps': 0, 'nombre_en_retard': 0}
+    for ligne in par_mois.values():
+        totaux['montant'] += ligne['montant'] or 0
+        totaux['nombre'] += ligne['count'] or 0
+        totaux['nombre_a_temps'] += ligne['nombre_a_temps'] or 0
+        totaux['nombre_en_retard'] += ligne['nombre_en_retard'] or 0
+    return totaux
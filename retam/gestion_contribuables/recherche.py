@@ -0,0 +1,67 @@
+# gestion_contribuables/recherche.py
+"""
+Recherche de contribuables (admin et ContribuableListView).
+
+S'appuie sur des index GIN pg_trgm (migration 0012) :
+- nom : sur UPPER(retam_unaccent(nom)), « Diène » est trouvé par « diene » ;
+- nif, téléphone, email, référence : sur UPPER(col), l'expression qu'utilise
+  icontains, donc l'index sert aussi aux recherches de l'admin par défaut.
+
+Les résultats sont triés par pertinence : correspondance exacte de NIF,
+référence ou téléphone d'abord, puis similarité de mots (trigrammes) sur le nom,
+qui rattrape aussi les fautes de frappe.
+"""
+import unicodedata
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import Case, FloatField, Func, Q, TextField, Value, When
+from django.db.models.functions import Greatest, Upper
+
+# remplacements que unaccent fait et que NFKD ne fait pas
+LIGATURES = {'Œ': 'OE', 'Æ': 'AE', 'ß': 'SS'}
+
+
+class SansAccents(Func):
+    """retam_unaccent(texte) : unaccent() déclarée IMMUTABLE, utilisable dans un index."""
+    function = 'retam_unaccent'
+    output_field = TextField()
+
+
+def plier(texte):
+    """Même repli que UPPER(retam_unaccent(...)) côté SQL, pour le terme recherché."""
+    texte = texte.strip().upper()
+    for ligature, remplacement in LIGATURES.items():
+        texte = texte.replace(ligature, remplacement)
+    decompose = unicodedata.normalize('NFKD', texte)
+    return ''.join(c for c in decompose if not unicodedata.combining(c))
+
+
+def rechercher_contribuables(queryset, terme):
+    """Contribuables correspondant à `terme`, annotés `pertinence` et triés par pertinence."""
+    terme_plie = plier(terme)
+    if not terme_plie:
+        return queryset
+    brut = terme.strip()
+
+    qs = queryset.annotate(nom_plie=Upper(SansAccents('nom')))
+    correspond = (
+        Q(nom_plie__contains=terme_plie)
+        | Q(nif__icontains=brut)
+        | Q(telephone__icontains=brut)
+        | Q(email__icontains=brut)
+        | Q(reference__icontains=brut)
+    )
+    if len(terme_plie) >= 3:
+        # fautes de frappe : opérateur %> de pg_trgm, servi par le même index
+        correspond |= Q(nom_plie__trigram_word_similar=terme_plie)
+
+    return qs.filter(correspond).annotate(
+        pertinence=Case(
+            When(Q(nif__iexact=brut) | Q(reference__iexact=brut) | Q(telephone=brut), then=Value(2.0)),
+            default=Greatest(
+                TrigramWordSimilarity(Value(terme_plie), 'nom_plie'),
+                Case(When(nom_plie__startswith=terme_plie, then=Value(1.0)), default=Value(0.0)),
+            ),
+            output_field=FloatField(),
+        )
+    ).order_by('-pertinence', 'nom')
@@ -0,0 +1,146 @@
+# gestion_contribuables/relances.py
+"""
+Relances automatiques (tâche nocturne lancer_relances, CELERY_BEAT_SCHEDULE).
+
+Un contribuable est relançable s'il est actif, accepte les notifications, a un
+e-mail et si son échéance est dépassée d'au moins le premier palier de
+RELANCE_NIVEAUX sans que les paiements de cette échéance (Paiement.date_echeance,
+reprise de celle du contribuable à la saisie) couvrent montant_a_payer.
+total_paye ne convient pas : il cumule toutes les périodes. Une seule requête
+sur Contribuable (index partiel contribuable_relance_idx), la somme par
+échéance étant une sous-requête sur l'index paiement_echeance_idx.
+
+Le palier visé dépend de l'ancienneté du retard ; seuls les contribuables sans
+relance de ce palier (ou d'un palier supérieur) pour cette échéance sont
+retenus : chaque passage ne traite que les nouveaux retards et les changements
+de palier. Traitement par tranches (parcours par pk), une transaction par tranche :
+Relance + NotificationSortante, puis envoi par la boîte d'envoi (notifications.py).
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    Case, DecimalField, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 500
+VERROU = 'relances:en_cours'
+VERROU_TIMEOUT = 3600
+
+
+def contribuables_a_relancer(jour=None):
+    """Contribuables à relancer au `jour` donné, annotés de niveau_cible et reste_du."""
+    from .models import Contribuable, Paiement, Relance, RELANCE_NIVEAUX
+
+    jour = jour or timezone.localdate()
+    paliers = sorted(RELANCE_NIVEAUX, key=lambda palier: palier[1], reverse=True)
+    premier_delai = paliers[-1][1]
+    deja_relance = Relance.objects.filter(
+        contribuable=OuterRef('pk'),
+        date_echeance=OuterRef('date_echeance'),
+        niveau__gte=OuterRef('niveau_cible'),
+    )
+    paye_echeance = (
+        Paiement.objects
+        .filter(contribuable=OuterRef('pk'), date_echeance=OuterRef('date_echeance'))
+        .order_by().values('contribuable')
+        .annotate(total=Sum('montant')).values('total')
+    )
+    return (
+        Contribuable.objects
+        .filter(
+            actif=True,
+            notifier_retards=True,
+            date_echeance__lte=jour - timedelta(days=premier_delai),
+            montant_a_payer__gt=0,
+            email__gt='',
+        )
+        .annotate(
+            niveau_cible=Case(
+                *[When(date_echeance__lte=jour - timedelta(days=jours), then=Value(niveau))
+                  for niveau, jours, _ in paliers],
+                output_field=IntegerField(),
+            ),
+            reste_du=ExpressionWrapper(
+                F('montant_a_payer') - Coalesce(
+                    Subquery(paye_echeance), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2),
+                ),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        .filter(~Exists(deja_relance), reste_du__gt=0)
+    )
+
+
+def _traiter_lot(lignes):
+    from .models import NotificationSortante, Relance
+    from .notifications import mettre_en_file
+
+    def cle(contribuable_id, echeance, niveau):
+        return f"relance:{contribuable_id}:{echeance:%Y%m%d}:{niveau}"
+
+    with transaction.atomic():
+        mettre_en_file(
+            NotificationSortante(
+                contribuable_id=contribuable_id,
+                type_notification='relance',
+                cle_deduplication=cle(contribuable_id, echeance, niveau),
+                destinataire=email,
+            )
+            for contribuable_id, email, echeance, niveau, _ in lignes
+        )
+        notifications = dict(
+            NotificationSortante.objects
+            .filter(cle_deduplication__in=[cle(c, e, n) for c, _, e, n, _ in lignes])
+            .values_list('cle_deduplication', 'pk')
+        )
+        Relance.objects.bulk_create(
+            [
+                Relance(
+                    contribuable_id=contribuable_id, date_echeance=echeance, niveau=niveau, montant_du=reste,
+                    notification_id=notifications.get(cle(contribuable_id, echeance, niveau)),
+                )
+                for contribuable_id, _, echeance, niveau, reste in lignes
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def lancer_relances(jour=None, taille_lot=TAILLE_LOT):
+    """Crée et met en file les relances dues. Retourne {niveau: nombre}."""
+    if not cache.add(VERROU, 1, VERROU_TIMEOUT):
+        logger.info("Relances déjà en cours, passage ignoré")
+        return {}
+
+    debut = time.monotonic()
+    compteurs = {}
+    try:
+        a_relancer = contribuables_a_relancer(jour).order_by('pk')
+        dernier = 0
+        while True:
+            lignes = list(
+                a_relancer.filter(pk__gt=dernier)
+                .values_list('pk', 'email', 'date_echeance', 'niveau_cible', 'reste_du')[:taille_lot]
+            )
+            if not lignes:
+                break
+            _traiter_lot(lignes)
+            for ligne in lignes:
+                compteurs[ligne[3]] = compteurs.get(ligne[3], 0) + 1
+            dernier = lignes[-1][0]
+    finally:
+        cache.delete(VERROU)
+
+    logger.info(
+        "Relances : %s en %.1fs",
+        ", ".join(f"{nombre} de niveau {niveau}" for niveau, nombre in sorted(compteurs.items())) or "aucune",
+        time.monotonic() - debut,
+    )
+    return compteurs
@@ -0,0 +1,149 @@
+# gestion_contribuables/series.py
+"""
+Séries temporelles des recettes pour les graphiques (jour, semaine, mois, année),
+éventuellement découpées par taxe, mode de paiement, zone ou type de contribuable.
+
+Tout est lu dans les tables de cumul : RecetteMensuelle quand la période tombe
+sur des mois entiers et que le pas est le mois ou l'année, RecetteJournaliere
+sinon. Les périodes sans paiement sont complétées par des zéros ici, et le
+résultat est mis en cache jusqu'à la prochaine écriture (tableau_de_bord.py).
+"""
+import hashlib
+from datetime import date, timedelta
+
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek, TruncYear
+
+from .recettes import mois_entiers
+from .tableau_de_bord import donnees_tableau_de_bord
+
+PAS = ('jour', 'semaine', 'mois', 'annee')
+# paramètre d'URL -> colonne des tables de cumul
+DECOUPAGES = {
+    'taxe': 'taxe_redevance',
+    'mode': 'mode_paiement',
+    'zone': 'zone',
+    'type': 'type_contribuable',
+}
+MAX_PERIODES = 4000
+
+
+class SerieInvalide(ValueError):
+    pass
+
+
+def debut_periode(jour, pas):
+    if pas == 'jour':
+        return jour
+    if pas == 'semaine':
+        return jour - timedelta(days=jour.weekday())
+    if pas == 'mois':
+        return date(jour.year, jour.month, 1)
+    return date(jour.year, 1, 1)
+
+
+def periode_suivante(jour, pas):
+    if pas == 'jour':
+        return jour + timedelta(days=1)
+    if pas == 'semaine':
+        return jour + timedelta(days=7)
+    if pas == 'mois':
+        return date(jour.year + jour.month // 12, jour.month % 12 + 1, 1)
+    return date(jour.year + 1, 1, 1)
+
+
+def periodes(debut, fin, pas):
+    """Débuts de toutes les périodes couvrant [debut, fin], y compris celles sans paiement."""
+    resultat = []
+    courant = debut_periode(debut, pas)
+    while courant <= fin:
+        resultat.append(courant)
+        if len(resultat) > MAX_PERIODES:
+            raise SerieInvalide(f"Plus de {MAX_PERIODES} périodes : choisir un pas plus large")
+        courant = periode_suivante(courant, pas)
+    return resultat
+
+
+def libelles(par):
+    from geolocalisation.models import Zone
+    from .models import Paiement, TYPE_CONTRIBUABLE_CHOICES
+
+    if par == 'taxe':
+        return dict(Paiement.TAXE_REDEVANCE_CHOICES)
+    if par == 'mode':
+        return dict(Paiement.MODES_PAIEMENT)
+    if par == 'type':
+        return dict(TYPE_CONTRIBUABLE_CHOICES)
+    if par == 'zone':
+        return {0: "Sans zone", **dict(Zone.objects.values_list('id', 'nom'))}
+    return {}
+
+
+def _calculer(debut, fin, pas, par, filtres):
+    from .models import RecetteJournaliere, RecetteMensuelle
+
+    if pas in ('mois', 'annee') and mois_entiers(debut, fin) is not None:
+        modele, champ = RecetteMensuelle, 'mois'
+    else:
+        modele, champ = RecetteJournaliere, 'jour'
+    troncature = {
+        'jour': F(champ),
+        'semaine': TruncWeek(champ),
+        'mois': TruncMonth(champ),
+        'annee': TruncYear(champ),
+    }[pas]
+    colonnes = ['periode'] + ([DECOUPAGES[par]] if par else [])
+
+    lignes = (
+        modele.objects.filter(**{f'{champ}__gte': debut, f'{champ}__lte': fin}, **filtres)
+        .order_by().annotate(periode=troncature)
+        .values(*colonnes).annotate(montant=Sum('montant'), nombre=Sum('nombre'))
+    )
+
+    axe = periodes(debut, fin, pas)
+    index = {p: i for i, p in enumerate(axe)}
+    series = {}
+    for ligne in lignes:
+        cle = ligne[DECOUPAGES[par]] if par else 'total'
+        serie = series.setdefault(cle, {'montants': [0.0] * len(axe), 'nombres': [0] * len(axe)})
+        i = index[debut_periode(ligne['periode'], pas)]
+        serie['montants'][i] += float(ligne['montant'] or 0)
+        serie['nombres'][i] += ligne['nombre'] or 0
+
+    noms = libelles(par)
+    return {
+        'pas': pas,
+        'debut': debut.isoformat(),
+        'fin': fin.isoformat(),
+        'par': par,
+        'periodes': [p.isoformat() for p in axe],
+        'series': [
+            {
+                'cle': cle,
+                'libelle': noms.get(cle, cle or 'Non défini') if par else 'Total',
+                'montants': serie['montants'],
+                'nombres': serie['nombres'],
+                'total': sum(serie['montants']),
+            }
+            for cle, serie in sorted(series.items(), key=lambda item: -sum(item[1]['montants']))
+        ],
+        'total': sum(sum(serie['montants']) for serie in series.values()),
+    }
+
+
+def serie_recettes(debut, fin, pas='mois', par=None, filtres=None):
+    """
+    Série des recettes entre debut et fin (inclus).
+    filtres : valeurs exactes sur les axes (taxe_redevance, mode_paiement, zone, type_contribuable).
+    """
+    if pas not in PAS:
+        raise SerieInvalide(f"pas inconnu : {pas}")
+    if par and par not in DECOUPAGES:
+        raise SerieInvalide(f"découpage inconnu : {par}")
+    if debut > fin:
+        raise SerieInvalide("debut doit précéder fin")
+    filtres = filtres or {}
+    periodes(debut, fin, pas)  # contrôle du nombre de points avant toute requête
+
+    empreinte = hashlib.sha1(repr((debut, fin, pas, par, sorted(filtres.items()))).encode()).hexdigest()
+    return donnees_tableau_de_bord(f'serie:{empreinte}', lambda: _calculer(debut, fin, pas, par, filtres))
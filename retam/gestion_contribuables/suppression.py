@@ -0,0 +1,117 @@
+# gestion_contribuables/suppression.py
+"""
+Suppression en masse de contribuables (action admin « Supprimer les contribuables sélectionnés »).
+
+obj.delete() en boucle relance le collecteur de Django pour chaque contribuable
+et, à cause des signaux de Paiement, charge puis supprime chaque paiement un
+par un (cumuls et total_paye mis à jour ligne par ligne). Ici :
+- les dépendances (CASCADE / SET_NULL) sont lues une fois dans les métadonnées
+  des modèles, puis supprimées par DELETE ... WHERE fk IN (...) par tranches,
+  le tout dans une seule transaction, sans signaux ;
+- les tables de cumul sont compensées en une agrégation par tranche
+  (total_paye est sans objet : ses contribuables disparaissent) ;
+- après validation, une tâche retire les fichiers devenus orphelins
+  (quittances, pièces d'identité) et les quittances HTML en cache.
+"""
+import logging
+import time
+
+from django.db import models, transaction
+from django.db.models.deletion import ProtectedError, RestrictedError
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 500
+GERES = (models.CASCADE, models.SET_NULL, models.PROTECT, models.RESTRICT)
+
+
+def _tranches(ids, taille):
+    for i in range(0, len(ids), taille):
+        yield ids[i:i + taille]
+
+
+def _supprimer_avec_dependances(modele, qs, compteurs):
+    """
+    DELETE de `qs` et de ce qui en dépend, sans charger d'objets ni envoyer de
+    signaux. CASCADE : récursif ; SET_NULL : UPDATE ; PROTECT / RESTRICT : erreur.
+    Tout autre on_delete (SET_DEFAULT, SET(...), DO_NOTHING) lève
+    NotImplementedError : passer par Model.delete() ou compléter ce parcours.
+    """
+    for relation in modele._meta.related_objects:
+        if relation.many_to_many:
+            continue
+        if relation.on_delete not in GERES:
+            raise NotImplementedError(
+                f"{relation.related_model._meta.label}.{relation.field.name} : on_delete="
+                f"{getattr(relation.on_delete, '__name__', relation.on_delete)} non géré par la suppression en masse"
+            )
+        liees = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': qs})
+        if relation.on_delete is models.CASCADE:
+            _supprimer_avec_dependances(relation.related_model, liees, compteurs)
+        elif relation.on_delete is models.SET_NULL:
+            liees.update(**{relation.field.name: None})
+        elif liees.exists():
+            erreur = ProtectedError if relation.on_delete is models.PROTECT else RestrictedError
+            raise erreur(f"{relation.related_model._meta.verbose_name_plural} liés empêchent la suppression", set())
+    # _raw_delete : DELETE direct, sans collecteur (les dépendances viennent d'être traitées)
+    nombre = qs._raw_delete(qs.db)
+    label = modele._meta.label
+    compteurs[label] = compteurs.get(label, 0) + nombre
+
+
+def supprimer_contribuables(queryset, utilisateur=None, taille_lot=TAILLE_LOT):
+    """Supprime les contribuables de `queryset` et leurs dépendances. Retourne {modèle: nombre supprimé}."""
+    from .models import Contribuable, Paiement, envoyer_tache
+    from .recettes import retirer_paiements
+    from .tableau_de_bord import nouvelle_generation
+
+    debut = time.monotonic()
+    ids = list(queryset.order_by().values_list('pk', flat=True))
+    compteurs = {}
+    fichiers = set()
+
+    with transaction.atomic():
+        for lot in _tranches(ids, taille_lot):
+            contribuables = Contribuable._base_manager.filter(pk__in=lot)
+            paiements = Paiement._base_manager.filter(contribuable_id__in=lot)
+            # noms relevés avant suppression ; les fichiers partent après le commit
+            fichiers.update(paiements.exclude(fichier_quittance='').values_list('fichier_quittance', flat=True))
+            fichiers.update(contribuables.exclude(piece_identite='').values_list('piece_identite', flat=True))
+            retirer_paiements(paiements)
+            _supprimer_avec_dependances(Contribuable, contribuables, compteurs)
+
+        fichiers.discard(None)
+        transaction.on_commit(nouvelle_generation)
+        transaction.on_commit(lambda: envoyer_tache('nettoyer_apres_suppression', ids, sorted(fichiers)))
+
+    logger.info(
+        "Suppression en masse par %s : %s, %d fichier(s) à vérifier, %.1fs",
+        getattr(utilisateur, 'username', None) or "système",
+        ", ".join(f"{nombre} {label}" for label, nombre in sorted(compteurs.items())) or "rien",
+        len(fichiers), time.monotonic() - debut,
+    )
+    return compteurs
+
+
+def nettoyer_fichiers(noms):
+    """Supprime du stockage les fichiers qu'aucun paiement ni contribuable restant ne référence."""
+    from django.core.files.storage import default_storage
+    from .models import Contribuable, Paiement
+
+    supprimes = 0
+    for lot in _tranches(list(noms), TAILLE_LOT):
+        # quittances adressées par contenu : un même PDF peut servir à un autre paiement
+        encore_utilises = set(
+            Paiement.objects.filter(fichier_quittance__in=lot).values_list('fichier_quittance', flat=True)
+        ) | set(
+            Contribuable.objects.filter(piece_identite__in=lot).values_list('piece_identite', flat=True)
+        )
+        for nom in lot:
+            if nom in encore_utilises:
+                continue
+            try:
+                default_storage.delete(nom)
+                supprimes += 1
+            except OSError as e:
+                logger.warning("Fichier %s non supprimé : %s", nom, e)
+    return supprimes
@@ -0,0 +1,66 @@
+# gestion_contribuables/tableau_de_bord.py
+"""
+Cache des données du tableau de bord admin.
+
+Une « génération » globale est changée à chaque écriture sur Paiement,
+Contribuable, Zone ou LocalisationContribuable (signaux dans models.py).
+Une entrée en cache calculée pour une autre génération est périmée.
+
+Après invalidation, un seul processus recalcule (verrou cache.add) ; les
+autres servent la valeur périmée en attendant, plutôt que de lancer tous
+le même calcul en même temps.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLE_GENERATION = 'tableau_de_bord:generation'
+# durée de conservation d'une entrée : elle doit survivre pour être servie périmée
+CONSERVATION = 60 * 60 * 24
+VERROU_TIMEOUT = 60
+
+
+def generation():
+    valeur = cache.get(CLE_GENERATION)
+    if valeur is None:
+        # clé évincée : nouvelle valeur, aucune entrée existante ne sera prise pour fraîche
+        cache.add(CLE_GENERATION, time.time_ns(), None)
+        valeur = cache.get(CLE_GENERATION)
+    return valeur
+
+
+def nouvelle_generation():
+    cache.set(CLE_GENERATION, time.time_ns(), None)
+
+
+def donnees_tableau_de_bord(nom, calculer):
+    """
+    Retourne calculer() mis en cache pour la génération courante.
+    Les fenêtres glissantes (30 derniers jours...) sont aussi recalculées après
+    TABLEAU_DE_BORD_TTL secondes, même sans écriture.
+    """
+    cle = f'tableau_de_bord:{nom}'
+    ttl = getattr(settings, 'TABLEAU_DE_BORD_TTL', 300)
+    courante = generation()
+    entree = cache.get(cle)
+    if entree and entree['generation'] == courante and time.time() - entree['calcule_le'] < ttl:
+        return entree['valeur']
+
+    if not cache.add(f'{cle}:verrou', 1, VERROU_TIMEOUT):
+        if entree:
+            return entree['valeur']
+        # rien à servir (premier calcul) : on calcule sans mettre en cache
+        return calculer()
+
+    try:
+        debut = time.perf_counter()
+        valeur = calculer()
+        cache.set(cle, {'generation': courante, 'calcule_le': time.time(), 'valeur': valeur}, CONSERVATION)
+        logger.debug("Tableau de bord %s recalculé en %.0f ms", nom, (time.perf_counter() - debut) * 1000)
+        return valeur
+    finally:
+        cache.delete(f'{cle}:verrou')
@@ -0,0 +1,68 @@
+# gestion_contribuables/tasks.py
+"""Tâches Celery : travaux lourds sortis du cycle requête/réponse."""
+import logging
+
+try:
+    from celery import shared_task
+except ImportError:  # celery absent (requirements cPanel) : exécution synchrone
+    def shared_task(*args, **options):
+        def decorateur(func):
+            func.delay = func
+            return func
+        if args and callable(args[0]):
+            return decorateur(args[0])
+        return decorateur
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def generer_quittance(paiement_id):
+    """Génère le PDF de la quittance d'un paiement (après commit de l'enregistrement)."""
+    from .models import Paiement
+
+    paiement = Paiement.objects.select_related('contribuable').filter(pk=paiement_id).first()
+    if paiement is None:
+        logger.info("Quittance ignorée : paiement %s supprimé", paiement_id)
+        return None
+    # même verrou que la génération à la demande : un seul rendu par paiement
+    return paiement.assurer_quittance()
+
+
+@shared_task
+def envoyer_notifications():
+    """Vide la boîte d'envoi (après chaque mise en file, et chaque minute via CELERY_BEAT_SCHEDULE)."""
+    from .notifications import envoyer_notifications as vider_boite_envoi
+
+    return vider_boite_envoi()
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def generer_quittances_lot(paiement_ids):
+    """Lot de la génération en masse (action admin « Générer les quittances manquantes »)."""
+    from .quittances import rendre_lot, enregistrer_lot
+
+    generees, erreurs = rendre_lot(paiement_ids)
+    enregistrer_lot(generees, erreurs)
+    return len(generees), len(erreurs)
+
+
+@shared_task
+def nettoyer_apres_suppression(contribuable_ids, fichiers):
+    """Après une suppression en masse : fichiers orphelins et quittances HTML en cache."""
+    from .quittances import invalider_quittances_html
+    from .suppression import nettoyer_fichiers
+
+    for contribuable_id in contribuable_ids:
+        invalider_quittances_html(contribuable_id)
+    supprimes = nettoyer_fichiers(fichiers)
+    logger.info("Nettoyage après suppression : %d fichier(s) supprimé(s) sur %d", supprimes, len(fichiers))
+    return supprimes
+
+
+@shared_task
+def lancer_relances():
+    """Relances nocturnes des échéances impayées (CELERY_BEAT_SCHEDULE)."""
+    from .relances import lancer_relances as relancer
+
+    return relancer()
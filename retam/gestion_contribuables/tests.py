@@ -1,3 +1,1517 @@
-from django.test import TestCase
+import json
+import smtplib
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+
+from .models import Contribuable, HistoriqueModification, NotificationSortante, Paiement, RecetteMensuelle, Relance
+from .fusion_pdf import FusionPDF
+from .importation import importer
+from .notifications import envoyer_notifications, notifier_retards
+from .quittances import get_renderer
+from .relances import lancer_relances
+from . import views
+
+
+class StatsRequetesTests(TestCase):
+    """Les endpoints de statistiques font un nombre de requêtes fixe, quel que soit le volume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user('agent', password='x', is_staff=True)
+        for i, (type_c, actif) in enumerate([('physique', True), ('morale', True), ('physique', False)]):
+            contribuable = Contribuable.objects.create(
+                nom=f"Contribuable {i}", type_contribuable=type_c, actif=actif,
+                adresse="Mbour", telephone="771234567",
+            )
+            for mois in (1, 2, 3):
+                Paiement.objects.create(
+                    contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                    date_paiement=date(2026, mois, 10), date_echeance=date(2026, 2, 28),
+                )
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _post_dashboard(self, **donnees):
+        request = self.factory.post('/admin/dashboard_stats/', donnees, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        request.user = self.staff
+        return views.dashboard_stats(request)
+
+    def test_stats_contribuables(self):
+        request = self.factory.get('/stats/')
+        request.user = self.staff
+        with self.assertNumQueries(2):
+            response = views.stats_contribuables(request)
+        stats = json.loads(response.content)
+        self.assertEqual(stats['total_contribuables'], 3)
+        self.assertEqual(stats['contribuables_inactifs'], 1)
+        self.assertEqual(Decimal(str(stats['paiements_totaux'])), Decimal('9000'))
+        self.assertEqual(stats['paiements_a_temps'], 6)
+        self.assertEqual(stats['paiements_en_retard'], 3)
+
+    def test_dashboard_stats_mois_entiers(self):
+        with self.assertNumQueries(3):
+            response = self._post_dashboard(type='physique', debut='2026-01-01', fin='2026-02-28')
+        stats = json.loads(response.content)
+        self.assertTrue(stats['success'])
+        self.assertEqual(stats['paiements_a_temps'], 4)
+        self.assertEqual(stats['paiements_en_retard'], 0)
+
+    def test_dashboard_stats_periode_au_jour(self):
+        with self.assertNumQueries(3):
+            response = self._post_dashboard(debut='2026-01-05', fin='2026-03-15')
+        stats = json.loads(response.content)
+        self.assertEqual(stats['paiements_a_temps'], 6)
+        self.assertEqual(stats['paiements_en_retard'], 3)
+
+    def test_cumul_suit_modification_et_suppression(self):
+        paiement = Paiement.objects.filter(date_paiement__month=3).first()
+        paiement.date_paiement = date(2026, 1, 20)
+        paiement.save()
+        Paiement.objects.filter(date_paiement__month=2).first().delete()
+
+        request = self.factory.get('/stats/')
+        request.user = self.staff
+        stats = json.loads(views.stats_contribuables(request).content)
+        self.assertEqual(Decimal(str(stats['paiements_totaux'])), Decimal('8000'))
+        self.assertEqual(stats['paiements_a_temps'], 6)
+        self.assertEqual(stats['paiements_en_retard'], 2)
+
+
+class RecettesZoneTests(TestCase):
+    """Les cumuls par zone suivent la localisation du contribuable."""
+
+    def test_suppression_localisation(self):
+        from django.contrib.gis.geos import Point, Polygon
+        from geolocalisation.models import LocalisationContribuable, Zone
+
+        zone = Zone.objects.create(nom="Mbour 1", geom=Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0))))
+        contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        localisation = LocalisationContribuable.objects.create(
+            contribuable=contribuable, zone=zone, geom=Point(0.5, 0.5),
+        )
+        Paiement.objects.create(
+            contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+            date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28),
+        )
+        self.assertEqual(RecetteMensuelle.objects.get(montant__gt=0).zone, zone.pk)
+
+        localisation.delete()
+        self.assertEqual(RecetteMensuelle.objects.get(montant__gt=0).zone, 0)
+
+
+class TotalPayeTests(TestCase):
+    """total_paye suit les paiements par incréments et égale toujours Sum('paiements__montant')."""
+
+    def setUp(self):
+        self.a, self.b = [
+            Contribuable.objects.create(
+                nom=nom, type_contribuable='physique', adresse="Mbour", telephone="771234567",
+            )
+            for nom in ("A", "B")
+        ]
+
+    def _paiement(self, contribuable, montant):
+        return Paiement.objects.create(
+            contribuable=contribuable, montant=Decimal(montant), mode_paiement='ESP',
+            date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28),
+        )
+
+    def assertTotauxExacts(self, *attendus):
+        totaux = Contribuable.objects.annotate(
+            somme=Coalesce(Sum('paiements__montant'), Decimal('0')),
+        ).order_by('nom').values_list('total_paye', 'somme')
+        for total_paye, somme in totaux:
+            self.assertEqual(total_paye, somme)
+        self.assertEqual([total for total, _ in totaux], [Decimal(m) for m in attendus])
+
+    def test_creation_modification_transfert_suppression(self):
+        paiement = self._paiement(self.a, '1000')
+        self._paiement(self.a, '500')
+        self.assertTotauxExacts('1500', '0')
+
+        paiement.montant = Decimal('1200')
+        paiement.save()
+        self.assertTotauxExacts('1700', '0')
+
+        paiement = Paiement.objects.get(pk=paiement.pk)
+        paiement.contribuable = self.b
+        paiement.save()
+        self.assertTotauxExacts('500', '1200')
+
+        paiement.delete()
+        self.assertTotauxExacts('500', '0')
+
+    def test_reconcilier_total_paye(self):
+        from django.core.management import call_command
+
+        self._paiement(self.a, '1000')
+        self._paiement(self.b, '300')
+        Contribuable.objects.filter(pk=self.a.pk).update(total_paye=Decimal('42'))
+
+        sortie = StringIO()
+        call_command('reconcilier_total_paye', '--dry-run', stdout=sortie)
+        self.assertIn("1 écart(s)", sortie.getvalue())
+        self.assertEqual(Contribuable.objects.get(pk=self.a.pk).total_paye, Decimal('42'))
+
+        call_command('reconcilier_total_paye', '--taille-lot', '1', stdout=StringIO())
+        self.assertTotauxExacts('1000', '300')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QRCodeCacheTests(TestCase):
+    """QR des quittances : encodé une fois par contenu, oublié quand le contact change."""
+
+    def setUp(self):
+        from . import quittances
+
+        cache.clear()
+        lru = patch.dict(quittances._qr_lru, clear=True)
+        lru.start()
+        self.addCleanup(lru.stop)
+        self.quittances = quittances
+        self.contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+            email="c@retam.sn",
+        )
+
+    def test_encode_une_seule_fois(self):
+        q = self.quittances
+        with patch.object(q, '_encoder_qr', wraps=q._encoder_qr) as encoder:
+            premier = q.qr_base64(self.contribuable)
+            self.assertEqual(q.qr_base64(self.contribuable), premier)
+            # autre processus : LRU vide, le cache partagé suffit
+            q._qr_lru.clear()
+            self.assertEqual(q.qr_base64(self.contribuable), premier)
+        self.assertEqual(encoder.call_count, 1)
+
+    def test_contact_modifie_invalide(self):
+        q = self.quittances
+        ancienne_empreinte = q.qr_empreinte(q.qr_payload(self.contribuable))
+        ancienne_cle = q._qr_cle(ancienne_empreinte)
+        ancien = q.qr_base64(self.contribuable)
+        self.assertIsNotNone(cache.get(ancienne_cle))
+
+        self.contribuable.telephone = "779999999"
+        self.contribuable.save()
+
+        self.assertIsNone(cache.get(ancienne_cle))
+        self.assertNotIn(ancienne_empreinte, q._qr_lru)
+        self.assertNotEqual(q.qr_base64(self.contribuable), ancien)
+
+    def test_autre_champ_sans_effet(self):
+        q = self.quittances
+        cle = q._qr_cle(q.qr_empreinte(q.qr_payload(self.contribuable)))
+        q.qr_base64(self.contribuable)
+
+        self.contribuable.nom = "Nouveau nom"
+        self.contribuable.save()
+        self.assertIsNotNone(cache.get(cle))
+
+
+class PaiementAdminRequetesTests(TestCase):
+    """La liste admin des paiements coûte autant de requêtes à 10 000 paiements qu'à 10."""
+
+    url = '/admin/gestion_contribuables/paiement/'
+    budget = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@retam.sn', 'x')
+        cls.contribuables = Contribuable.objects.bulk_create([
+            Contribuable(
+                nom=f"Contribuable {i}", type_contribuable='morale' if i % 3 else 'physique',
+                adresse="Mbour", telephone="771234567", reference=f"C{i:05d}",
+            )
+            for i in range(100)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _creer_paiements(self, nombre, debut=0):
+        # bulk_create : pas de save(), les cumuls ne servent pas ici
+        Paiement.objects.bulk_create(
+            (
+                Paiement(
+                    contribuable=self.contribuables[i % 100], montant=Decimal('1000'), mode_paiement='ESP',
+                    date_paiement=date(2026, 1, 1) + timedelta(days=i % 365), date_echeance=date(2026, 6, 30),
+                    reference=f"P{i:06d}",
+                )
+                for i in range(debut, debut + nombre)
+            ),
+            batch_size=2000,
+        )
+
+    def _requetes(self, parametres=''):
+        with CaptureQueriesContext(connection) as requetes:
+            response = self.client.get(self.url + parametres)
+        self.assertEqual(response.status_code, 200)
+        return len(requetes)
+
+    def test_liste_en_requetes_constantes(self):
+        self._creer_paiements(10)
+        petit = self._requetes()
+        petit_filtre = self._requetes('?type_contribuable=morale')
+        self.assertLessEqual(petit, self.budget)
+
+        self._creer_paiements(9990, debut=10)
+        self.assertEqual(self._requetes(), petit)
+        self.assertEqual(self._requetes('?type_contribuable=morale'), petit_filtre)
+
+
+class ContribuableAdminRequetesTests(TestCase):
+    """La liste admin des contribuables coûte autant de requêtes à 500 lignes qu'à 5."""
+
+    url = '/admin/gestion_contribuables/contribuable/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@retam.sn', 'x')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _creer(self, nombre, debut=0):
+        contribuables = Contribuable.objects.bulk_create([
+            Contribuable(
+                nom=f"Contribuable {i}", type_contribuable='physique', adresse="Mbour",
+                telephone="771234567", reference=f"C{i:05d}",
+            )
+            for i in range(debut, debut + nombre)
+        ])
+        Paiement.objects.bulk_create([
+            Paiement(
+                contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                date_paiement=date(2026, 3, 1), date_echeance=date(2026, 2, 28), reference=f"P{contribuable.pk}",
+            )
+            for contribuable in contribuables
+        ])
+        HistoriqueModification.objects.bulk_create([
+            HistoriqueModification(contribuable=contribuable, action='CREATE', details={})
+            for contribuable in contribuables
+        ])
+
+    def _requetes(self, parametres=''):
+        with CaptureQueriesContext(connection) as requetes:
+            response = self.client.get(self.url + parametres)
+        self.assertEqual(response.status_code, 200)
+        return requetes
+
+    def test_liste_en_requetes_constantes(self):
+        self._creer(5)
+        petit = len(self._requetes())
+        petit_filtre = len(self._requetes('?en_retard=oui'))
+
+        self._creer(495, debut=5)
+        self.assertEqual(len(self._requetes()), petit)
+        self.assertEqual(len(self._requetes('?en_retard=oui')), petit_filtre)
+
+    def test_historique_compte_sur_la_fiche_seulement(self):
+        self._creer(3)
+        table = HistoriqueModification._meta.db_table
+        self.assertFalse(any(table in requete['sql'] for requete in self._requetes()))
+
+        fiche = self.client.get(f"{self.url}{Contribuable.objects.first().pk}/change/")
+        self.assertContains(fiche, "1 Modifications")
+
+
+class CompteurBackend(EmailBackend):
+    """Backend locmem qui compte les connexions ouvertes."""
+    connexions = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CompteurBackend.connexions += 1
+
+
+class PanneBackend(EmailBackend):
+    """Backend locmem dont le serveur coupe la connexion à chaque envoi."""
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected("connexion perdue")
+
+
+class CoupureBackend(EmailBackend):
+    """Backend locmem : la connexion tombe au deuxième envoi et le serveur ne répond plus."""
+    ouvertures = 0
+
+    def open(self):
+        CoupureBackend.ouvertures += 1
+        if CoupureBackend.ouvertures > 1:
+            raise ConnectionRefusedError("serveur arrêté")
+        return super().open()
+
+    def send_messages(self, messages):
+        if len(mail.outbox) >= 1:
+            raise smtplib.SMTPServerDisconnected("connexion perdue")
+        return super().send_messages(messages)
+
+
+class ErreurBackend(EmailBackend):
+    """Backend locmem qui plante (erreur non SMTP) après un premier envoi réussi."""
+
+    def send_messages(self, messages):
+        if len(mail.outbox) >= 1:
+            raise RuntimeError("panne inattendue")
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='gestion_contribuables.tests.CompteurBackend',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    NOTIFICATIONS_MAX_PAR_MINUTE=100,
+)
+class BoiteEnvoiTests(TestCase):
+    """Mises en demeure : dédoublonnées à la mise en file, envoyées par lots sur une connexion."""
+
+    @classmethod
+    def setUpTestData(cls):
+        contribuables = Contribuable.objects.bulk_create([
+            Contribuable(
+                nom=f"Contribuable {i}", type_contribuable='physique', adresse="Mbour",
+                telephone="771234567", reference=f"C{i:05d}", email=f"c{i}@exemple.sn",
+                notifier_retards=i != 4,
+            )
+            for i in range(5)
+        ])
+        # deux retards pour chacun, plus un paiement à temps
+        Paiement.objects.bulk_create([
+            Paiement(
+                contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                date_paiement=date(2026, 3, jour), date_echeance=date(2026, 3, 5), reference=f"P{i}{jour:02d}",
+            )
+            for i, contribuable in enumerate(contribuables)
+            for jour in (1, 10, 20)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        CompteurBackend.connexions = 0
+        CoupureBackend.ouvertures = 0
+
+    def test_une_notification_par_contribuable_et_par_jour(self):
+        self.assertEqual(notifier_retards(Paiement.objects.all()), 4)
+        self.assertEqual(notifier_retards(Paiement.objects.all()), 0)
+        # le contribuable 4 a refusé les notifications
+        self.assertEqual(NotificationSortante.objects.count(), 4)
+        self.assertEqual(
+            set(NotificationSortante.objects.values_list('paiement__date_paiement', flat=True)),
+            {date(2026, 3, 10)},
+        )
+
+    def test_envoi_groupe_sur_une_connexion(self):
+        notifier_retards(Paiement.objects.all())
+        self.assertEqual(envoyer_notifications(taille_lot=3), (4, 0))
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(CompteurBackend.connexions, 1)
+        self.assertTrue(mail.outbox[0].subject.startswith("Mise en demeure de paiement"))
+        self.assertFalse(NotificationSortante.objects.exclude(statut=NotificationSortante.ENVOYEE).exists())
+        # rien de plus au passage suivant
+        self.assertEqual(envoyer_notifications(), (0, 0))
+
+    @override_settings(NOTIFICATIONS_MAX_PAR_MINUTE=3)
+    def test_debit_limite(self):
+        notifier_retards(Paiement.objects.all())
+        self.assertEqual(envoyer_notifications(taille_lot=2), (3, 0))
+        self.assertEqual(envoyer_notifications(), (0, 0))
+        self.assertEqual(NotificationSortante.objects.filter(statut=NotificationSortante.EN_ATTENTE).count(), 1)
+
+    @override_settings(EMAIL_BACKEND='gestion_contribuables.tests.CoupureBackend')
+    def test_serveur_injoignable_reporte_le_reste_du_lot(self):
+        notifier_retards(Paiement.objects.all())
+        self.assertEqual(envoyer_notifications(), (1, 3))
+        self.assertEqual(NotificationSortante.objects.filter(statut=NotificationSortante.ENVOYEE).count(), 1)
+        reportees = NotificationSortante.objects.filter(statut=NotificationSortante.EN_ATTENTE)
+        self.assertEqual(reportees.count(), 3)
+        # délai de nouvel essai, pas le bail de réservation
+        self.assertFalse(reportees.filter(prochain_essai__gt=timezone.now() + timedelta(seconds=300)).exists())
+
+    @override_settings(EMAIL_BACKEND='gestion_contribuables.tests.ErreurBackend')
+    def test_envois_reussis_enregistres_malgre_une_erreur(self):
+        notifier_retards(Paiement.objects.all())
+        with self.assertRaises(RuntimeError):
+            envoyer_notifications()
+        self.assertEqual(NotificationSortante.objects.filter(statut=NotificationSortante.ENVOYEE).count(), 1)
+
+    @override_settings(EMAIL_BACKEND='gestion_contribuables.tests.PanneBackend', NOTIFICATIONS_MAX_TENTATIVES=2)
+    def test_nouvel_essai_differe_puis_echec(self):
+        notifier_retards(Paiement.objects.filter(contribuable__reference='C00000'))
+        avant = timezone.now()
+        self.assertEqual(envoyer_notifications(), (0, 1))
+        notification = NotificationSortante.objects.get()
+        self.assertEqual(notification.statut, NotificationSortante.EN_ATTENTE)
+        self.assertEqual(notification.tentatives, 1)
+        self.assertGreater(notification.prochain_essai, avant + timedelta(seconds=50))
+        self.assertIn("connexion perdue", notification.derniere_erreur)
+
+        # pas avant l'échéance du nouvel essai
+        self.assertEqual(envoyer_notifications(), (0, 0))
+        NotificationSortante.objects.update(prochain_essai=timezone.now())
+        envoyer_notifications()
+        self.assertEqual(NotificationSortante.objects.get().statut, NotificationSortante.ECHEC)
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class RelancesTests(TestCase):
+    """Relances nocturnes : palier selon l'ancienneté, un seul envoi par palier et par échéance."""
+
+    @classmethod
+    def setUpTestData(cls):
+        def contribuable(ref, echeance, paye=0, **options):
+            return Contribuable(
+                nom=f"Contribuable {ref}", type_contribuable='physique', adresse="Mbour",
+                telephone="771234567", reference=ref, email=f"{ref.lower()}@exemple.sn",
+                montant_a_payer=Decimal('50000'), total_paye=Decimal(paye), date_echeance=echeance,
+                **options,
+            )
+
+        contribuables = {c.reference: c for c in Contribuable.objects.bulk_create([
+            contribuable('A', date(2026, 4, 20), paye=20000),  # J+11 au 1er mai
+            contribuable('B', date(2026, 3, 15)),  # J+47
+            contribuable('C', date(2026, 4, 28)),  # pas encore relançable
+            contribuable('D', date(2026, 1, 31), paye=50000),  # soldé
+            contribuable('E', date(2026, 1, 31), notifier_retards=False),
+            contribuable('F', date(2026, 1, 31), actif=False),
+            contribuable('G', date(2026, 4, 20), paye=200000),  # à jour des années passées seulement
+        ])}
+        Paiement.objects.bulk_create([
+            Paiement(
+                contribuable=contribuables[ref], montant=Decimal(montant), mode_paiement='ESP',
+                date_paiement=echeance, date_echeance=echeance, reference=f"P{ref}{echeance:%Y}",
+            )
+            for ref, montant, echeance in [
+                ('A', 20000, date(2026, 4, 20)),
+                ('D', 50000, date(2026, 1, 31)),
+                ('G', 200000, date(2025, 4, 20)),
+            ]
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_paliers_et_passages_incrementaux(self):
+        self.assertEqual(lancer_relances(jour=date(2026, 5, 1), taille_lot=1), {1: 2, 2: 1})
+        # reste dû calculé sur les paiements de l'échéance, pas sur total_paye
+        self.assertEqual(
+            set(Relance.objects.values_list('contribuable__reference', 'niveau', 'montant_du')),
+            {('A', 1, Decimal('30000')), ('B', 2, Decimal('50000')), ('G', 1, Decimal('50000'))},
+        )
+        # rien de neuf le lendemain
+        self.assertEqual(lancer_relances(jour=date(2026, 5, 2)), {})
+        # changement de palier
+        self.assertEqual(lancer_relances(jour=date(2026, 5, 20)), {2: 2, 3: 1})
+        self.assertEqual(Relance.objects.count(), 6)
+        self.assertFalse(Relance.objects.filter(notification__isnull=True).exists())
+
+    def test_relance_envoyee_par_la_boite_envoi(self):
+        lancer_relances(jour=date(2026, 5, 1))
+        self.assertEqual(envoyer_notifications(), (3, 0))
+        self.assertEqual(
+            sorted(message.subject for message in mail.outbox),
+            ["Mise en demeure - Contribuable B", "Premier rappel - Contribuable A", "Premier rappel - Contribuable G"],
+        )
+        for message in mail.outbox:
+            html, _ = message.alternatives[0]
+            self.assertNotIn('href=""', html)
+            self.assertIn(Contribuable.objects.get(email=message.to[0]).reference, html)
+
+
+class ExportAdminTests(TestCase):
+    """Export admin : « tout sélectionner » exporte toute la liste filtrée, pas seulement la page."""
+
+    url = '/admin/gestion_contribuables/contribuable/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@retam.sn', 'x')
+        cls.contribuables = Contribuable.objects.bulk_create([
+            Contribuable(
+                nom=f"Contribuable {i}", type_contribuable='physique', actif=i != 2,
+                adresse="Mbour", telephone="771234567", reference=f"C{i:05d}",
+            )
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_confirmation_select_across_exporte_la_liste_filtree(self):
+        donnees = {
+            'action': 'csv_export_selected',
+            'select_across': '1',
+            '_selected_action': [self.contribuables[0].pk],
+        }
+        confirmation = self.client.post(self.url + '?actif__exact=1', donnees)
+        self.assertEqual(confirmation.status_code, 200)
+        self.assertContains(confirmation, 'name="select_across"')
+        self.assertContains(confirmation, f'name="_selected_action" value="{self.contribuables[0].pk}"')
+
+        response = self.client.post(
+            self.url + '?actif__exact=1', {**donnees, 'post': 'yes', 'format': 'csv', '_fields': ['nom']}
+        )
+        self.assertTrue(response.streaming)
+        contenu = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertEqual(contenu.splitlines(), ["Nom", "Contribuable 0", "Contribuable 1"])
+
+
+class ImportContribuablesTests(TestCase):
+    """Import en masse : NIF et référence facultatifs ne comptent pas comme doublons quand ils sont vides."""
+
+    def test_lignes_sans_nif(self):
+        Contribuable.objects.create(
+            nom="Existant", type_contribuable='physique', adresse="Mbour", telephone="771234567", nif=None,
+        )
+        existant = Contribuable.objects.get()
+        fichier = BytesIO((
+            "nom;type_contribuable;adresse;telephone;nif;reference\n"
+            "Awa Diop;physique;Mbour;771234567;;\n"
+            "Moussa Sarr;physique;Saly;771234568;;\n"
+            f"Doublon;physique;Saly;771234569;;{existant.reference}\n"
+            "Société X;morale;Mbour;771234560;123ABC;\n"
+        ).encode())
+
+        rapport = importer('contribuables', fichier, 'contribuables.csv')
+
+        self.assertEqual(rapport.importees, 3)
+        self.assertEqual(rapport.erreurs, [(4, f"référence {existant.reference} déjà utilisée")])
+        self.assertEqual(Contribuable.objects.filter(nif__isnull=True).count(), 3)
+
+    def test_references_generees_completees_puis_epuisees(self):
+        existant = Contribuable.objects.create(
+            nom="Existant", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        # la première tirée est déjà prise et répétée : seule la manquante est retirée
+        tirages = iter([existant.reference, existant.reference, "CONTRIB-2026-0001"])
+        fichier = BytesIO((
+            "nom;type_contribuable;adresse;telephone\n"
+            "Awa Diop;physique;Mbour;771234567\n"
+            "Moussa Sarr;physique;Saly;771234568\n"
+        ).encode())
+
+        with patch.object(Contribuable, '_generate_reference', lambda self: next(tirages, existant.reference)):
+            rapport = importer('contribuables', fichier, 'contribuables.csv')
+
+        # une seule référence libre pour deux lignes : l'autre est signalée, pas d'exception
+        self.assertEqual(rapport.importees, 1)
+        self.assertEqual(len(rapport.erreurs), 1)
+        self.assertIn("aucune référence libre", rapport.erreurs[0][1])
+        self.assertTrue(Contribuable.objects.filter(reference="CONTRIB-2026-0001").exists())
+        self.assertEqual(Contribuable.objects.count(), 2)
+
+
+class ListeContribuablesPaginationTests(TestCase):
+    """Liste des contribuables : lien « suivant » en curseur dès la première page."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agent = get_user_model().objects.create_user('agent', password='x')
+        Contribuable.objects.bulk_create([
+            Contribuable(
+                nom=f"Contribuable {i:02d}", type_contribuable='physique',
+                adresse="Mbour", telephone="771234567", reference=f"C{i:05d}",
+            )
+            for i in range(30)
+        ])
+
+    def _liste(self, parametres):
+        request = RequestFactory().get('/contribuables/', parametres)
+        request.user = self.agent
+        return views.ContribuableListView.as_view()(request).context_data
+
+    def test_curseur_depuis_la_premiere_page(self):
+        premiere = self._liste({'actif_only': 'on'})
+        self.assertEqual(len(premiere['contribuables']), 25)
+        self.assertIn('apres=', premiere['url_suivante'])
+        self.assertIn('actif_only=on', premiere['url_suivante'])
+
+        curseur = premiere['curseur_suivant']
+        suite = self._liste({'actif_only': 'on', 'apres': curseur})
+        self.assertEqual([c.nom for c in suite['contribuables']], [f"Contribuable {i}" for i in range(25, 30)])
+        self.assertNotIn('url_suivante', suite)
+        self.assertEqual(suite['url_debut'], '?actif_only=on')
+
+
+class RechercheContribuablesTests(TestCase):
+    """Recherche : sans accents, NIF exact en tête, fautes de frappe, admin et liste publique."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@retam.sn', 'x')
+        Contribuable.objects.bulk_create([
+            Contribuable(nom="Diène Ndiaye", nif="NIF1234", type_contribuable='physique', adresse="Mbour",
+                         telephone="771234567", reference="C00001"),
+            Contribuable(nom="Moussa Diop", nif="NIF12345", type_contribuable='physique', adresse="Thiès",
+                         telephone="770000000", reference="C00002"),
+            Contribuable(nom="Bœuf Service", nif="NIF9", type_contribuable='morale', adresse="Mbour",
+                         telephone="779999999", reference="C00003"),
+        ])
+
+    def _noms(self, terme):
+        from .recherche import rechercher_contribuables
+
+        return [c.nom for c in rechercher_contribuables(Contribuable.objects.all(), terme)]
+
+    def test_plier(self):
+        from .recherche import plier
+
+        self.assertEqual(plier("  Diène "), "DIENE")
+        self.assertEqual(plier("bœuf"), "BOEUF")
+
+    def test_sans_accents_ni_casse(self):
+        self.assertEqual(self._noms("diene"), ["Diène Ndiaye"])
+        self.assertEqual(self._noms("DIÈNE"), ["Diène Ndiaye"])
+        self.assertEqual(self._noms("boeuf"), ["Bœuf Service"])
+
+    def test_nif_exact_en_tete(self):
+        self.assertEqual(self._noms("NIF12345"), ["Moussa Diop"])
+        self.assertEqual(self._noms("nif1234"), ["Diène Ndiaye", "Moussa Diop"])
+
+    def test_faute_de_frappe(self):
+        self.assertEqual(self._noms("ndiayr"), ["Diène Ndiaye"])
+
+    def test_liste_publique(self):
+        request = RequestFactory().get('/contribuables/', {'q': 'diene'})
+        request.user = self.admin
+        contexte = views.ContribuableListView.as_view()(request).context_data
+        self.assertEqual([c.nom for c in contexte['contribuables']], ["Diène Ndiaye"])
+
+    def test_admin(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/gestion_contribuables/contribuable/', {'q': 'diene'})
+        self.assertContains(response, "Diène Ndiaye")
+        self.assertNotContains(response, "Moussa Diop")
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SuiviQuittancesTests(TestCase):
+    """Avancement de « Générer les quittances manquantes », lu sur le statut des paiements."""
+
+    def setUp(self):
+        self.contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+
+    def _paiements(self, *etats):
+        return Paiement.objects.bulk_create([
+            Paiement(
+                contribuable=self.contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28),
+                reference=f"P{i}", statut_quittance=statut, quittance_en_cours_depuis=depuis,
+                quittance_generee=statut == Paiement.QUITTANCE_GENEREE,
+            )
+            for i, (statut, depuis) in enumerate(etats)
+        ])
+
+    def test_avancement(self):
+        from .quittances import _cle_suivi
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@retam.sn', 'x')
+        maintenant = timezone.now()
+        paiements = self._paiements(
+            (Paiement.QUITTANCE_GENEREE, None), (Paiement.QUITTANCE_ERREUR, None),
+            (Paiement.QUITTANCE_EN_COURS, maintenant),
+            # worker tué en plein lot : remis en attente, le suivi peut se terminer
+            (Paiement.QUITTANCE_EN_COURS, maintenant - timedelta(hours=2)),
+        )
+        cache.set(_cle_suivi('abc'), [p.pk for p in paiements])
+        self.client.force_login(admin)
+
+        url = '/admin/gestion_contribuables/contribuable/suivi-quittances/abc/'
+        avancement = self.client.get(url, {'format': 'json'}).json()
+        self.assertEqual(
+            avancement,
+            {'total': 4, 'generees': 1, 'erreurs': 1, 'interrompues': 1, 'restantes': 1, 'termine': False},
+        )
+        self.assertEqual(Paiement.objects.get(pk=paiements[3].pk).statut_quittance, Paiement.QUITTANCE_EN_ATTENTE)
+        self.assertEqual(self.client.get(url.replace('abc', 'inconnu')).status_code, 404)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_sans_file_rien_n_est_lance(self):
+        from .quittances import lancer_quittances_en_masse
+
+        self._paiements((Paiement.QUITTANCE_EN_ATTENTE, None), (Paiement.QUITTANCE_ERREUR, None))
+
+        self.assertEqual(lancer_quittances_en_masse(Paiement.objects.all()), (None, 0, 2))
+        self.assertFalse(Paiement.objects.filter(statut_quittance=Paiement.QUITTANCE_EN_COURS).exists())
+
+    def test_lots_en_file(self):
+        from .quittances import lancer_quittances_en_masse, suivi_quittances
+
+        self._paiements(*[(Paiement.QUITTANCE_EN_ATTENTE, None)] * 3)
+        envois = []
+        with patch('gestion_contribuables.models.mettre_tache_en_file',
+                   side_effect=lambda nom, lot: envois.append(lot) or len(envois) < 2):
+            suivi, planifies, sans_file = lancer_quittances_en_masse(Paiement.objects.all(), taille_lot=2)
+
+        # second lot refusé par la file : remis en attente, hors suivi
+        self.assertEqual((planifies, sans_file), (2, 1))
+        self.assertEqual(suivi_quittances(suivi)['restantes'], 2)
+        self.assertEqual(Paiement.objects.filter(statut_quittance=Paiement.QUITTANCE_EN_ATTENTE).count(), 1)
+
+
+class QuittanceSigneeTests(TestCase):
+    """Lien signé de quittance : ETag sur l'empreinte, 304, plages d'octets."""
+
+    contenu = b"%PDF-1.4 quittance de test " + b"x" * 100
+
+    def setUp(self):
+        import base64
+        import tempfile
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from django.core.signing import TimestampSigner
+
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        reglages = override_settings(MEDIA_ROOT=dossier.name, QUITTANCE_SENDFILE_HEADER='')
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+        nom = default_storage.save('quittances/ab/abcdef.pdf', ContentFile(self.contenu))
+        contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        Paiement.objects.bulk_create([Paiement(
+            contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+            date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28), reference="P1",
+            fichier_quittance=nom, quittance_sha256='abcdef', quittance_taille=len(self.contenu),
+            quittance_generee=True, statut_quittance=Paiement.QUITTANCE_GENEREE,
+        )])
+        self.token = base64.urlsafe_b64encode(TimestampSigner().sign(nom).encode()).decode()
+
+    def _get(self, **entetes):
+        request = RequestFactory().get('/s/quittance/', {'token': self.token}, **entetes)
+        return views.serve_quittance_signed(request)
+
+    def test_etag_sans_last_modified(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"abcdef"')
+        # aucune date ne suit une régénération : validation par l'ETag seul
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(b''.join(response.streaming_content), self.contenu)
+
+    def test_304_si_etag_inchange(self):
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH='"abcdef"').status_code, 304)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH='"autre"').status_code, 200)
+        # If-Modified-Since seul ne suffit plus à obtenir un 304
+        self.assertEqual(self._get(HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT').status_code, 200)
+
+    def test_plages(self):
+        response = self._get(HTTP_RANGE='bytes=0-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, self.contenu[:8])
+        self.assertEqual(response['Content-Range'], f'bytes 0-7/{len(self.contenu)}')
+
+        self.assertEqual(self._get(HTTP_RANGE='bytes=-4').content, self.contenu[-4:])
+        self.assertEqual(self._get(HTTP_RANGE=f'bytes={len(self.contenu)}-').status_code, 416)
+        # If-Range périmé : fichier entier
+        self.assertEqual(self._get(HTTP_RANGE='bytes=0-7', HTTP_IF_RANGE='"autre"').status_code, 200)
+
+
+@override_settings(
+    QUITTANCE_GENERATION='a_la_demande', QUITTANCE_MOTEUR='reportlab', QUITTANCE_SENDFILE_HEADER='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class QuittanceALaDemandeTests(TestCase):
+    """Mode à la demande : rien à l'enregistrement, un seul rendu à la première ouverture."""
+
+    def setUp(self):
+        import base64
+        import tempfile
+        from django.core.signing import TimestampSigner
+
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        reglages = override_settings(MEDIA_ROOT=dossier.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+        contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.paiement = Paiement.objects.create(
+                contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28),
+            )
+        self.token = base64.urlsafe_b64encode(TimestampSigner().sign(str(self.paiement.pk)).encode()).decode()
+
+    def _get(self, **entetes):
+        request = RequestFactory().get('/s/quittance/', {'token': self.token}, **entetes)
+        return views.serve_quittance_signed(request)
+
+    def test_rien_a_l_enregistrement(self):
+        self.paiement.refresh_from_db()
+        self.assertEqual(self.paiement.statut_quittance, Paiement.QUITTANCE_EN_ATTENTE)
+        self.assertFalse(self.paiement.fichier_quittance)
+
+    def test_generee_a_la_premiere_ouverture(self):
+        origine = Paiement.generer_quittance
+        appels = []
+
+        def compter(paiement):
+            appels.append(paiement.pk)
+            return origine(paiement)
+
+        with patch.object(Paiement, 'generer_quittance', compter):
+            premiere = self._get()
+            seconde = self._get()
+
+        self.assertEqual(appels, [self.paiement.pk])
+        self.paiement.refresh_from_db()
+        self.assertEqual(self.paiement.statut_quittance, Paiement.QUITTANCE_GENEREE)
+        for response in (premiere, seconde):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], f'"{self.paiement.quittance_sha256}"')
+        self.assertTrue(b''.join(seconde.streaming_content).startswith(b'%PDF'))
+
+    def test_conditions_if_match(self):
+        etag = self._get()['ETag']
+        self.assertEqual(self._get(HTTP_IF_MATCH='"autre"').status_code, 412)
+        self.assertEqual(self._get(HTTP_IF_MATCH=etag).status_code, 200)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(
+    QUITTANCE_GENERATION='a_la_demande', QUITTANCE_MOTEUR='reportlab',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class QuittanceALaDemandeConcurrenceTests(TransactionTestCase):
+    """Des ouvertures simultanées d'une quittance absente ne produisent qu'un rendu (verrou sur la ligne)."""
+
+    def test_un_seul_rendu(self):
+        import tempfile
+        import threading
+        from django.db import connections
+
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        paiement = Paiement.objects.create(
+            contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+            date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28),
+        )
+        origine = Paiement.generer_quittance
+        appels = []
+        noms = []
+        depart = threading.Barrier(3)
+
+        def lent(instance):
+            appels.append(instance.pk)
+            time.sleep(0.3)  # laisse le temps à l'autre demande d'attendre le verrou
+            return origine(instance)
+
+        def ouvrir():
+            try:
+                depart.wait()
+                noms.append(Paiement.objects.get(pk=paiement.pk).assurer_quittance())
+            finally:
+                connections.close_all()
+
+        with override_settings(MEDIA_ROOT=dossier.name), patch.object(Paiement, 'generer_quittance', lent):
+            fils = [threading.Thread(target=ouvrir) for _ in range(2)]
+            for fil in fils:
+                fil.start()
+            depart.wait()
+            for fil in fils:
+                fil.join(10)
+
+        self.assertEqual(appels, [paiement.pk])
+        self.assertEqual(len(noms), 2)
+        self.assertEqual(noms[0], noms[1])
+
+
+@override_settings(
+    QUITTANCE_GENERATION='a_la_demande',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class QuittanceHTMLCacheTests(TestCase):
+    """Quittance HTML publique : fragment servi du cache, périmé quand le contribuable change."""
+
+    def setUp(self):
+        import base64
+        from django.core.signing import TimestampSigner
+
+        cache.clear()
+        self.contribuable = Contribuable.objects.create(
+            nom="Premier", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.paiement = Paiement.objects.create(
+                contribuable=self.contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28),
+            )
+        self.token = base64.urlsafe_b64encode(TimestampSigner().sign(str(self.paiement.pk)).encode()).decode()
+
+    def _get(self):
+        request = RequestFactory().get('/s/quittance/html/', {'token': self.token})
+        response = views.serve_quittance_html(request)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_second_acces_sans_requete(self):
+        premier = self._get()
+        self.assertIn("Premier", premier)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._get(), premier)
+
+    def test_nouveau_paiement_invalide(self):
+        avant = self._get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Paiement.objects.create(
+                contribuable=self.contribuable, montant=Decimal('500'), mode_paiement='ESP',
+                date_paiement=date(2026, 1, 20), date_echeance=date(2026, 2, 28),
+            )
+        apres = self._get()
+        self.assertNotEqual(apres, avant)
+        self.assertIn("1500", apres)
+
+    def test_contribuable_modifie_invalide(self):
+        self._get()
+        self.contribuable.nom = "Renommé"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contribuable.save()
+        self.assertIn("Renommé", self._get())
+
+    def test_paiement_transfere_invalide(self):
+        self._get()
+        autre = Contribuable.objects.create(
+            nom="Second", type_contribuable='physique', adresse="Thiès", telephone="770000000",
+        )
+        paiement = Paiement.objects.get(pk=self.paiement.pk)
+        paiement.contribuable = autre
+        with self.captureOnCommitCallbacks(execute=True):
+            paiement.save()
+        html = self._get()
+        self.assertIn("Second", html)
+        self.assertNotIn("Premier", html)
+
+
+@override_settings(
+    TABLEAU_DE_BORD_TTL=300,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class TableauDeBordCacheTests(TestCase):
+    """Données du tableau de bord : calculées une fois par génération, périmées par écriture ou TTL."""
+
+    def setUp(self):
+        cache.clear()
+        self.appels = 0
+
+    def _calculer(self):
+        self.appels += 1
+        return {'appel': self.appels}
+
+    def _donnees(self):
+        from .tableau_de_bord import donnees_tableau_de_bord
+
+        return donnees_tableau_de_bord('test', self._calculer)
+
+    def test_calcule_une_fois(self):
+        self.assertEqual(self._donnees(), {'appel': 1})
+        self.assertEqual(self._donnees(), {'appel': 1})
+        self.assertEqual(self.appels, 1)
+
+    def test_ecriture_perime(self):
+        self._donnees()
+        with self.captureOnCommitCallbacks(execute=True):
+            Contribuable.objects.create(
+                nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+            )
+        self.assertEqual(self._donnees(), {'appel': 2})
+
+    def test_ttl_expire(self):
+        from . import tableau_de_bord
+
+        self._donnees()
+        maintenant = time.time()
+        with patch.object(tableau_de_bord.time, 'time', return_value=maintenant + 299):
+            self.assertEqual(self._donnees(), {'appel': 1})
+        with patch.object(tableau_de_bord.time, 'time', return_value=maintenant + 301):
+            self.assertEqual(self._donnees(), {'appel': 2})
+
+    def test_valeur_perimee_pendant_recalcul(self):
+        from .tableau_de_bord import nouvelle_generation
+
+        self._donnees()
+        nouvelle_generation()
+        # un autre processus recalcule : on sert l'ancienne valeur sans calculer
+        cache.add('tableau_de_bord:test:verrou', 1)
+        self.assertEqual(self._donnees(), {'appel': 1})
+        self.assertEqual(self.appels, 1)
+
+        cache.delete('tableau_de_bord:test:verrou')
+        self.assertEqual(self._donnees(), {'appel': 2})
+        self.assertIsNone(cache.get('tableau_de_bord:test:verrou'))
+
+    def test_premier_calcul_verrouille_non_mis_en_cache(self):
+        cache.add('tableau_de_bord:test:verrou', 1)
+        self.assertEqual(self._donnees(), {'appel': 1})
+        self.assertIsNone(cache.get('tableau_de_bord:test'))
+
+
+class FusionPDFTests(TestCase):
+    """La fusion en flux produit un PDF valide, relu par pypdf, avec toutes les pages dans l'ordre."""
+
+    @classmethod
+    def setUpTestData(cls):
+        contribuable = Contribuable.objects.create(
+            nom="Fusion", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        cls.paiements = [
+            Paiement.objects.create(
+                contribuable=contribuable, montant=Decimal(montant), mode_paiement='ESP',
+                date_paiement=date(2026, 3, 10), date_echeance=date(2026, 2, 28), reference=reference,
+            )
+            for montant, reference in (('1000', 'FUS-001'), ('2500', 'FUS-002'), ('4000', 'FUS-003'))
+        ]
+
+    def _fusionner(self, documents):
+        fusion = FusionPDF()
+        return b''.join([fusion.debut(), *(fusion.ajouter(pdf) for pdf in documents), fusion.fin()])
+
+    def test_quittances_fusionnees_relues_par_pypdf(self):
+        renderer = get_renderer('reportlab')
+        documents = [pdf for _, pdf in renderer.render_many(self.paiements)]
+
+        lecteur = PdfReader(BytesIO(self._fusionner(documents)), strict=True)
+
+        self.assertEqual(len(lecteur.pages), 3)
+        for page, paiement in zip(lecteur.pages, self.paiements):
+            self.assertIn(paiement.reference, page.extract_text())
+
+    @staticmethod
+    def _document(*textes):
+        tampon = BytesIO()
+        toile = canvas.Canvas(tampon)
+        for texte in textes:
+            toile.drawString(72, 720, texte)
+            toile.showPage()
+        toile.save()
+        return tampon.getvalue()
+
+    def test_documents_de_plusieurs_pages(self):
+        document = self._document
+        lecteur = PdfReader(
+            BytesIO(self._fusionner([document("A1"), document("B1", "B2"), document("C1")])), strict=True,
+        )
+
+        self.assertEqual([page.extract_text().strip() for page in lecteur.pages], ["A1", "B1", "B2", "C1"])
+
+
+    def test_attributs_herites_du_noeud_pages(self):
+        from pypdf import PdfWriter
+        from pypdf.generic import NameObject, NumberObject
+
+        # producteur qui range /MediaBox, /Resources et /Rotate sur le nœud /Pages
+        ecrivain = PdfWriter(clone_from=PdfReader(BytesIO(self._document("H1", "H2"))))
+        racine = ecrivain._root_object['/Pages']
+        for cle in ('/MediaBox', '/Resources'):
+            racine[NameObject(cle)] = ecrivain.pages[0].raw_get(cle)
+        racine[NameObject('/Rotate')] = NumberObject(90)
+        for page in ecrivain.pages:
+            for cle in ('/MediaBox', '/Resources', '/Rotate'):
+                page.pop(cle, None)
+        tampon = BytesIO()
+        ecrivain.write(tampon)
+
+        lecteur = PdfReader(BytesIO(self._fusionner([self._document("A1"), tampon.getvalue()])), strict=True)
+
+        self.assertEqual([page.extract_text().strip() for page in lecteur.pages], ["A1", "H1", "H2"])
+        for page in lecteur.pages[1:]:
+            # portés par la page elle-même dans la sortie
+            self.assertEqual(page.raw_get('/Rotate'), 90)
+            self.assertIn('/MediaBox', page)
+            self.assertIn('/Resources', page)
+
+    def test_document_illisible_ignore(self):
+        fusion = FusionPDF()
+        morceaux = [fusion.debut(), fusion.ajouter(self._document("A1"))]
+        with self.assertRaises(Exception):
+            fusion.ajouter(b"pas un PDF")
+        morceaux += [fusion.ajouter(self._document("B1")), fusion.fin()]
+
+        lecteur = PdfReader(BytesIO(b''.join(morceaux)), strict=True)
+        self.assertEqual([page.extract_text().strip() for page in lecteur.pages], ["A1", "B1"])
+
+    def test_impression_groupee_signale_les_absentes(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        import tempfile
+        from .admin import _flux_quittances
+
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        with override_settings(MEDIA_ROOT=dossier.name):
+            nom = default_storage.save('quittances/ok.pdf', ContentFile(self._document("OK")))
+
+            def assurer(paiement):
+                return (True, nom) if paiement.reference == 'FUS-001' else (False, "rendu impossible")
+
+            with patch('gestion_contribuables.admin._ensure_quittance_pdf', side_effect=assurer):
+                contenu = b''.join(_flux_quittances(Paiement.objects.select_related('contribuable').order_by('pk')))
+
+        lecteur = PdfReader(BytesIO(contenu), strict=True)
+        self.assertEqual(len(lecteur.pages), 2)
+        recapitulatif = lecteur.pages[-1].extract_text()
+        self.assertIn("2 quittance(s) non incluse(s)", recapitulatif)
+        self.assertIn("FUS-002", recapitulatif)
+        self.assertIn("FUS-003", recapitulatif)
+
+class MigrerQuittancesTests(TestCase):
+    """migrer_quittances : copie, enregistrement en base, puis suppression de l'ancien fichier."""
+
+    contenu = b"%PDF-1.4 ancienne quittance"
+
+    def setUp(self):
+        import tempfile
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        reglages = override_settings(MEDIA_ROOT=dossier.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+        self.stockage = default_storage
+        self.ancien = default_storage.save('quittances/quittance_P1.pdf', ContentFile(self.contenu))
+        contribuable = Contribuable.objects.create(
+            nom="Contribuable", type_contribuable='physique', adresse="Mbour", telephone="771234567",
+        )
+        Paiement.objects.bulk_create([Paiement(
+            contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+            date_paiement=date(2026, 1, 10), date_echeance=date(2026, 2, 28), reference="P1",
+            fichier_quittance=self.ancien,
+        )])
+
+    def test_rangement_par_empreinte(self):
+        import hashlib
+        from django.core.management import call_command
+
+        call_command('migrer_quittances', stdout=StringIO())
+
+        paiement = Paiement.objects.get()
+        empreinte = hashlib.sha256(self.contenu).hexdigest()
+        self.assertEqual(paiement.quittance_sha256, empreinte)
+        self.assertEqual(paiement.fichier_quittance.name, f"quittances/2026/01/{empreinte[:2]}/{empreinte}.pdf")
+        self.assertTrue(self.stockage.exists(paiement.fichier_quittance.name))
+        self.assertFalse(self.stockage.exists(self.ancien))
+
+    def test_interruption_avant_enregistrement(self):
+        from django.core.management import call_command
+
+        with patch.object(Paiement.objects, 'bulk_update', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('migrer_quittances', stdout=StringIO())
+
+        # le paiement pointe toujours vers un fichier présent : la relance le traite
+        self.assertEqual(Paiement.objects.get().fichier_quittance.name, self.ancien)
+        self.assertTrue(self.stockage.exists(self.ancien))
+
+        call_command('migrer_quittances', stdout=StringIO())
+        paiement = Paiement.objects.get()
+        self.assertNotEqual(paiement.quittance_sha256, '')
+        self.assertTrue(self.stockage.exists(paiement.fichier_quittance.name))
+        self.assertFalse(self.stockage.exists(self.ancien))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CELERY_TASK_ALWAYS_EAGER=True,
+)
+class SuppressionMasseTests(TestCase):
+    """Suppression en masse : même résultat que Model.delete(), cumuls compensés, fichiers nettoyés."""
+
+    def setUp(self):
+        import tempfile
+        from django.contrib.gis.geos import Point, Polygon
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from geolocalisation.models import LocalisationContribuable, Zone
+
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        reglages = override_settings(MEDIA_ROOT=dossier.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+        self.stockage = default_storage
+        self.propre = default_storage.save('quittances/aa/propre.pdf', ContentFile(b"%PDF a"))
+        self.partage = default_storage.save('quittances/bb/partage.pdf', ContentFile(b"%PDF b"))
+        zone = Zone.objects.create(nom="Mbour 1", geom=Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0))))
+        self.a, self.b, self.c = [
+            Contribuable.objects.create(
+                nom=nom, type_contribuable='physique', adresse="Mbour", telephone="771234567",
+            )
+            for nom in ("A", "B", "C")
+        ]
+        LocalisationContribuable.objects.create(contribuable=self.a, zone=zone, geom=Point(0.5, 0.5))
+        for i, (contribuable, fichier) in enumerate(
+            [(self.a, self.propre), (self.a, self.partage), (self.b, ''), (self.c, self.partage)]
+        ):
+            paiement = Paiement.objects.create(
+                contribuable=contribuable, montant=Decimal('1000'), mode_paiement='ESP',
+                date_paiement=date(2026, 1, 10 + i), date_echeance=date(2026, 2, 28),
+            )
+            Paiement.objects.filter(pk=paiement.pk).update(fichier_quittance=fichier)
+        notification = NotificationSortante.objects.create(
+            contribuable=self.a, paiement=self.a.paiements.first(), type_notification='relance',
+            cle_deduplication='relance:a', destinataire='a@retam.sn',
+        )
+        Relance.objects.create(
+            contribuable=self.a, date_echeance=date(2026, 2, 28), niveau=1, montant_du=Decimal('500'),
+            notification=notification,
+        )
+        self.cibles = Contribuable.objects.filter(pk__in=[self.a.pk, self.b.pk])
+
+    def test_memes_suppressions_que_model_delete(self):
+        from .suppression import supprimer_contribuables
+
+        with transaction.atomic():
+            compteurs = supprimer_contribuables(self.cibles, taille_lot=1)
+            transaction.set_rollback(True)
+        _, attendus = self.cibles.delete()
+
+        self.assertEqual(
+            {label: nombre for label, nombre in compteurs.items() if nombre},
+            {label: nombre for label, nombre in attendus.items() if nombre},
+        )
+
+    def test_cumuls_et_fichiers(self):
+        from .suppression import supprimer_contribuables
+
+        with self.captureOnCommitCallbacks(execute=True):
+            supprimer_contribuables(self.cibles)
+
+        self.assertEqual(list(Contribuable.objects.values_list('nom', flat=True)), ["C"])
+        restants = Paiement.objects.aggregate(montant=Sum('montant'), nombre=Count('pk'))
+        cumuls = RecetteMensuelle.objects.aggregate(montant=Sum('montant'), nombre=Sum('nombre'))
+        self.assertEqual(cumuls, restants)
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.total_paye, Decimal('1000'))
+        # le PDF encore utilisé par C reste, l'autre part
+        self.assertFalse(self.stockage.exists(self.propre))
+        self.assertTrue(self.stockage.exists(self.partage))
+
+    def test_protect_annule_tout(self):
+        from django.db.models import PROTECT
+        from django.db.models.deletion import ProtectedError
+        from .suppression import supprimer_contribuables
+
+        relation = HistoriqueModification._meta.get_field('contribuable').remote_field
+        with patch.object(relation, 'on_delete', PROTECT), self.assertRaises(ProtectedError):
+            supprimer_contribuables(self.cibles)
+        self.assertEqual(Contribuable.objects.count(), 3)
+        self.assertEqual(Paiement.objects.count(), 4)
+
+    def test_on_delete_non_gere(self):
+        from django.db.models import DO_NOTHING
+        from .suppression import supprimer_contribuables
+
+        relation = Relance._meta.get_field('contribuable').remote_field
+        with patch.object(relation, 'on_delete', DO_NOTHING), self.assertRaises(NotImplementedError):
+            supprimer_contribuables(self.cibles)
+        self.assertEqual(Contribuable.objects.count(), 3)
+
+
+class FauxRedis:
+    """
+    Remplace le RedisCache de django-redis dans CacheDeuxNiveaux : stockage et
+    canal pub/sub partagés entre instances (comme un serveur entre processus),
+    panne simulée par `en_panne`.
+    """
+
+    def __init__(self, serveur):
+        self.serveur = serveur
+        self.client = self
+
+    # --- API RedisCache utilisée par le backend
+    def _verifier(self):
+        if self.serveur.en_panne:
+            raise ConnectionError("Redis injoignable")
+
+    def get(self, key, default=None, version=None):
+        self._verifier()
+        return self.serveur.donnees.get((key, version), default)
+
+    def get_many(self, keys, version=None):
+        self._verifier()
+        return {key: self.serveur.donnees[(key, version)] for key in keys if (key, version) in self.serveur.donnees}
+
+    def set(self, key, value, timeout=None, version=None):
+        self._verifier()
+        self.serveur.donnees[(key, version)] = value
+
+    def add(self, key, value, timeout=None, version=None):
+        self._verifier()
+        if (key, version) in self.serveur.donnees:
+            return False
+        self.serveur.donnees[(key, version)] = value
+        return True
+
+    def touch(self, key, timeout=None, version=None):
+        self._verifier()
+        return (key, version) in self.serveur.donnees
+
+    def delete(self, key, version=None):
+        self._verifier()
+        return self.serveur.donnees.pop((key, version), None) is not None
+
+    def incr(self, key, delta=1, version=None):
+        self._verifier()
+        if (key, version) not in self.serveur.donnees:
+            raise ValueError(f"Key '{key}' not found")
+        self.serveur.donnees[(key, version)] += delta
+        return self.serveur.donnees[(key, version)]
+
+    def clear(self):
+        self._verifier()
+        self.serveur.donnees.clear()
+
+    def close(self, **kwargs):
+        pass
+
+    # --- client redis-py : publication et abonnement
+    def get_client(self, write=True):
+        return self
+
+    def publish(self, canal, message):
+        self._verifier()
+        for file in self.serveur.abonnes.get(canal, []):
+            file.put({'type': 'message', 'data': message.encode()})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FauxPubSub(self.serveur)
+
+
+class FauxPubSub:
+    def __init__(self, serveur):
+        import queue
+        self.serveur = serveur
+        self.file = queue.Queue()
+
+    def subscribe(self, canal):
+        self.serveur.abonnes.setdefault(canal, []).append(self.file)
+
+    def get_message(self, timeout=0):
+        import queue
+        try:
+            return self.file.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class CacheDeuxNiveauxTests(SimpleTestCase):
+    """Cache à deux niveaux : repli local sans Redis, retour de Redis, invalidations entre processus."""
+
+    def setUp(self):
+        from types import SimpleNamespace
+        from retam import cache_backend
+
+        # chaque test part d'états de processus neufs
+        etats = patch.dict(cache_backend._etats, clear=True)
+        etats.start()
+        self.addCleanup(etats.stop)
+        self.serveur = SimpleNamespace(donnees={}, abonnes={}, en_panne=False)
+
+    def _cache(self, processus='a', redis=True, **options):
+        from retam.cache_backend import CacheDeuxNiveaux
+
+        # serveur différent = état local différent : simule un autre processus
+        cache_local = CacheDeuxNiveaux(f'faux://{processus}' if redis else '', {
+            'TIMEOUT': 300, 'OPTIONS': {'LOCAL_TIMEOUT': 60, 'REDIS_RETRY': 30, **options},
+        })
+        cache_local._redis = FauxRedis(self.serveur) if redis else None
+        return cache_local
+
+    def _attendre(self, condition):
+        limite = time.monotonic() + 3
+        while not condition():
+            if time.monotonic() > limite:
+                self.fail("condition non atteinte")
+            time.sleep(0.02)
+
+    def test_local_seul_add_et_incr(self):
+        local = self._cache(redis=False)
+        self.assertTrue(local.add('compteur', 0, 60))
+        self.assertFalse(local.add('compteur', 5, 60))
+        self.assertEqual(local.incr('compteur'), 1)
+        self.assertEqual(local.incr('compteur', 2), 3)
+        self.assertEqual(local.get('compteur'), 3)
+        with self.assertRaises(ValueError):
+            local.incr('absent')
+
+    def test_incr_local_conserve_l_expiration(self):
+        local = self._cache(redis=False)
+        local.add('fenetre', 0, 60)
+        depart = time.monotonic()
+        with patch('retam.cache_backend.time.monotonic', return_value=depart + 30):
+            self.assertEqual(local.incr('fenetre'), 1)
+        # la fenêtre de 60 s n'est pas rallongée par l'incrément
+        with patch('retam.cache_backend.time.monotonic', return_value=depart + 61):
+            self.assertIsNone(local.get('fenetre'))
+
+    def test_repli_local_puis_retour_de_redis(self):
+        cache_a = self._cache()
+        cache_a.set('cle', 'avant')
+        self.assertEqual(self.serveur.donnees[('cle', None)], 'avant')
+
+        self.serveur.en_panne = True
+        cache_a.set('cle', 'pendant la panne')
+        self.assertEqual(cache_a.get('cle'), 'pendant la panne')
+        self.assertTrue(cache_a.add('nouvelle', 1))
+        self.assertFalse(cache_a.add('nouvelle', 2))
+
+        # Redis revient après REDIS_RETRY : la copie locale faite sans lui est oubliée
+        self.serveur.en_panne = False
+        self.serveur.donnees[('cle', None)] = 'valeur Redis'
+        with patch('retam.cache_backend.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(cache_a.get('cle'), 'valeur Redis')
+        self.assertEqual(cache_a._etat.hors_ligne_jusqua, 0.0)
+
+    def test_invalidation_entre_processus(self):
+        cache_a, cache_b = self._cache('a'), self._cache('b')
+        cache_a.set('cle', 1)
+        self.assertEqual(cache_b.get('cle'), 1)  # copie locale dans b
+        self._attendre(lambda: len(self.serveur.abonnes.get(cache_a._canal, [])) == 2)
+
+        cache_a.set('cle', 2)
+        self._attendre(lambda: cache_b.get('cle') == 2)
+
+        cache_a.delete('cle')
+        self._attendre(lambda: cache_b.get('cle') is None)
+
+    def test_incr_redis_invalide_les_copies(self):
+        cache_a, cache_b = self._cache('a'), self._cache('b')
+        cache_a.set('compteur', 1)
+        self.assertEqual(cache_b.get('compteur'), 1)
+        self._attendre(lambda: len(self.serveur.abonnes.get(cache_a._canal, [])) == 2)
+
+        self.assertEqual(cache_a.incr('compteur'), 2)
+        self._attendre(lambda: cache_b.get('compteur') == 2)
@@ -19,6 +19,7 @@ urlpatterns = [
     # API Endpoints
     path('api/zones/geojson/', views.zones_geojson, name='zones_geojson'),
     path('admin/dashboard_stats/', views.dashboard_stats, name='dashboard_stats'),
+    path('api/recettes/serie/', views.serie_recettes_api, name='serie_recettes'),
 
     # Autres URLs
     path('historique/<int:pk>/', views.historique_contribuable, name='historique_contribuable'),
@@ -1,5 +1,6 @@
 # gestion_contribuables/views.py
 from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
 from django.http import JsonResponse, FileResponse, HttpResponseForbidden, Http404, HttpResponse
 from django.urls import reverse_lazy, reverse
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
@@ -8,23 +9,30 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
-from django.db.models.functions import TruncMonth
-from django.db.models import Sum, Count, Exists, OuterRef, F, Avg, Q
+from django.db.models import Sum, Count, Exists, OuterRef, F, Q
 from django.core import serializers
 from django.core.serializers import serialize
 from urllib.parse import quote_plus
-from io import BytesIO
 import json
 import base64
-import qrcode
+import logging
 from .models import Contribuable, Paiement, HistoriqueModification
 from .forms import ContribuableForm, PaiementForm, ContribuableSearchForm
+from .recettes import (
+    recettes, mois_entiers, mensuel_recettes, mensuel_paiements, totaliser,
+)
+from .series import serie_recettes, SerieInvalide, DECOUPAGES
+from .pagination import EstimatedCountPaginator
+from .recherche import rechercher_contribuables
+from .tableau_de_bord import donnees_tableau_de_bord
+from .quittances import qr_base64, qr_png_base64, quittance_html_en_cache, mettre_quittance_html_en_cache
 from geolocalisation.models import Zone, LocalisationContribuable
 from django.utils.dateparse import parse_date
 from datetime import timedelta
 from django.core.signing import TimestampSigner, BadSignature, SignatureExpired
 from django.http import FileResponse, HttpResponseForbidden, Http404
 from django.core.files.storage import default_storage
+from django.conf import settings
 
 class PaiementCreateView(LoginRequiredMixin, CreateView):
     model = Paiement
@@ -39,10 +47,7 @@ class PaiementCreateView(LoginRequiredMixin, CreateView):
         return response
 
 def generate_qr_code(data):
-    qr = qrcode.make(data)
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode()
+    return qr_png_base64(data)
 
 @staff_member_required
 def zones_geojson(request):
@@ -71,26 +76,50 @@ def dashboard_stats(request):
             # QuerySets de base
             contribuables = Contribuable.objects.all()
             paiements = Paiement.objects.all()  # Ajout de cette ligne
-           
+            axes = {}
+
+            debut = parse_date(filters['debut']) if filters['debut'] else None
+            fin = parse_date(filters['fin']) if filters['fin'] else None
+            if (filters['debut'] and not debut) or (filters['fin'] and not fin):
+                raise ValueError("Date invalide (AAAA-MM-JJ attendu)")
 
             # Appliquer les filtres
             if filters['type'] and filters['type'] != "all":
                 contribuables = contribuables.filter(type_contribuable=filters['type'])
                 paiements = paiements.filter(contribuable__type_contribuable=filters['type'])
+                axes['type_contribuable'] = filters['type']
             if filters['zone'] and filters['zone'] != "all":
                 contribuables = contribuables.filter(localisation__zone__id=filters['zone'])
                 paiements = paiements.filter(contribuable__localisation__zone__id=filters['zone'])
-            if filters['debut']:
-                contribuables = contribuables.filter(date_creation__gte=filters['debut'])
-                paiements = paiements.filter(date_paiement__gte=filters['debut'])
-            if filters['fin']:
-                contribuables = contribuables.filter(date_creation__lte=filters['fin'])
-                paiements = paiements.filter(date_paiement__lte=filters['fin'])
-
-            # Calcul des statistiques
-            paiements_a_temps = paiements.filter(date_paiement__lte=F('date_echeance')).count()
-            paiements_en_retard = paiements.filter(date_paiement__gt=F('date_echeance')).count()
-            total_paiements = paiements.count()
+                axes['zone'] = int(filters['zone'])
+            if debut:
+                contribuables = contribuables.filter(date_inscription__gte=debut)
+                paiements = paiements.filter(date_paiement__gte=debut)
+            if fin:
+                contribuables = contribuables.filter(date_inscription__lte=fin)
+                paiements = paiements.filter(date_paiement__lte=fin)
+
+            # Une requête d'agrégats conditionnels par source :
+            # mois entiers -> table de cumul, période au jour près -> paiements
+            periode = mois_entiers(debut, fin)
+            if periode is not None:
+                par_mois = mensuel_recettes(recettes(*periode, **axes))
+            else:
+                par_mois = mensuel_paiements(paiements)
+            totaux = totaliser(par_mois)
+
+            compteurs = contribuables.aggregate(
+                total=Count('id'),
+                actifs=Count('id', filter=Q(actif=True)),
+            )
+            recents = paiements.aggregate(
+                paiements_mois=Sum('montant', filter=Q(date_paiement__gte=timezone.now() - timedelta(days=30))),
+                retards=Count('id', filter=Q(date_echeance__lt=timezone.now(), date_paiement__isnull=True)),
+            )
+
+            paiements_a_temps = totaux['nombre_a_temps']
+            paiements_en_retard = totaux['nombre_en_retard']
+            total_paiements = totaux['nombre']
 
             # Récupérer les 12 derniers mois (du plus ancien au plus récent)
             now = timezone.now()
@@ -99,22 +128,10 @@ def dashboard_stats(request):
                 month = (now - relativedelta(months=i)).replace(day=1)
                 months.append(month)
 
-            # Paiements groupés par mois
-            paiements = (
-                paiements
-                .annotate(mois=TruncMonth('date_paiement'))
-                .values('mois')
-                .annotate(montant=Sum('montant'), count=Count('id'))
-            )
-
-            # Indexer par mois
-            paiements_dict = {p['mois'].strftime('%Y-%m'): p for p in paiements if p['mois']}
-
             # Générer la liste complète
             montant_par_mois = []
             for month in months:
-                key = month.strftime('%Y-%m')
-                p = paiements_dict.get(key)
+                p = par_mois.get(month.date())
                 montant_par_mois.append({
                     'mois': month.strftime('%Y-%m-01'),
                     'montant': p['montant'] if p else 0,
@@ -122,19 +139,14 @@ def dashboard_stats(request):
                 })
 
             stats = {
-                "total_contribuables": contribuables.count(),
-                "contribuables_actifs": contribuables.filter(actif=True).count(),
-                "paiements_mois": paiements.filter(
-                    date_paiement__gte=timezone.now() - timedelta(days=30)
-                ).aggregate(total=Sum('montant'))['total'] or 0,
-                "retards": paiements.filter(
-                    date_echeance__lt=timezone.now(),
-                    date_paiement__isnull=True
-                ).count(),
+                "total_contribuables": compteurs['total'],
+                "contribuables_actifs": compteurs['actifs'],
+                "paiements_mois": recents['paiements_mois'] or 0,
+                "retards": recents['retards'],
                 "taux_recouvrement": round(paiements_a_temps / total_paiements * 100) if total_paiements > 0 else 0,
                 "paiements_a_temps": paiements_a_temps,
                 "paiements_en_retard": paiements_en_retard,
-                "montant_moyen": paiements.aggregate(avg=Avg('montant'))['avg'] or 0,
+                "montant_moyen": totaux['montant'] / total_paiements if total_paiements else 0,
                 "montants_par_mois": montant_par_mois,
                 "success": True
             }
@@ -149,18 +161,6 @@ def dashboard_stats(request):
 def admin_dashboard(request):
     """Vue simplifiée du tableau de bord admin sans filtres"""
     # QuerySets de base - on garde les 12 derniers mois par défaut
-    date_debut = timezone.now() - relativedelta(months=11)
-    paiements = Paiement.objects.filter(date_paiement__gte=date_debut)
-
-    # Regrouper par mois
-    paiements_par_mois = (
-        paiements
-        .annotate(mois=TruncMonth('date_paiement'))
-        .values('mois')
-        .annotate(montant=Sum('montant'), count=Count('id'))
-        .order_by('mois')
-    )
-
     # Générer la liste des 12 derniers mois
     months = []
     now = timezone.now()
@@ -168,13 +168,12 @@ def admin_dashboard(request):
         month = (now - relativedelta(months=i)).replace(day=1)
         months.append(month)
 
-    # Créer un dict pour accès rapide
-    paiements_dict = {p['mois'].strftime('%Y-%m'): p for p in paiements_par_mois if p['mois']}
+    # Regrouper par mois (table de cumul mensuelle)
+    paiements_dict = mensuel_recettes(recettes(debut=months[0].date()))
 
     montant_par_mois = []
     for month in months:
-        key = month.strftime('%Y-%m')
-        p = paiements_dict.get(key)
+        p = paiements_dict.get(month.date())
         montant_par_mois.append({
             'mois': month.strftime('%B %Y'),
             'montant': p['montant'] if p else 0,
@@ -190,7 +189,9 @@ class ContribuableListView(LoginRequiredMixin, ListView):
     model = Contribuable
     template_name = 'gestion_contribuables/contribuable_list.html'
     paginate_by = 25
+    paginator_class = EstimatedCountPaginator
     context_object_name = 'contribuables'
+    curseur_suivant = None
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -198,10 +199,7 @@ class ContribuableListView(LoginRequiredMixin, ListView):
         
         if form.is_valid():
             if form.cleaned_data.get('q'):
-                queryset = queryset.filter(
-                    Q(nom__icontains=form.cleaned_data['q']) |
-                    Q(nif__icontains=form.cleaned_data['q'])
-                )
+                queryset = rechercher_contribuables(queryset, form.cleaned_data['q'])
             if form.cleaned_data.get('actif_only'):
                 queryset = queryset.filter(actif=True)
             if form.cleaned_data.get('en_retard'):
@@ -216,26 +214,54 @@ class ContribuableListView(LoginRequiredMixin, ListView):
         
         return queryset.prefetch_related('paiements')
 
+    def paginate_queryset(self, queryset, page_size):
+        # ?apres=<curseur> : page suivante par clé de tri, sans OFFSET
+        curseur = self.request.GET.get('apres')
+        if curseur is None:
+            paginator, page, objets, pagine = super().paginate_queryset(queryset, page_size)
+            # lien « suivant » en curseur dès la première page
+            if page.has_next() and page.object_list:
+                self.curseur_suivant = paginator.curseur_apres(list(page.object_list)[-1])
+            return paginator, page, objets, pagine
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            objets, self.curseur_suivant = paginator.page_apres(curseur)
+        except ValueError:
+            raise Http404("Curseur de pagination invalide")
+        return (paginator, None, objets, True)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_form'] = ContribuableSearchForm(self.request.GET)
         context['stats'] = self.calculate_stats()
+        context['curseur_suivant'] = self.curseur_suivant
+        if self.curseur_suivant:
+            parametres = self.request.GET.copy()
+            parametres.pop('page', None)
+            parametres['apres'] = self.curseur_suivant
+            context['url_suivante'] = '?' + parametres.urlencode()
+        if 'apres' in self.request.GET:
+            parametres = self.request.GET.copy()
+            del parametres['apres']
+            context['url_debut'] = '?' + parametres.urlencode()
         return context
 
     def calculate_stats(self):
-        queryset = self.get_queryset()
-        return {
-            'total': queryset.count(),
-            'actifs': queryset.filter(actif=True).count(),
-            'en_retard': queryset.annotate(
-                a_retard=Exists(
+        # une seule requête ; sans filtre, mise en cache jusqu'à la prochaine écriture
+        def calculer():
+            return self.get_queryset().aggregate(
+                total=Count('id'),
+                actifs=Count('id', filter=Q(actif=True)),
+                en_retard=Count('id', filter=Exists(
                     Paiement.objects.filter(
                         contribuable=OuterRef('pk'),
                         date_paiement__gt=F('date_echeance')
                     )
-                )
-            ).filter(a_retard=True).count()
-        }
+                )),
+            )
+        if any(self.request.GET.get(champ) for champ in ('q', 'actif_only', 'en_retard')):
+            return calculer()
+        return donnees_tableau_de_bord('liste_contribuables', calculer)
 
 class ContribuableCreateView(LoginRequiredMixin, CreateView):
     model = Contribuable
@@ -319,6 +345,12 @@ def fiche_contribuable(request, pk):
 def quittance_paiement(request, paiement_id):
     paiement = get_object_or_404(Paiement, pk=paiement_id)
 
+    # première consultation : la quittance est produite maintenant (une seule fois)
+    try:
+        paiement.assurer_quittance()
+    except Exception:
+        logging.getLogger(__name__).exception("Erreur génération quittance %s", paiement.pk)
+
     # Récupère l'URL publique du fichier PDF (champ FileField : fichier_quittance)
     file_url = ''
     file_field = getattr(paiement, 'fichier_quittance', None)
@@ -386,31 +418,63 @@ def repartition_stats(request):
 @staff_member_required
 def stats_contribuables(request):
     """Stats détaillées sur les contribuables"""
-    date_debut = timezone.now() - timedelta(days=365)
-    
+    # deux requêtes en tout : compteurs des contribuables, puis la table de cumul mensuelle
+    compteurs = Contribuable.objects.aggregate(
+        total=Count('id'),
+        actifs=Count('id', filter=Q(actif=True)),
+        inactifs=Count('id', filter=Q(actif=False)),
+    )
+    par_mois = mensuel_recettes(recettes())
+    totaux = totaliser(par_mois)
+
     stats = {
-        "total_contribuables": Contribuable.objects.count(),
-        "contribuables_actifs": Contribuable.objects.filter(actif=True).count(),
-        "contribuables_inactifs": Contribuable.objects.filter(actif=False).count(),
-        "paiements_totaux": Paiement.objects.aggregate(Sum('montant'))['montant__sum'] or 0,
-        "paiements_a_temps": Paiement.objects.filter(date_paiement__lte=F('date_echeance')).count(),
-        "paiements_en_retard": Paiement.objects.filter(date_paiement__gt=F('date_echeance')).count(),
+        "total_contribuables": compteurs['total'],
+        "contribuables_actifs": compteurs['actifs'],
+        "contribuables_inactifs": compteurs['inactifs'],
+        "paiements_totaux": totaux['montant'],
+        "paiements_a_temps": totaux['nombre_a_temps'],
+        "paiements_en_retard": totaux['nombre_en_retard'],
         "taux_recouvrement": round(
-            Paiement.objects.filter(date_paiement__lte=F('date_echeance')).count() /
-            Paiement.objects.count() * 100
-        ) if Paiement.objects.count() > 0 else 0,
-        "montant_moyen_paiement": Paiement.objects.aggregate(avg=Avg('montant'))['avg'] or 0,
-        "montants_par_mois": list(
-            Paiement.objects
-            .annotate(mois=TruncMonth('date_paiement'))
-            .values('mois')
-            .annotate(montant=Sum('montant'), count=Count('id'))
-            .order_by('mois')
-        ),
+            totaux['nombre_a_temps'] / totaux['nombre'] * 100
+        ) if totaux['nombre'] > 0 else 0,
+        "montant_moyen_paiement": totaux['montant'] / totaux['nombre'] if totaux['nombre'] else 0,
+        "montants_par_mois": [
+            {'mois': mois, 'montant': item['montant'], 'count': item['count']}
+            for mois, item in sorted(par_mois.items())
+        ],
     }
 
     return JsonResponse(stats)
 
+
+@staff_member_required
+def serie_recettes_api(request):
+    """
+    Série des recettes pour les graphiques.
+    GET pas=jour|semaine|mois|annee, debut, fin (AAAA-MM-JJ, 12 derniers mois par défaut),
+    par=taxe|mode|zone|type, et filtres taxe, mode, zone, type.
+    """
+    try:
+        pas = request.GET.get('pas', 'mois')
+        fin = parse_date(request.GET['fin']) if request.GET.get('fin') else timezone.now().date()
+        if request.GET.get('debut'):
+            debut = parse_date(request.GET['debut'])
+        else:
+            debut = (fin - relativedelta(months=11)).replace(day=1)
+        if debut is None or fin is None:
+            raise SerieInvalide("dates attendues au format AAAA-MM-JJ")
+        filtres = {
+            colonne: request.GET[param]
+            for param, colonne in DECOUPAGES.items() if request.GET.get(param)
+        }
+        if 'zone' in filtres:
+            filtres['zone'] = int(filtres['zone'])
+        donnees = serie_recettes(debut, fin, pas=pas, par=request.GET.get('par') or None, filtres=filtres)
+    except ValueError as e:
+        # SerieInvalide, date impossible (parse_date) ou zone non numérique
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(donnees)
+
 def serve_quittance_signed(request):
     signer = TimestampSigner()
     token_b64 = request.GET.get('token', '')
@@ -427,14 +491,128 @@ def serve_quittance_signed(request):
     except BadSignature:
         return HttpResponseForbidden("Signature invalide")
 
+    # token = signer.sign(str(paiement.pk)) : quittance produite à la première ouverture
+    champs = ('pk', 'date_paiement', 'statut_quittance',
+              'fichier_quittance', 'quittance_sha256', 'quittance_taille')
+    if name.isdigit():
+        paiement = get_object_or_404(Paiement.objects.only(*champs), pk=int(name))
+        try:
+            name = paiement.assurer_quittance()
+        except Exception:
+            logging.getLogger(__name__).exception("Erreur génération quittance %s", paiement.pk)
+            raise Http404("Quittance indisponible")
+    else:
+        # ancien lien signé sur le nom du fichier (index paiement_fichier_quittance_idx)
+        paiement = Paiement.objects.only(*champs).filter(fichier_quittance=name).first()
+
+    return _reponse_quittance(request, name, paiement)
+
+
+def _plage_demandee(request, taille, etag):
+    """
+    (debut, fin) inclusifs pour un en-tête Range à plage unique, None pour
+    servir le fichier entier, 'invalide' si la plage est hors du fichier.
+    Les demandes multi-plages reçoivent le fichier entier (autorisé par la RFC).
+    """
+    entete = request.META.get('HTTP_RANGE', '')
+    if not entete.startswith('bytes=') or ',' in entete:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+    debut, _, fin = entete[6:].strip().partition('-')
+    try:
+        if not debut:  # bytes=-500 : les 500 derniers octets
+            longueur = int(fin)
+            if longueur <= 0:
+                return 'invalide'
+            return max(taille - longueur, 0), taille - 1
+        debut = int(debut)
+        fin = min(int(fin), taille - 1) if fin else taille - 1
+    except ValueError:
+        return None
+    if debut >= taille or fin < debut:
+        return 'invalide'
+    return debut, fin
+
+
+def _reponse_quittance(request, name, paiement=None):
+    """
+    Sert un PDF de quittance avec ETag (304 si inchangé) et Range.
+    Le fichier étant rangé sous son empreinte, il ne change jamais : l'ETag est
+    l'empreinte, la taille vient de la base. Pas de Last-Modified dans ce cas :
+    aucune date en base ne suit une régénération, un If-Modified-Since
+    donnerait un 304 sur un contenu périmé. Avec QUITTANCE_SENDFILE_HEADER,
+    seuls les en-têtes partent d'ici, le serveur web transfère les octets.
+    """
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from django.utils.http import http_date
+
+    if paiement is not None and paiement.quittance_sha256:
+        empreinte = paiement.quittance_sha256
+        taille = paiement.quittance_taille
+        modifie = None
+    else:
+        # ancien fichier sans empreinte : on se contente d'un stat
+        try:
+            taille = default_storage.size(name)
+            modifie = default_storage.get_modified_time(name)
+        except Exception:
+            raise Http404("Fichier introuvable")
+        empreinte = f"{int(modifie.timestamp()):x}-{taille:x}"
+    etag = f'"{empreinte}"'
+
+    def entetes(resp):
+        resp['ETag'] = etag
+        if modifie is not None:
+            resp['Last-Modified'] = http_date(modifie.timestamp())
+        resp['Accept-Ranges'] = 'bytes'
+        patch_cache_control(resp, private=True, max_age=86400)
+        return resp
+
+    reponse_304 = get_conditional_response(
+        request, etag=etag, last_modified=int(modifie.timestamp()) if modifie else None,
+        response=entetes(HttpResponse()),
+    )
+    if reponse_304.status_code in (304, 412):
+        return reponse_304
+
+    en_tete_sendfile = getattr(settings, 'QUITTANCE_SENDFILE_HEADER', '')
+    if en_tete_sendfile:
+        prefixe = getattr(settings, 'QUITTANCE_SENDFILE_PREFIX', '/media-protege/')
+        resp = HttpResponse(content_type='application/pdf')
+        resp[en_tete_sendfile] = prefixe.rstrip('/') + '/' + name.lstrip('/')
+        resp['Content-Disposition'] = 'inline; filename="quittance.pdf"'
+        return entetes(resp)
+
+    if taille is None:
+        try:
+            taille = default_storage.size(name)
+        except Exception:
+            raise Http404("Fichier introuvable")
+
+    plage = _plage_demandee(request, taille, etag)
+    if plage == 'invalide':
+        resp = HttpResponse(status=416)
+        resp['Content-Range'] = f'bytes */{taille}'
+        return entetes(resp)
+
     try:
         f = default_storage.open(name, 'rb')
     except Exception:
         raise Http404("Fichier introuvable")
 
-    resp = FileResponse(f, content_type='application/pdf')
+    if plage is None:
+        resp = FileResponse(f, content_type='application/pdf')
+    else:
+        debut, fin = plage
+        with f:
+            f.seek(debut)
+            morceau = f.read(fin - debut + 1)
+        resp = HttpResponse(morceau, status=206, content_type='application/pdf')
+        resp['Content-Range'] = f'bytes {debut}-{fin}/{taille}'
     resp['Content-Disposition'] = 'inline; filename="quittance.pdf"'
-    return resp
+    return entetes(resp)
 
 import base64
 from django.core.signing import TimestampSigner, BadSignature, SignatureExpired
@@ -470,24 +648,30 @@ def serve_quittance_html(request):
     except Exception:
         return HttpResponseForbidden("Token invalide")
 
-    paiement = get_object_or_404(Paiement, pk=pk)
+    # les liens partagés sont rouverts souvent (destinataire, aperçus de liens) : fragment en cache
+    variante = request.get_host()
+    html = quittance_html_en_cache(pk, variante)
+    if html is not None:
+        return HttpResponse(html)
+
+    paiement = get_object_or_404(Paiement.objects.select_related('contribuable'), pk=pk)
     contribuable = paiement.contribuable
 
     total_paye = Paiement.objects.filter(contribuable=contribuable).aggregate(total=Sum('montant'))['total'] or 0
 
-    # QR / autres context vars si tu les utilises (ici on laisse vide si tu n'as pas de génération)
-    qr_base64 = getattr(paiement, 'qr_base64', None)
-
     context = {
         'paiement': paiement,
         'contribuable': contribuable,
         'total_paye': total_paye,
         'date_emission': timezone.now().date(),
-        'qr_base64': qr_base64,
+        # QR mis en cache par empreinte du contact (pas d'encodage PNG à chaque ouverture)
+        'qr_base64': qr_base64(contribuable),
         # file_url peut pointer vers PDF signé si tu veux inclure aussi le PDF link
         'file_url': request.build_absolute_uri(request.path)  # placeholder
     }
-    return render(request, "quittance_template.html", context)
+    html = render_to_string("quittance_template.html", context, request=request)
+    mettre_quittance_html_en_cache(paiement, html, variante)
+    return HttpResponse(html)
 
 import json
 from django.views.decorators.http import require_POST
@@ -0,0 +1,7 @@
+# Charger l'application Celery au démarrage de Django pour que @shared_task l'utilise.
+try:
+    from .celery import app as celery_app
+except ImportError:  # celery absent (ex. requirements cPanel minimal)
+    celery_app = None
+
+__all__ = ('celery_app',)
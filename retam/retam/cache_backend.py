@@ -0,0 +1,331 @@
+# retam/cache_backend.py
+"""
+Cache à deux niveaux : LRU borné dans chaque processus, devant Redis.
+
+- Lecture : copie locale si elle a moins de LOCAL_TIMEOUT secondes, sinon
+  Redis, puis copie locale.
+- Écriture / suppression : Redis, copie locale, puis message publié sur un
+  canal Redis pour que les autres processus oublient leur copie.
+- Sans Redis (LOCATION vide, django-redis absent ou serveur injoignable) :
+  le niveau local sert seul, avec les durées demandées. Redis est retenté
+  toutes les REDIS_RETRY secondes ; à son retour la copie locale est vidée.
+
+    CACHES = {'default': {
+        'BACKEND': 'retam.cache_backend.CacheDeuxNiveaux',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'OPTIONS': {'LOCAL_MAX_ENTRIES': 2048, 'LOCAL_TIMEOUT': 5},
+    }}
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+logger = logging.getLogger(__name__)
+
+OPTIONS_LOCALES = ('LOCAL_MAX_ENTRIES', 'LOCAL_TIMEOUT', 'CHANNEL', 'REDIS_RETRY')
+_ABSENT = object()
+# attente maximale d'un message d'invalidation avant de reboucler (secondes)
+ATTENTE_MESSAGE = 1.0
+
+
+def _erreurs_connexion():
+    """Exceptions qui signalent un Redis injoignable (les autres remontent normalement)."""
+    erreurs = [OSError]
+    try:
+        from django_redis.exceptions import ConnectionInterrupted
+        erreurs.append(ConnectionInterrupted)
+    except ImportError:
+        pass
+    try:
+        from redis.exceptions import ConnectionError, TimeoutError
+        erreurs.extend([ConnectionError, TimeoutError])
+    except ImportError:
+        pass
+    return tuple(erreurs)
+
+
+class _LRULocal:
+    """LRU borné, thread-safe ; valeurs picklées comme LocMemCache (pas de partage d'objets mutables)."""
+
+    def __init__(self, taille):
+        self.taille = taille
+        self._donnees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cle):
+        with self._lock:
+            entree = self._donnees.get(cle)
+            if entree is None:
+                return _ABSENT
+            expire, valeur = entree
+            if expire is not None and expire <= time.monotonic():
+                del self._donnees[cle]
+                return _ABSENT
+            self._donnees.move_to_end(cle)
+        return pickle.loads(valeur)
+
+    def set(self, cle, valeur, duree):
+        expire = None if duree is None else time.monotonic() + duree
+        donnees = pickle.dumps(valeur, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._donnees[cle] = (expire, donnees)
+            self._donnees.move_to_end(cle)
+            while len(self._donnees) > self.taille:
+                self._donnees.popitem(last=False)
+
+    def incr(self, cle, delta):
+        """Incrément en place, expiration conservée ; ValueError si la clé est absente."""
+        with self._lock:
+            entree = self._donnees.get(cle)
+            if entree is None or (entree[0] is not None and entree[0] <= time.monotonic()):
+                raise ValueError(f"Key '{cle}' not found")
+            valeur = pickle.loads(entree[1]) + delta
+            self._donnees[cle] = (entree[0], pickle.dumps(valeur, pickle.HIGHEST_PROTOCOL))
+            self._donnees.move_to_end(cle)
+        return valeur
+
+    def delete(self, cle):
+        with self._lock:
+            return self._donnees.pop(cle, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._donnees.clear()
+
+
+class _EtatProcessus:
+    """
+    Niveau local et abonnement, partagés par toutes les instances du processus
+    (Django crée une instance de cache par thread).
+    """
+
+    def __init__(self, taille):
+        self.local = _LRULocal(taille)
+        self.origine = uuid.uuid4().hex
+        self.pid = None
+        self.lock = threading.Lock()
+        self.hors_ligne_jusqua = 0.0
+
+
+_etats = {}
+_etats_lock = threading.Lock()
+
+
+class CacheDeuxNiveaux(BaseCache):
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = dict(params.get('OPTIONS', {}))
+        self._duree_locale = float(options.get('LOCAL_TIMEOUT', 5))
+        self._canal = options.get('CHANNEL', 'retam:cache:invalidation')
+        self._delai_reessai = float(options.get('REDIS_RETRY', 30))
+        with _etats_lock:
+            if (server, self._canal) not in _etats:
+                _etats[(server, self._canal)] = _EtatProcessus(int(options.get('LOCAL_MAX_ENTRIES', 2048)))
+            self._etat = _etats[(server, self._canal)]
+        self._local = self._etat.local
+
+        self._redis = None
+        self._erreurs = _erreurs_connexion()
+        if server:
+            try:
+                from django_redis.cache import RedisCache
+            except ImportError:
+                logger.warning("django-redis absent : cache local uniquement")
+            else:
+                params_redis = dict(params)
+                params_redis['OPTIONS'] = {k: v for k, v in options.items() if k not in OPTIONS_LOCALES}
+                self._redis = RedisCache(server, params_redis)
+
+    # --- Redis : disponibilité et invalidations --------------------------------
+
+    def _redis_disponible(self):
+        if self._redis is None:
+            return False
+        if self._etat.hors_ligne_jusqua:
+            if time.monotonic() < self._etat.hors_ligne_jusqua:
+                return False
+            # Redis de retour : les copies locales faites entre-temps peuvent être périmées
+            self._etat.hors_ligne_jusqua = 0.0
+            self._local.clear()
+        self._demarrer_abonnement()
+        return True
+
+    def _verifier_retour(self):
+        # avant de servir une copie locale : si le délai de panne est écoulé, on
+        # retente Redis (et on vide les copies faites sans lui)
+        if self._etat.hors_ligne_jusqua and time.monotonic() >= self._etat.hors_ligne_jusqua:
+            self._redis_disponible()
+
+    def _panne(self, erreur):
+        if not self._etat.hors_ligne_jusqua:
+            logger.warning("Redis injoignable (%s) : cache local seul pendant %ss", erreur, self._delai_reessai)
+        self._etat.hors_ligne_jusqua = time.monotonic() + self._delai_reessai
+
+    def _appel(self, methode, *args, **kwargs):
+        """Appel au niveau Redis ; _ABSENT si Redis est indisponible."""
+        if not self._redis_disponible():
+            return _ABSENT
+        try:
+            return getattr(self._redis, methode)(*args, **kwargs)
+        except self._erreurs as e:
+            self._panne(e)
+            return _ABSENT
+
+    def _publier(self, cle_locale):
+        if self._redis is None or self._etat.hors_ligne_jusqua:
+            return
+        try:
+            self._redis.client.get_client(write=True).publish(self._canal, f"{self._etat.origine}|{cle_locale}")
+        except self._erreurs as e:
+            self._panne(e)
+
+    def _demarrer_abonnement(self):
+        # un thread par processus ; après un fork (workers gunicorn/celery) il faut le relancer
+        etat = self._etat
+        if etat.pid == os.getpid():
+            return
+        with etat.lock:
+            if etat.pid == os.getpid():
+                return
+            etat.pid = os.getpid()
+            etat.origine = uuid.uuid4().hex
+            self._local.clear()
+            threading.Thread(target=self._ecouter, name='cache-invalidation', daemon=True).start()
+
+    def _ecouter(self):
+        from redis.exceptions import TimeoutError as DelaiRedis
+
+        while True:
+            try:
+                pubsub = self._redis.client.get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._canal)
+                while True:
+                    # attente bornée plutôt que listen() : avec le SOCKET_TIMEOUT court des
+                    # options Redis, un canal calme ferait croire à une coupure
+                    try:
+                        message = pubsub.get_message(timeout=ATTENTE_MESSAGE)
+                    except (DelaiRedis, TimeoutError):
+                        continue
+                    if message is None or message['type'] != 'message':
+                        continue
+                    origine, _, cle = message['data'].decode().partition('|')
+                    if origine == self._etat.origine:
+                        continue
+                    if cle == '*':
+                        self._local.clear()
+                    else:
+                        self._local.delete(cle)
+            except Exception as e:
+                # messages manqués pendant la coupure : on repart d'un niveau local vide
+                logger.debug("Abonnement aux invalidations interrompu : %s", e)
+                self._local.clear()
+                time.sleep(self._delai_reessai)
+
+    def _duree_copie(self, timeout):
+        """Durée de vie de la copie locale : courte si Redis fait foi, complète sinon."""
+        expire = self.get_backend_timeout(timeout)
+        restant = None if expire is None else max(expire - time.time(), 0)
+        if self._redis is None or self._etat.hors_ligne_jusqua:
+            return restant
+        return self._duree_locale if restant is None else min(self._duree_locale, restant)
+
+    # --- API du cache ----------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        self._verifier_retour()
+        valeur = self._local.get(cle)
+        if valeur is not _ABSENT:
+            return valeur
+        valeur = self._appel('get', key, _ABSENT, version=version)
+        if valeur is _ABSENT:
+            return default
+        self._local.set(cle, valeur, self._duree_locale)
+        return valeur
+
+    def get_many(self, keys, version=None):
+        self._verifier_retour()
+        trouves, manquants = {}, []
+        for key in keys:
+            valeur = self._local.get(self.make_and_validate_key(key, version=version))
+            if valeur is _ABSENT:
+                manquants.append(key)
+            else:
+                trouves[key] = valeur
+        if manquants:
+            distants = self._appel('get_many', manquants, version=version)
+            if distants is not _ABSENT:
+                for key, valeur in distants.items():
+                    self._local.set(self.make_and_validate_key(key, version=version), valeur, self._duree_locale)
+                trouves.update(distants)
+        return trouves
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        self._appel('set', key, value, timeout=timeout, version=version)
+        duree = self._duree_copie(timeout)
+        if duree == 0:
+            self._local.delete(cle)
+        else:
+            self._local.set(cle, value, duree)
+        self._publier(cle)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        ajoute = self._appel('add', key, value, timeout=timeout, version=version)
+        if ajoute is _ABSENT:
+            # local seul
+            if self._local.get(cle) is not _ABSENT:
+                return False
+            ajoute = True
+        if ajoute:
+            self._local.set(cle, value, self._duree_copie(timeout))
+            self._publier(cle)
+        return ajoute
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        resultat = self._appel('touch', key, timeout=timeout, version=version)
+        if resultat is _ABSENT:
+            valeur = self._local.get(cle)
+            if valeur is _ABSENT:
+                return False
+            self._local.set(cle, valeur, self._duree_copie(timeout))
+            return True
+        return resultat
+
+    def delete(self, key, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        supprime = self._appel('delete', key, version=version)
+        supprime_local = self._local.delete(cle)
+        self._publier(cle)
+        return supprime_local if supprime is _ABSENT else bool(supprime)
+
+    def incr(self, key, delta=1, version=None):
+        cle = self.make_and_validate_key(key, version=version)
+        valeur = self._appel('incr', key, delta, version=version)
+        if valeur is _ABSENT:
+            # local seul : l'expiration de la clé est conservée (fenêtres de limitation)
+            valeur = self._local.incr(cle, delta)
+        else:
+            self._local.delete(cle)
+            self._publier(cle)
+        return valeur
+
+    def has_key(self, key, version=None):
+        return self.get(key, _ABSENT, version=version) is not _ABSENT
+
+    def clear(self):
+        self._appel('clear')
+        self._local.clear()
+        self._publier('*')
+
+    def close(self, **kwargs):
+        if self._redis is not None:
+            self._redis.close(**kwargs)
@@ -0,0 +1,16 @@
+"""
+Application Celery du projet retam.
+
+Lancée par le Procfile (`celery -A retam worker` / `celery -A retam beat`).
+La configuration est lue depuis settings.py (préfixe CELERY_).
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'retam.settings')
+
+app = Celery('retam')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
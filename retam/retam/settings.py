@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.humanize',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',  # lookups trigrammes (recherche des contribuables)
     'gestion_contribuables',
     'geolocalisation',
     
@@ -226,17 +227,80 @@ if DEBUG:
 DEFAULT_PHONE_COUNTRY_CODE = "221"
 
 # --- CACHE CONFIGURATION ---
+# Cache à deux niveaux (retam/cache_backend.py) : LRU local de chaque processus devant Redis.
+# Redis local par défaut ; CACHE_REDIS_URL définie mais vide (CACHE_REDIS_URL=) :
+# cache local seul (poste de développement, tests).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '/tmp/django_cache_retam',
+        'BACKEND': 'retam.cache_backend.CacheDeuxNiveaux',
+        'LOCATION': os.environ.get('CACHE_REDIS_URL', 'redis://127.0.0.1:6379/1'),
         'TIMEOUT': 300,
+        'KEY_PREFIX': 'retam',
         'OPTIONS': {
-            'MAX_ENTRIES': 1000
+            'LOCAL_MAX_ENTRIES': 2048,
+            'LOCAL_TIMEOUT': 5,
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 0.5,
+            'SOCKET_TIMEOUT': 0.5,
         }
     }
 }
 
+# --- CELERY (tâches en arrière-plan : quittances, notifications) ---
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'))
+# En mono-serveur sans worker, exécuter les tâches immédiatement (CELERY_TASK_ALWAYS_EAGER=True)
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_ACKS_LATE = True
+CELERY_TIMEZONE = TIME_ZONE
+try:
+    from celery.schedules import crontab
+    HORAIRE_RELANCES = crontab(hour=2, minute=0)
+except ImportError:  # celery absent : beat ne tourne pas de toute façon
+    HORAIRE_RELANCES = 24 * 3600.0
+CELERY_BEAT_SCHEDULE = {
+    # rattrape les notifications en attente de nouvel essai
+    'vider-boite-envoi': {
+        'task': 'gestion_contribuables.tasks.envoyer_notifications',
+        'schedule': 60.0,
+    },
+    # relances des échéances impayées (paliers RELANCE_NIVEAUX), la nuit
+    'relances-nocturnes': {
+        'task': 'gestion_contribuables.tasks.lancer_relances',
+        'schedule': HORAIRE_RELANCES,
+    },
+}
+
+# --- NOTIFICATIONS (boîte d'envoi, gestion_contribuables/notifications.py) ---
+# Plafond partagé par tous les workers (limite du relais SMTP)
+NOTIFICATIONS_MAX_PAR_MINUTE = int(os.environ.get('NOTIFICATIONS_MAX_PAR_MINUTE', '120'))
+# Messages réservés et envoyés ensemble sur une même connexion
+NOTIFICATIONS_LOT = int(os.environ.get('NOTIFICATIONS_LOT', '100'))
+NOTIFICATIONS_MAX_TENTATIVES = 5
+# Délai avant le premier nouvel essai (secondes), doublé à chaque échec
+NOTIFICATIONS_DELAI_BASE = 60
+
+# --- QUITTANCES ---
+# Délai (secondes) après lequel l'aperçu admin génère lui-même une quittance restée en file
+QUITTANCE_DELAI_ATTENTE = int(os.environ.get('QUITTANCE_DELAI_ATTENTE', '60'))
+# Délai (secondes) au-delà duquel une quittance « En cours » est tenue pour interrompue
+# (worker arrêté en plein lot) et remise en attente
+QUITTANCE_EN_COURS_DELAI = int(os.environ.get('QUITTANCE_EN_COURS_DELAI', '3600'))
+# 'file' : quittance générée en arrière-plan après chaque paiement ;
+# 'a_la_demande' : générée seulement à la première consultation (la plupart ne sont jamais ouvertes)
+QUITTANCE_GENERATION = os.environ.get('QUITTANCE_GENERATION', 'file')
+# Moteur de rendu PDF : 'weasyprint' (gabarit HTML) ou 'reportlab' (mise en page fixe, bien plus rapide)
+QUITTANCE_MOTEUR = os.environ.get('QUITTANCE_MOTEUR', 'weasyprint')
+# Téléchargements signés : transfert délégué au serveur web frontal.
+# Nginx : 'X-Accel-Redirect' + préfixe d'un location internal (ex. '/media-protege/') ;
+# Apache : 'X-Sendfile' + MEDIA_ROOT. Vide : Django sert le fichier lui-même.
+QUITTANCE_SENDFILE_HEADER = os.environ.get('QUITTANCE_SENDFILE_HEADER', '')
+QUITTANCE_SENDFILE_PREFIX = os.environ.get('QUITTANCE_SENDFILE_PREFIX', '/media-protege/')
+
+# --- TABLEAU DE BORD ---
+# Données de l'index admin en cache jusqu'à la prochaine écriture (paiement, contribuable, zone),
+# et au plus ce nombre de secondes pour les fenêtres glissantes (30 derniers jours)
+TABLEAU_DE_BORD_TTL = int(os.environ.get('TABLEAU_DE_BORD_TTL', '300'))
+
 # --- OPTIMISATIONS SÉCURITÉ ---
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True